@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Benchmark of TaskFinder and Downloader against the local fake Taskcluster service.
+
+It measures the pagination throughput of TaskFinder (items/s and pages/s), and the throughput (MB/s),
+the CPU usage and the peak RSS of Downloader for different artifact sizes and connections.
+Each case runs in a new process, so the peak RSS belongs to that case only.
+
+Usage: python benchmarks/bench_service.py [--sizes MB,...] [--latency SECONDS] [--bandwidth MB] [--error-rate RATE]
+                                          [--json FILE] [--baseline FILE] [--tolerance RATE]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_taskcluster import Artifact, FakeTaskcluster, FakeTaskclusterServer
+from taskcluster_util.util.finder import TaskFinder
+from taskcluster_util.util.downloader import Downloader
+from taskcluster_util.util.resilience import Resilience
+
+_NAMESPACE = 'bench.v2.latest'
+_MB = 1024 * 1024
+
+
+def build_service(namespaces, sizes, page_size):
+    service = FakeTaskcluster(page_size=page_size)
+    for index in range(namespaces):
+        service.add_namespace('{}.listing.ns{:06d}'.format(_NAMESPACE, index))
+    for size in sizes:
+        service.add_task('{}.download.size{}'.format(_NAMESPACE, size), 'task-size{}'.format(size),
+                         [Artifact('public/build/target.bin', size=size * _MB)])
+    # the GZip content is decoded while downloading
+    service.add_task('{}.download.gzip'.format(_NAMESPACE), 'task-gzip',
+                     [Artifact('public/build/target.txt', content='taskcluster ' * (_MB / 2), gzip_encoded=True)])
+    return service
+
+
+def serve(options, port_queue):
+    service = build_service(options.namespaces, options.sizes, options.page_size)
+    server = FakeTaskclusterServer(service, latency=options.latency, bandwidth=options.bandwidth * _MB,
+                                   error_rate=options.error_rate)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _get_usage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is KiB on Linux, and bytes on Mac OS X
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return time.time(), usage.ru_utime + usage.ru_stime, peak_rss
+
+
+def _get_result(started, ended):
+    seconds = ended[0] - started[0]
+    return {
+        'seconds': seconds,
+        'cpu_percent': 100.0 * (ended[1] - started[1]) / seconds,
+        'peak_rss_mb': ended[2] / float(_MB)
+    }
+
+
+def bench_finder(base_url, options):
+    finder = TaskFinder(options={'baseUrl': base_url + '/index/v1'}, resilience=Resilience(backoff=0, rate=0))
+    started = _get_usage()
+    namespaces = finder.get_namespaces('{}.listing'.format(_NAMESPACE), limit=options.page_size, strict=True)
+    result = _get_result(started, _get_usage())
+    pages = -(-len(namespaces) // options.page_size)
+    result.update({
+        'name': 'finder-pagination',
+        'items': len(namespaces),
+        'pages': pages,
+        'items_per_second': len(namespaces) / result['seconds'],
+        'pages_per_second': pages / result['seconds']
+    })
+    return result
+
+
+def bench_downloader(base_url, task_id, artifact_name, connections):
+    dest_dir = tempfile.mkdtemp(prefix='bench_service_')
+    try:
+        downloader = Downloader(options={'baseUrl': base_url + '/queue/v1'}, connections=connections,
+                                show_progress=False, resilience=Resilience(backoff=0, rate=0))
+        started = _get_usage()
+        local_file = downloader.download_latest_artifact(task_id, artifact_name, dest_dir)
+        result = _get_result(started, _get_usage())
+        size = os.path.getsize(local_file)
+    finally:
+        shutil.rmtree(dest_dir, ignore_errors=True)
+    result.update({
+        'name': 'downloader-{}-c{}'.format(task_id, connections),
+        'bytes': size,
+        'connections': connections,
+        'mb_per_second': size / float(_MB) / result['seconds']
+    })
+    return result
+
+
+def _run_case(result_queue, func, args):
+    try:
+        result_queue.put(func(*args))
+    except Exception as e:
+        result_queue.put({'name': func.__name__, 'error': str(e)})
+
+
+def run_case(func, *args):
+    """
+    Run the benchmark case in a new process.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case, args=(result_queue, func, args))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the throughput with the baseline results.
+    @return: the list of regression messages.
+    """
+    baseline_cases = dict((case['name'], case) for case in baseline.get('results', []))
+    regressions = []
+    for case in results:
+        base = baseline_cases.get(case['name'], {})
+        for key in ('items_per_second', 'mb_per_second'):
+            if key in case and base.get(key) and case[key] < base[key] * (1 - tolerance):
+                regressions.append('{} {}: {:.1f} < {:.1f}'.format(case['name'], key, case[key], base[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of TaskFinder and Downloader.')
+    parser.add_argument('--sizes', default='1,16,128',
+                        type=lambda value: [int(size) for size in value.split(',') if size],
+                        help='The artifact sizes in MB (default: 1,16,128)')
+    parser.add_argument('--connections', default='1,4',
+                        type=lambda value: [int(count) for count in value.split(',') if count],
+                        help='The connections of downloading (default: 1,4)')
+    parser.add_argument('--namespaces', type=int, default=5000,
+                        help='The namespaces of pagination benchmark (default: 5000)')
+    parser.add_argument('--page-size', dest='page_size', type=int, default=100,
+                        help='The items per page (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='The seconds before responding each request (default: 0.005)')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='The MB/s of each download connection, 0 for no limit (default: 0)')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0,
+                        help='The probability of the API calls failed with 503 (default: 0)')
+    parser.add_argument('--json', dest='json_file', help='Write the results into JSON file')
+    parser.add_argument('--baseline', help='Compare the throughput with the results JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='The allowed throughput drop from the baseline (default: 0.2)')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(options, port_queue))
+    server.daemon = True
+    server.start()
+    base_url = 'http://127.0.0.1:{}'.format(port_queue.get())
+
+    results = []
+    try:
+        result = run_case(bench_finder, base_url, options)
+        results.append(result)
+        if 'error' not in result:
+            print('{:28} {:10.1f} items/s {:8.1f} pages/s {:8.1f}% CPU'.format(
+                result['name'], result['items_per_second'], result['pages_per_second'], result['cpu_percent']))
+        cases = [('task-size{}'.format(size), 'public/build/target.bin') for size in options.sizes]
+        cases.append(('task-gzip', 'public/build/target.txt'))
+        for task_id, artifact_name in cases:
+            for connections in options.connections:
+                result = run_case(bench_downloader, base_url, task_id, artifact_name, connections)
+                results.append(result)
+                if 'error' not in result:
+                    print('{:28} {:10.1f} MB/s {:8.1f}% CPU {:8.1f} MB RSS'.format(
+                        result['name'], result['mb_per_second'], result['cpu_percent'], result['peak_rss_mb']))
+    finally:
+        server.terminate()
+    for result in results:
+        if 'error' in result:
+            print('{:28} failed: {}'.format(result['name'], result['error']))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        'options': vars(options),
+        'results': results
+    }
+    if options.json_file:
+        with open(options.json_file, 'w') as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as fd:
+            regressions = compare(results, json.load(fd), options.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+    if any('error' in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
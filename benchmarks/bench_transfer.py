@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Benchmark of the download loop against a local HTTP server.
+
+It compares the legacy loop (urllib2, 1 KiB reads, redraw the progress bar per chunk)
+with the transfer engine (pooled session, adaptive reads, throttled progress bar),
+and prints the throughput (MB/s) and the CPU usage of the client.
+
+Usage: python benchmarks/bench_transfer.py [--size MB] [--rounds N] [--json FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import urllib2
+import tempfile
+import BaseHTTPServer
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from progressbar import ProgressBar, Percentage, FileTransferSpeed
+from taskcluster_util.util.transfer import open_url, release_response, ChunkReader, ThrottledProgress
+
+_BLOCK = os.urandom(1024 * 1024)
+
+
+class PayloadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        size = int(self.path.strip('/'))
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        sent = 0
+        while sent < size:
+            block = _BLOCK[:min(len(_BLOCK), size - sent)]
+            self.wfile.write(block)
+            sent += len(block)
+
+
+def serve(port_queue):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), PayloadHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _new_progress(total_length):
+    devnull = open(os.devnull, 'w')
+    return ProgressBar(widgets=[Percentage(), ' ', FileTransferSpeed()], maxval=total_length, fd=devnull).start()
+
+
+def legacy_loop(url, fd, total_length):
+    url_handler = urllib2.urlopen(url)
+    progress = _new_progress(total_length)
+    current_size = 0
+    while True:
+        chunk = url_handler.read(1024)
+        current_size = current_size + len(chunk)
+        if not chunk:
+            break
+        fd.write(chunk)
+        progress.update(current_size)
+    progress.finish()
+
+
+def engine_loop(url, fd, total_length):
+    response = open_url(url)
+    progress = ThrottledProgress(_new_progress(total_length))
+    current_size = 0
+    reader = ChunkReader(response.raw)
+    while True:
+        chunk = reader.read()
+        if not chunk:
+            break
+        current_size = current_size + len(chunk)
+        fd.write(chunk)
+        progress.update(current_size)
+    progress.finish()
+    release_response(response)
+
+
+def measure(loop, url, size):
+    with tempfile.TemporaryFile() as fd:
+        started_times = os.times()
+        started = time.time()
+        loop(url, fd, size)
+        duration = time.time() - started
+        ended_times = os.times()
+    cpu = (ended_times[0] - started_times[0]) + (ended_times[1] - started_times[1])
+    return {
+        'seconds': duration,
+        'mb_per_second': size / 1024.0 / 1024.0 / duration,
+        'cpu_percent': 100.0 * cpu / duration
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the download loop.')
+    parser.add_argument('--size', type=int, default=256, help='The payload size in MB (default: 256)')
+    parser.add_argument('--rounds', type=int, default=3, help='The rounds of each loop (default: 3)')
+    parser.add_argument('--json', dest='json_file', help='Write the results into JSON file')
+    options = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,))
+    server.daemon = True
+    server.start()
+    size = options.size * 1024 * 1024
+    url = 'http://127.0.0.1:{}/{}'.format(port_queue.get(), size)
+
+    results = {}
+    for name, loop in (('legacy', legacy_loop), ('engine', engine_loop)):
+        rounds = [measure(loop, url, size) for _ in range(options.rounds)]
+        best = max(rounds, key=lambda item: item['mb_per_second'])
+        results[name] = best
+        print('{:8} {:10.1f} MB/s {:8.1f}% CPU'.format(name, best['mb_per_second'], best['cpu_percent']))
+    server.terminate()
+
+    if options.json_file:
+        with open(options.json_file, 'w') as fd:
+            json.dump({'size': size, 'results': results}, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+The local stand-in of Taskcluster Index and Queue services, for benchmarks and integration tests.
+
+Index endpoints (under /index/v1):
+  - POST /namespaces/<namespace> (listNamespaces), with limit and continuationToken
+  - POST /tasks/<namespace> (listTasks), with limit and continuationToken
+  - GET /task/<namespace> (findTask)
+
+Queue endpoints (under /queue/v1):
+  - GET /task/<taskId>/artifacts (listLatestArtifacts)
+  - GET /task/<taskId>/artifacts/<name> (getLatestArtifact), redirects to the blob like S3,
+    the blob supports single byte range, If-Range, If-None-Match and GZip content encoding.
+
+The latency, bandwidth and error injection are configurable.
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import socket
+import urllib
+import hashlib
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from StringIO import StringIO
+
+_BLOCK = os.urandom(1024 * 1024)
+_EXPIRES = '2099-01-01T00:00:00.000Z'
+_INDEX_PREFIX = '/index/v1'
+_QUEUE_PREFIX = '/queue/v1'
+_BLOB_PREFIX = '/blobs'
+
+
+class Artifact(object):
+    def __init__(self, name, size=0, content=None, gzip_encoded=False, content_type='application/octet-stream'):
+        """
+        The artifact of task.
+        The content is generated from the random block if it is not given, so large artifacts do not use memory.
+        @param name: the artifact name. e.g. 'public/build/target.zip'.
+        @param size: the size of generated content.
+        @param content: the content.
+        @param gzip_encoded: serve the content with 'Content-Encoding: gzip'.
+        @param content_type: the Content-Type.
+        """
+        self.name = name
+        self.content_type = content_type
+        self.gzip_encoded = gzip_encoded
+        if gzip_encoded:
+            content = content if content is not None else self.read_generated(0, size)
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+                fd.write(content)
+            content = buf.getvalue()
+        self.content = content
+        self.size = len(content) if content is not None else size
+        self.etag = '"{}"'.format(hashlib.sha1('{}:{}'.format(name, self.size)).hexdigest())
+
+    @staticmethod
+    def read_generated(start, end):
+        chunks = []
+        while start < end:
+            offset = start % len(_BLOCK)
+            chunk = _BLOCK[offset:offset + min(len(_BLOCK) - offset, end - start)]
+            chunks.append(chunk)
+            start += len(chunk)
+        return ''.join(chunks)
+
+    def read(self, start, end):
+        """
+        @return: the content of [start, end).
+        """
+        if self.content is not None:
+            return self.content[start:end]
+        return Artifact.read_generated(start, end)
+
+
+class FakeTaskcluster(object):
+    """
+    The namespace tree, tasks and artifacts served by L{FakeTaskclusterServer}.
+    """
+
+    def __init__(self, page_size=1000):
+        """
+        @param page_size: the max items per page, even the request asks for more.
+        """
+        self.page_size = page_size
+        # {namespace: [child name]}, {namespace: [task name]}, {namespace: task dict}, {TaskId: {name: Artifact}}
+        self.namespaces = {'': []}
+        self.task_names = {}
+        self.tasks = {}
+        self.artifacts = {}
+        self._lock = threading.Lock()
+
+    def add_namespace(self, namespace):
+        """
+        Add the namespace and its parents.
+        @param namespace: the namespace. e.g. 'gecko.v2.mozilla-central.latest'.
+        """
+        with self._lock:
+            self._add_namespace(namespace)
+
+    def _add_namespace(self, namespace):
+        parent = ''
+        for name in namespace.split('.'):
+            current = parent + '.' + name if parent else name
+            if current not in self.namespaces:
+                self.namespaces[current] = []
+                self.namespaces[parent].append(name)
+            parent = current
+
+    def add_task(self, namespace, task_id, artifacts=()):
+        """
+        Index the task by namespace.
+        @param namespace: the namespace of task. e.g. 'gecko.v2.mozilla-central.latest.firefox.linux64-opt'.
+        @param task_id: the TaskId.
+        @param artifacts: the L{Artifact} list.
+        """
+        with self._lock:
+            parent, _, name = namespace.rpartition('.')
+            if parent:
+                self._add_namespace(parent)
+            if namespace not in self.tasks:
+                self.task_names.setdefault(parent, []).append(name)
+            self.tasks[namespace] = {'namespace': namespace, 'taskId': task_id, 'rank': 0, 'data': {},
+                                     'expires': _EXPIRES}
+            task_artifacts = self.artifacts.setdefault(task_id, {})
+            for artifact in artifacts:
+                task_artifacts[artifact.name] = artifact
+
+    def _get_page(self, items, payload):
+        limit = min(int(payload.get('limit') or 1000), self.page_size)
+        start = int(payload.get('continuationToken') or 0)
+        ret = {'items': items[start:start + limit]}
+        if start + limit < len(items):
+            ret['continuationToken'] = str(start + limit)
+        return ret
+
+    def list_namespaces(self, namespace, payload):
+        # like the Index, the unknown namespace has an empty listing
+        names = self.namespaces.get(namespace, [])
+        prefix = namespace + '.' if namespace else ''
+        page = self._get_page(names, payload)
+        page['namespaces'] = [{'namespace': prefix + name, 'name': name, 'expires': _EXPIRES}
+                              for name in page.pop('items')]
+        return page
+
+    def list_tasks(self, namespace, payload):
+        prefix = namespace + '.' if namespace else ''
+        names = self.task_names.get(namespace, [])
+        page = self._get_page(names, payload)
+        page['tasks'] = [self.tasks[prefix + name] for name in page.pop('items')]
+        return page
+
+    def find_task(self, namespace):
+        return self.tasks.get(namespace)
+
+    def list_artifacts(self, task_id):
+        artifacts = self.artifacts.get(task_id)
+        if artifacts is None:
+            return None
+        return {'artifacts': [{'storageType': 's3', 'name': artifact.name, 'expires': _EXPIRES,
+                               'contentType': artifact.content_type} for artifact in artifacts.values()]}
+
+    def get_artifact(self, task_id, name):
+        return self.artifacts.get(task_id, {}).get(name)
+
+
+class FakeTaskclusterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    _CHUNK_SIZE = 64 * 1024
+
+    def log_message(self, *args):
+        pass
+
+    def _inject(self):
+        """
+        Wait for the latency, and return True if the error is injected.
+        """
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            failed = server.random.random() < server.error_rate
+            if failed:
+                server.errors += 1
+        if failed:
+            self._send_json(server.error_status, {'message': 'injected error'})
+        return failed
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_not_found(self, what):
+        self._send_json(404, {'message': '[{}] is not found'.format(what)})
+
+    def _read_payload(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or '{}') if length else {}
+
+    @staticmethod
+    def _split(path, prefix):
+        return [urllib.unquote(part) for part in path[len(prefix):].strip('/').split('/')]
+
+    def do_POST(self):
+        path = urlparse.urlparse(self.path).path
+        payload = self._read_payload()
+        if self._inject():
+            return
+        parts = self._split(path, _INDEX_PREFIX)
+        if not path.startswith(_INDEX_PREFIX) or len(parts) != 2 or parts[0] not in ('namespaces', 'tasks'):
+            return self._send_not_found(path)
+        service = self.server.service
+        if parts[0] == 'namespaces':
+            ret = service.list_namespaces(parts[1], payload)
+        else:
+            ret = service.list_tasks(parts[1], payload)
+        self._send_json(200, ret)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path.startswith(_BLOB_PREFIX):
+            # the blob is served by "S3", the errors are injected into the API calls only
+            parts = self._split(path, _BLOB_PREFIX)
+            return self._send_artifact(parts[0], '/'.join(parts[1:]))
+        if self._inject():
+            return
+        service = self.server.service
+        if path.startswith(_INDEX_PREFIX):
+            parts = self._split(path, _INDEX_PREFIX)
+            task = service.find_task(parts[1]) if len(parts) == 2 and parts[0] == 'task' else None
+            return self._send_json(200, task) if task else self._send_not_found(path)
+        if path.startswith(_QUEUE_PREFIX):
+            parts = self._split(path, _QUEUE_PREFIX)
+            if len(parts) == 3 and parts[0] == 'task' and parts[2] == 'artifacts':
+                ret = service.list_artifacts(parts[1])
+                return self._send_json(200, ret) if ret else self._send_not_found(parts[1])
+            if len(parts) >= 4 and parts[0] == 'task' and parts[2] == 'artifacts':
+                task_id, name = parts[1], '/'.join(parts[3:])
+                if self.server.redirect:
+                    location = '{}/{}/{}'.format(_BLOB_PREFIX, task_id, urllib.quote(name))
+                    return self._send_json(303, {'url': location}, {'Location': location})
+                return self._send_artifact(task_id, name)
+        self._send_not_found(path)
+
+    def _get_range(self, artifact):
+        range_header = self.headers.getheader('Range')
+        if_range = self.headers.getheader('If-Range')
+        if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+            return None
+        if if_range and if_range != artifact.etag:
+            return None
+        start, _, end = range_header[len('bytes='):].partition('-')
+        if not start:
+            # the suffix range, e.g. 'bytes=-100'
+            return max(0, artifact.size - int(end)), artifact.size
+        end = min(int(end) + 1, artifact.size) if end else artifact.size
+        return int(start), end
+
+    def _send_artifact(self, task_id, name):
+        artifact = self.server.service.get_artifact(task_id, name)
+        if artifact is None:
+            return self._send_not_found(name)
+        if self.headers.getheader('If-None-Match') == artifact.etag:
+            self.send_response(304)
+            self.send_header('ETag', artifact.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        byte_range = self._get_range(artifact)
+        if byte_range and byte_range[0] >= byte_range[1]:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(artifact.size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = byte_range or (0, artifact.size)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', artifact.content_type)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', artifact.etag)
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, artifact.size))
+        if artifact.gzip_encoded:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self._send_content(artifact, start, end)
+
+    def _send_content(self, artifact, start, end):
+        bandwidth = self.server.bandwidth
+        started = time.time()
+        sent = 0
+        while start + sent < end:
+            chunk = artifact.read(start + sent, min(end, start + sent + FakeTaskclusterHandler._CHUNK_SIZE))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if bandwidth:
+                # sleep until the sent bytes fit the bandwidth of this connection
+                delay = float(sent) / bandwidth - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class FakeTaskclusterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service=None, latency=0, bandwidth=0, error_rate=0, error_status=503, redirect=True, seed=0,
+                 port=0):
+        """
+        @param service: the L{FakeTaskcluster}, an empty one is created if not given.
+        @param latency: the seconds before responding each API call and download.
+        @param bandwidth: the max bytes per second of each download connection, 0 for no limit.
+        @param error_rate: 0-1, the probability of API calls failed with error_status.
+        @param error_status: the status code of injected errors.
+        @param redirect: getLatestArtifact redirects to the blob URL or not.
+        @param seed: the random seed of error injection.
+        @param port: the listening port, 0 for any free port.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeTaskclusterHandler)
+        self.service = service or FakeTaskcluster()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.redirect = redirect
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._connections = set()
+        self._thread = None
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self._connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self._connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # the clients close the connections of the probes and the cancelled downloads
+        if isinstance(sys.exc_info()[1], socket.error):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    @property
+    def index_options(self):
+        """
+        @return: the options of L{TaskFinder}.
+        """
+        return {'baseUrl': self.base_url + _INDEX_PREFIX}
+
+    @property
+    def queue_options(self):
+        """
+        @return: the options of L{Downloader}.
+        """
+        return {'baseUrl': self.base_url + _QUEUE_PREFIX}
+
+    def start(self):
+        """
+        Serve in background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving, and close the keep-alive connections.
+        """
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        # wait for the handler threads of closed connections
+        deadline = time.time() + 1
+        while self._connections and time.time() < deadline:
+            time.sleep(0.01)
+        if self._thread:
+            self._thread.join()
@@ -8,6 +8,7 @@ install_requires = [
     'easygui==0.97.2',
     'taskcluster==0.0.32',
     'progressbar',
+    'requests',
 ]
 
 here = os.path.dirname(os.path.abspath(__file__))
@@ -37,7 +38,7 @@ if __name__ == '__main__':
           author='Askeing Yen',
           author_email='askeing@gmail.com',
           url='https://github.com/askeing/taskcluster-util-python',
-          packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+          packages=find_packages(exclude=['ez_setup', 'examples', 'tests', 'benchmarks', 'benchmarks.*']),
           package_data={},
           install_requires=install_requires,
           zip_safe=False,
@@ -47,5 +48,7 @@ if __name__ == '__main__':
           taskcluster_download = taskcluster_util.taskcluster_download:main
           taskcluster_traverse = taskcluster_util.taskcluster_traverse:main
           taskcluster_login = taskcluster_util.taskcluster_login:main
+          taskcluster_crawl = taskcluster_util.taskcluster_crawl:main
+          taskcluster_serve = taskcluster_util.taskcluster_serve:main
           """,
   )
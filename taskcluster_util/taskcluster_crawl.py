@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import json
+import logging
+import argparse
+from argparse import RawTextHelpFormatter
+
+# the Taskcluster client and the crawler are imported by the run path, so the argument errors and --help return fast
+from util.stats import STATS_FORMATS, create_stats
+from util.search import NamespaceIndex
+from model.credentials import Credentials
+from model.login_policy import LOGGING_POLICY
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlRunner(object):
+    def __init__(self, connection_options=None):
+        """
+        @param connection_options: the options argument for connection. e.g. {'credentials': ...}
+        """
+        if not connection_options:
+            connection_options = {}
+        self.connection_options = connection_options
+        self.namespace = ''
+        self.workers = 8
+        self.max_depth = None
+        self.includes = []
+        self.excludes = []
+        self.output = None
+        self.search_index_path = None
+        self.stats_format = None
+        self.stats_file = None
+        self.statsd = None
+        self.taskcluster_credentials = os.path.join(os.path.expanduser('~'), 'tc_credentials.json')
+        self.is_verbose = False
+
+    def parser(self):
+        # argument parser
+        parser = argparse.ArgumentParser(prog='taskcluster_crawl',
+                                         description='Crawl the namespaces and tasks of Taskcluster Index, '
+                                                     'and print them as JSON lines.',
+                                         formatter_class=RawTextHelpFormatter)
+        parser.add_argument('--credentials', action='store', default=self.taskcluster_credentials, dest='credentials',
+                            help='The credential JSON file\n(default: {})'.format(self.taskcluster_credentials))
+        parser.add_argument('-n', '--namespace', action='store', default='', dest='namespace',
+                            help='The root namespace of crawling, e.g. gecko.v2.mozilla-central\n(default: root)')
+        parser.add_argument('--depth', action='store', type=int, dest='max_depth',
+                            help='The max depth under the root namespace, 1 for the children of root only\n'
+                                 '(default: no limit)')
+        parser.add_argument('--include', action='append', default=[], dest='includes',
+                            help='Only print the namespaces and tasks which match the glob pattern,\n'
+                                 'e.g. \'*.opt\'. Can be given multiple times.')
+        parser.add_argument('--exclude', action='append', default=[], dest='excludes',
+                            help='Skip the namespaces which match the glob pattern, and do not crawl into them,\n'
+                                 'e.g. \'*.pushdate.*\'. Can be given multiple times.')
+        parser.add_argument('-j', '--workers', action='store', type=int, default=self.workers, dest='workers',
+                            help='The number of concurrent Index API calls\n(default: {})'.format(self.workers))
+        parser.add_argument('-o', '--output', action='store', dest='output',
+                            help='The output file\n(default: stdout)')
+        parser.add_argument('--search-index', action='store', nargs='?', const=NamespaceIndex.DEFAULT_PATH,
+                            dest='search_index_path', metavar='FILE',
+                            help='Also add the crawled namespaces and tasks into the search index file\n'
+                                 'of "taskcluster_traverse --search"\n'
+                                 '(default: {})'.format(NamespaceIndex.DEFAULT_PATH))
+        parser.add_argument('--stats', action='store', choices=STATS_FORMATS, dest='stats_format',
+                            help='Write the timings and retry counts of Index API calls in JSON,\n'
+                                 'or in Prometheus text format for the textfile collector')
+        parser.add_argument('--stats-file', action='store', dest='stats_file',
+                            help='The stats file, it is replaced atomically\n(default: stderr)')
+        parser.add_argument('--statsd', action='store', dest='statsd', metavar='HOST:PORT',
+                            help='Send the stats of Index API calls to StatsD by UDP')
+        parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False,
+                            help='Turn on verbose output, with all the debug logger.')
+        options = parser.parse_args(sys.argv[1:])
+        if options.max_depth is not None and options.max_depth < 1:
+            parser.error('argument --depth: should be 1 or more')
+        return options
+
+    def cli(self):
+        """
+        This method will parse the argument for CLI.
+        """
+        # parser the argv
+        options = self.parser()
+
+        self.namespace = options.namespace
+        self.workers = max(1, options.workers)
+        self.max_depth = options.max_depth
+        self.includes = options.includes
+        self.excludes = options.excludes
+        self.output = options.output
+        self.search_index_path = options.search_index_path
+        self.stats_format = options.stats_format
+        self.stats_file = options.stats_file
+        self.statsd = options.statsd
+        self.is_verbose = options.verbose
+        self._configure_login()
+        self.check_crendentials_file(options)
+        return self
+
+    def _configure_login(self):
+        if self.is_verbose is True:
+            logging_config = LOGGING_POLICY['verbose']
+        else:
+            logging_config = LOGGING_POLICY['default']
+            # For removing log "INFO: Starting new HTTPS connection" from requests package
+            logging.getLogger('requests').setLevel(logging.WARNING)
+        logging.basicConfig(level=logging_config['level'], format=logging_config['format'])
+
+    def check_crendentials_file(self, options):
+        try:
+            path = self.taskcluster_credentials
+            if options:
+                path = options.credentials
+            abs_credentials_path = os.path.abspath(path)
+            credentials = Credentials.from_file(abs_credentials_path)
+            self.connection_options = {'credentials': credentials}
+            logger.debug('Load Credentials from {}'.format(abs_credentials_path))
+        except Exception as e:
+            if os.path.isfile(abs_credentials_path):
+                logger.error('Please check your credentials file: {}'.format(abs_credentials_path))
+                raise e
+            else:
+                logger.debug('No credentials.')
+                logger.debug(e)
+
+    def run(self):
+        """
+        Run the crawl process.
+        """
+        from util.finder import TaskFinder
+        from util.crawler import NamespaceCrawler
+
+        self.namespace = TaskFinder.normalize_namespace(self.namespace)
+        stats = create_stats(self.stats_format, self.statsd)
+        # each namespace is listed by two background listings, the Index API calls of all are bounded by workers
+        task_finder = TaskFinder(self.connection_options, stats=stats, max_calls=self.workers)
+        crawler = NamespaceCrawler(task_finder, workers=self.workers,
+                                   max_depth=self.max_depth, includes=self.includes, excludes=self.excludes)
+        search_index = NamespaceIndex(self.search_index_path) if self.search_index_path else None
+        fd = open(self.output, 'w') if self.output else sys.stdout
+        count = 0
+        try:
+            for record in crawler.crawl(self.namespace):
+                fd.write(json.dumps(record) + '\n')
+                fd.flush()
+                if search_index is not None:
+                    search_index.add_record(record)
+                count += 1
+        finally:
+            if fd is not sys.stdout:
+                fd.close()
+            if search_index is not None:
+                search_index.save()
+                logger.info('Saved {} namespaces into the search index [{}].'.format(len(search_index),
+                                                                                   search_index.path))
+            if self.stats_format:
+                stats.write(self.stats_format, self.stats_file)
+        logger.info('Crawled {} records under [{}].'.format(count, self.namespace or 'root'))
+
+
+def main():
+    try:
+        CrawlRunner().cli().run()
+    except KeyboardInterrupt:
+        exit(1)
+    except Exception as e:
+        logger.error(e)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
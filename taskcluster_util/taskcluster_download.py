@@ -3,12 +3,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+import sys
+import logging
 import argparse
 import textwrap
 from argparse import RawTextHelpFormatter
 
-from util.finder import *
-from util.downloader import *
+# the Taskcluster client, Index cache, batch downloader and progress bar are imported by the command paths using them,
+# so the listing and --signed-url-only calls from shell scripts start fast
+from util.cache import ArtifactCache, parse_size
+from util.stats import STATS_FORMATS, NULL_STATS, create_stats
 from model.credentials import Credentials
 from model.login_policy import LOGGING_POLICY
 
@@ -25,8 +30,24 @@ class DownloadRunner(object):
         self.connection_options = connection_options
         self.namespace = None
         self.task_id = None
+        self.manifest = None
+        self.jobs = 4
         self.artifact_name = None
+        self.artifact_regex = None
         self.dest_dir = None
+        self.connections = 1
+        self.cache_dir = None
+        self.cache_max_size = ArtifactCache.DEFAULT_MAX_SIZE
+        self.digest = None
+        self.checksums_artifact = None
+        self.no_index_cache = False
+        self.refresh_index_cache = False
+        self.stale_while_revalidate = False
+        self.stats_format = None
+        self.stats_file = None
+        self.statsd = None
+        self.stats = NULL_STATS
+        self.task_finder = None
         self.artifact_downloader = None
         self.taskcluster_credentials = os.path.join(os.path.expanduser('~'), 'tc_credentials.json')
         self.should_display_signed_url_only = False
@@ -57,12 +78,57 @@ class DownloadRunner(object):
         task_group = parser.add_mutually_exclusive_group(required=True)
         task_group.add_argument('-n', '--namespace', action='store', dest='namespace', help='The namespace of task')
         task_group.add_argument('-t', '--taskid', action='store', dest='task_id', help='The taskId of task')
+        task_group.add_argument('-m', '--manifest', action='store', dest='manifest',
+                                help='The manifest file of batch download, "-" for stdin.\n'
+                                     'JSON/YAML list of {"namespace"|"taskid", "artifact", "dest", "digest"},\n'
+                                     'or lines of "NAMESPACE_OR_TASKID ARTIFACT [DEST]".')
         artifact_group = parser.add_argument_group('Download Artifact', 'The artifact name and dest folder')
         artifact_group.add_argument('-a', '--artifact', action='store', dest='aritfact_name',
-                                    help='The artifact name on Taskcluster')
+                                    help='The artifact name on Taskcluster.\n'
+                                         'The glob pattern downloads all matched artifacts, e.g. \'public/build/*.tar.gz\'')
+        artifact_group.add_argument('--artifact-regex', action='store', dest='artifact_regex',
+                                    help='Download all artifacts whose name matches the regular expression')
         artifact_group.add_argument('-d', '--dest-dir', action='store', dest='dest_dir',
                                     help='The dest folder (default: current working folder)')
-        artifact_group.add_argument('-u', '--signed-url-only', action='store_true', help='Retrieve the signed url and display it.\nNo download is done.')
+        artifact_group.add_argument('--connections', action='store', type=int, default=self.connections, dest='connections',
+                                    help='The number of parallel connections for downloading one artifact.\n'
+                                         'Fall back to single connection if the server does not support byte ranges.\n'
+                                         '(default: {})'.format(self.connections))
+        artifact_group.add_argument('--cache-dir', action='store', dest='cache_dir',
+                                    help='The local artifact cache folder shared across runs.\n'
+                                         'The cached artifact will be linked to dest folder if it is not modified.\n'
+                                         '(default: no cache)')
+        artifact_group.add_argument('--cache-max-size', action='store', type=parse_size, default=self.cache_max_size,
+                                    dest='cache_max_size',
+                                    help='The max size of cache folder, e.g. 500M, 10G.\n'
+                                         'The least recently used artifacts will be removed.\n'
+                                         '(default: 10G)')
+        artifact_group.add_argument('-u', '--signed-url-only', action='store_true',
+                                    help='Retrieve the signed url and display it.\nNo download is done.\n'
+                                         'With --manifest, display the signed urls of all items.')
+        verify_group = parser.add_argument_group('Verify Artifact', 'The artifact is hashed while downloading')
+        verify_group.add_argument('--digest', action='store', dest='digest',
+                                  help='The expected digest of artifact, e.g. sha256:HEX or sha512:HEX')
+        verify_group.add_argument('--checksums-artifact', action='store', dest='checksums_artifact',
+                                  help='The checksums artifact of the same task, e.g. \'public/build/target.checksums\'.\n'
+                                       'The lines are "HEX ALGORITHM SIZE NAME" or "HEX NAME".')
+        index_group = parser.add_argument_group('Index Cache', 'The local cache of Index API results')
+        index_group.add_argument('--no-cache', action='store_true', dest='no_index_cache', default=False,
+                                 help='Do not use the Index cache.')
+        index_group.add_argument('--refresh', action='store_true', dest='refresh_index_cache', default=False,
+                                 help='Query the Index API and update the Index cache.')
+        index_group.add_argument('--stale-while-revalidate', action='store_true', dest='stale_while_revalidate',
+                                 default=False,
+                                 help='Use the expired Index cache entries, and update them in background.')
+        stats_group = parser.add_argument_group('Stats', 'The timings, byte counts and retry counts of each phase')
+        stats_group.add_argument('--stats', action='store', choices=STATS_FORMATS, dest='stats_format',
+                                 help='Write the stats in JSON, or in Prometheus text format for the textfile collector')
+        stats_group.add_argument('--stats-file', action='store', dest='stats_file',
+                                 help='The stats file, it is replaced atomically (default: stderr)')
+        stats_group.add_argument('--statsd', action='store', dest='statsd', metavar='HOST:PORT',
+                                 help='Send the stats of each phase to StatsD by UDP')
+        parser.add_argument('-j', '--jobs', action='store', type=int, default=self.jobs, dest='jobs',
+                            help='The number of parallel downloads of batch download and matched artifacts.\n(default: {})'.format(self.jobs))
         parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False,
                             help='Turn on verbose output, with all the debug logger.')
         return parser.parse_args(sys.argv[1:])
@@ -76,8 +142,22 @@ class DownloadRunner(object):
 
         self.namespace = options.namespace
         self.task_id = options.task_id
+        self.manifest = options.manifest
+        self.jobs = max(1, options.jobs)
         self.artifact_name = options.aritfact_name
+        self.artifact_regex = options.artifact_regex
         self.dest_dir = options.dest_dir
+        self.connections = max(1, options.connections)
+        self.cache_dir = options.cache_dir
+        self.cache_max_size = options.cache_max_size
+        self.digest = options.digest
+        self.checksums_artifact = options.checksums_artifact
+        self.no_index_cache = options.no_index_cache
+        self.refresh_index_cache = options.refresh_index_cache
+        self.stale_while_revalidate = options.stale_while_revalidate
+        self.stats_format = options.stats_format
+        self.stats_file = options.stats_file
+        self.statsd = options.statsd
         self.is_verbose = options.verbose
         self.should_display_signed_url_only = options.signed_url_only
 
@@ -128,27 +208,58 @@ class DownloadRunner(object):
 
     def run(self):
         """
-        Run the download process.
+        Run the download process, and write the stats.
         """
+        self.stats = create_stats(self.stats_format, self.statsd)
+        try:
+            self.download()
+        finally:
+            if self.stats_format:
+                self.stats.write(self.stats_format, self.stats_file)
+
+    def download(self):
+        """
+        Download the artifacts, or display the artifacts list or the signed urls.
+        """
+        from util.downloader import Downloader
+        cache = ArtifactCache(self.cache_dir, self.cache_max_size) if self.cache_dir else None
+        if self.manifest is not None or self.namespace is not None:
+            from util.finder import TaskFinder
+            from util.index_cache import open_index_cache
+            index_cache = open_index_cache(self.no_index_cache, self.refresh_index_cache, self.stale_while_revalidate)
+            self.task_finder = TaskFinder(self.connection_options, cache=index_cache, stats=self.stats)
+        if self.manifest is not None:
+            # parallel downloads share the terminal, so no progress bar
+            self.artifact_downloader = Downloader(self.connection_options, connections=self.connections, cache=cache,
+                                                  show_progress=self.jobs == 1,
+                                                  checksums_artifact=self.checksums_artifact, stats=self.stats)
+            self.run_batch()
+            return
+
         if self.namespace is not None:
             # remove the 'index.' and 'root.' of namespace
-            task_namespace = self.namespace
-            logger.debug('Finding the TaskID of Namespace [{}] ...'.format(task_namespace))
-            if self.namespace.startswith('index.'):
-                task_namespace = self.namespace[len('index.'):]
-                logger.debug('Remove the ["index."] of Namespace [{}].'.format(task_namespace))
-            elif self.namespace.startswith('root.'):
-                task_namespace = self.namespace[len('root.'):]
-                logger.debug('Remove the ["root."] of Namespace [{}].'.format(task_namespace))
+            logger.debug('Finding the TaskID of Namespace [{}] ...'.format(self.namespace))
+            task_namespace = self.task_finder.normalize_namespace(self.namespace)
             # find TaskId from Namespace
-            task_finder = TaskFinder(self.connection_options)
-            task_id = task_finder.get_taskid_by_namespace(task_namespace)
+            resolution = self.task_finder.resolve(task_namespace)
+            if resolution.is_not_found:
+                raise Exception('Can not find the Namespace [{}].'.format(task_namespace))
+            elif not resolution.is_task:
+                raise Exception('The Namespace [{}] is not a task.'.format(task_namespace))
+            task_id = resolution.task_id
             logger.debug('The TaskID of Namespace [{}] is [{}].'.format(task_namespace, task_id))
         else:
             task_id = self.task_id
 
-        self.artifact_downloader = Downloader(self.connection_options)
-        if self.artifact_name is None:
+        is_pattern = self.artifact_regex is not None or \
+            (self.artifact_name is not None and Downloader.is_artifact_pattern(self.artifact_name))
+        # parallel downloads share the terminal, so no progress bar
+        self.artifact_downloader = Downloader(self.connection_options, connections=self.connections, cache=cache,
+                                              show_progress=not is_pattern or self.jobs == 1,
+                                              checksums_artifact=self.checksums_artifact, stats=self.stats)
+        if is_pattern:
+            self.run_matched_artifacts(task_id)
+        elif self.artifact_name is None:
             # no artifact_name, then get the latest artifacts list
             self.show_latest_artifacts(task_id)
         elif self.should_display_signed_url_only is True:
@@ -156,9 +267,68 @@ class DownloadRunner(object):
         else:
             # has artifact_name, then download it
             logger.info('Downloading [{}] from TaskID [{}] ...'.format(self.artifact_name, task_id))
-            local_file = self.artifact_downloader.download_latest_artifact(task_id, self.artifact_name, self.dest_dir)
+            local_file = self.artifact_downloader.download_latest_artifact(task_id, self.artifact_name, self.dest_dir,
+                                                                           digest=self.digest)
             logger.debug('Downloaded to [{}]'.format(local_file))
 
+    def run_matched_artifacts(self, task_id):
+        """
+        Download, or display the signed urls of, the artifacts matched by glob pattern or regular expression.
+        @param task_id: the given TaskId.
+        """
+        is_pattern = self.artifact_name and self.artifact_downloader.is_artifact_pattern(self.artifact_name)
+        pattern = self.artifact_name if is_pattern else None
+        names = self.artifact_downloader.find_artifacts(task_id, pattern=pattern, regex=self.artifact_regex)
+        if not names:
+            raise Exception('No artifact of TaskID [{}] matches.'.format(task_id))
+        if self.should_display_signed_url_only is True:
+            for url in self.artifact_downloader.get_signed_urls([(task_id, name) for name in names]):
+                print(url)
+            return
+        from util.batch import BatchItem
+        self.download_items([BatchItem(name, task_id=task_id) for name in names])
+
+    def run_batch(self):
+        """
+        Download, or display the signed urls of, the artifacts of manifest file.
+        """
+        from util.batch import load_manifest, BatchDownloader
+        items = load_manifest(self.manifest)
+        if self.should_display_signed_url_only is True:
+            batch_downloader = BatchDownloader(self.task_finder, self.artifact_downloader, jobs=self.jobs)
+            failed_items = [item for item in batch_downloader.resolve(items) if item.error]
+            if failed_items:
+                raise Exception('Can not resolve {}'.format(', '.join('[{}]: {}'.format(item, item.error)
+                                                                      for item in failed_items)))
+            for url in self.artifact_downloader.get_signed_urls([(item.task_id, item.artifact_name)
+                                                                 for item in items]):
+                print(url)
+            return
+        self.download_items(items)
+
+    def download_items(self, items):
+        """
+        Download the items in parallel, and print the summary.
+        Raise exception if any item failed.
+        @param items: the list of L{BatchItem}.
+        """
+        from util.batch import BatchDownloader
+        from util.transfer import ensure_pool_maxsize
+        # keep the connections of all parallel downloads alive
+        ensure_pool_maxsize(self.jobs * self.connections)
+        logger.info('Downloading {} artifacts by {} jobs ...'.format(len(items), self.jobs))
+        batch_downloader = BatchDownloader(self.task_finder, self.artifact_downloader,
+                                           jobs=self.jobs, dest_dir=self.dest_dir)
+        failed_items = []
+        for item in batch_downloader.run(items):
+            if item.error:
+                failed_items.append(item)
+                print('[FAILED] {}: {}'.format(item, item.error))
+            else:
+                print('[OK] {} -> {}'.format(item, item.local_file))
+        if failed_items:
+            raise Exception('{} of {} artifacts failed.'.format(len(failed_items), len(items)))
+
 
 def main():
     try:
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import logging
+import argparse
+from argparse import RawTextHelpFormatter
+
+# the Taskcluster client, Index cache and proxy are imported by the run path, so the argument errors and --help return fast
+from util.cache import ArtifactCache, parse_size
+from model.credentials import Credentials
+from model.login_policy import LOGGING_POLICY
+
+logger = logging.getLogger(__name__)
+
+
+class ServeRunner(object):
+    def __init__(self, connection_options=None):
+        """
+        @param connection_options: the options argument for connection. e.g. {'credentials': ...}
+        """
+        if not connection_options:
+            connection_options = {}
+        self.connection_options = connection_options
+        self.address = 'localhost'
+        self.port = 8080
+        self.store_dir = os.path.join(os.path.expanduser('~'), '.cache', 'taskcluster_util', 'artifacts')
+        self.cache_max_size = ArtifactCache.DEFAULT_MAX_SIZE
+        self.no_index_cache = False
+        self.stale_while_revalidate = False
+        self.taskcluster_credentials = os.path.join(os.path.expanduser('~'), 'tc_credentials.json')
+        self.is_verbose = False
+
+    def parser(self):
+        # argument parser
+        parser = argparse.ArgumentParser(prog='taskcluster_serve',
+                                         description='The local artifact proxy server for Taskcluster.\n'
+                                                     'GET /namespace/<NAMESPACE>/<ARTIFACT> or /task/<TASKID>/<ARTIFACT>',
+                                         formatter_class=RawTextHelpFormatter)
+        parser.add_argument('--credentials', action='store', default=self.taskcluster_credentials, dest='credentials',
+                            help='The credential JSON file\n(default: {})'.format(self.taskcluster_credentials))
+        parser.add_argument('-a', '--address', action='store', default=self.address, dest='address',
+                            help='The server address\n(default: {})'.format(self.address))
+        parser.add_argument('-p', '--port', action='store', type=int, default=self.port, dest='port',
+                            help='The server port\n(default: {})'.format(self.port))
+        parser.add_argument('-s', '--store-dir', action='store', default=self.store_dir, dest='store_dir',
+                            help='The folder of fetched artifacts\n(default: {})'.format(self.store_dir))
+        parser.add_argument('--cache-max-size', action='store', type=parse_size, default=self.cache_max_size,
+                            dest='cache_max_size',
+                            help='The max size of the store folder, e.g. 500M, 10G.\n'
+                                 'The least recently used artifacts will be removed. 0 for no limit.\n'
+                                 '(default: 10G)')
+        parser.add_argument('--no-cache', action='store_true', dest='no_index_cache', default=False,
+                            help='Do not use the Index cache.')
+        parser.add_argument('--stale-while-revalidate', action='store_true', dest='stale_while_revalidate',
+                            default=False,
+                            help='Use the expired Index cache entries, and update them in background.')
+        parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False,
+                            help='Turn on verbose output, with all the debug logger.')
+        return parser.parse_args(sys.argv[1:])
+
+    def cli(self):
+        """
+        This method will parse the argument for CLI.
+        """
+        # parser the argv
+        options = self.parser()
+
+        self.address = options.address
+        self.port = options.port
+        self.store_dir = options.store_dir
+        self.cache_max_size = options.cache_max_size
+        self.no_index_cache = options.no_index_cache
+        self.stale_while_revalidate = options.stale_while_revalidate
+        self.is_verbose = options.verbose
+        self._configure_login()
+        self.check_crendentials_file(options)
+        return self
+
+    def _configure_login(self):
+        if self.is_verbose is True:
+            logging_config = LOGGING_POLICY['verbose']
+        else:
+            logging_config = LOGGING_POLICY['default']
+            # For removing log "INFO: Starting new HTTPS connection" from requests package
+            logging.getLogger('requests').setLevel(logging.WARNING)
+        logging.basicConfig(level=logging_config['level'], format=logging_config['format'])
+
+    def check_crendentials_file(self, options):
+        try:
+            path = self.taskcluster_credentials
+            if options:
+                path = options.credentials
+            abs_credentials_path = os.path.abspath(path)
+            credentials = Credentials.from_file(abs_credentials_path)
+            self.connection_options = {'credentials': credentials}
+            logger.debug('Load Credentials from {}'.format(abs_credentials_path))
+        except Exception as e:
+            if os.path.isfile(abs_credentials_path):
+                logger.error('Please check your credentials file: {}'.format(abs_credentials_path))
+                raise e
+            else:
+                logger.warning('No credentials. Run with "--help" for more information.')
+                logger.debug(e)
+
+    def run(self):
+        """
+        Run the proxy server until interrupted.
+        """
+        from util.finder import TaskFinder
+        from util.downloader import Downloader
+        from util.index_cache import open_index_cache
+        from util.proxy import ArtifactProxy, ProxyServer
+
+        index_cache = open_index_cache(self.no_index_cache, stale_while_revalidate=self.stale_while_revalidate)
+        proxy = ArtifactProxy(TaskFinder(self.connection_options, cache=index_cache),
+                              Downloader(self.connection_options, show_progress=False),
+                              self.store_dir, max_size=self.cache_max_size)
+        server = ProxyServer((self.address, self.port), proxy)
+        logger.info('Serving artifacts on http://{}:{}/ , store folder: {}'.format(
+            server.server_address[0], server.server_address[1], proxy.store_dir))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Stop serving.')
+        finally:
+            server.server_close()
+
+
+def main():
+    try:
+        ServeRunner().cli().run()
+    except Exception as e:
+        logger.error(e)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,17 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import os
+import sys
 import json
+import logging
 import argparse
 import textwrap
 from argparse import RawTextHelpFormatter
 
 import easygui
-from util.finder import *
-from util.downloader import *
+# the Taskcluster client and Index cache are imported by the run path, so the argument errors and --help return fast
+from util.prefetcher import ListingPrefetcher
+from util.search import NamespaceIndex
 from model.credentials import Credentials
 from model.login_policy import LOGGING_POLICY
 
@@ -32,9 +35,18 @@ class TraverseRunner(object):
         self.origin_dest_dir = None
         self.dest_dir = None
         self.entry_namespace = ''
+        self.no_index_cache = False
+        self.refresh_index_cache = False
+        self.stale_while_revalidate = False
+        self.prefetch_depth = ListingPrefetcher.DEFAULT_MAX_DEPTH
+        self.prefetch_workers = ListingPrefetcher.DEFAULT_WORKERS
+        self.search_query = None
+        self.search_index_path = NamespaceIndex.DEFAULT_PATH
         self.downloaded_file_list = []
         self.task_finder = None
         self.artifact_downloader = None
+        self.prefetcher = None
+        self.search_index = None
         self.taskcluster_credentials = os.path.join(os.path.expanduser('~'), 'tc_credentials.json')
 
     def parser(self):
@@ -63,6 +75,33 @@ class TraverseRunner(object):
                             help='The namespace of task')
         parser.add_argument('-d', '--dest-dir', action='store', dest='dest_dir',
                             help='The dest folder (default: current working folder)')
+        index_group = parser.add_argument_group('Index Cache', 'The local cache of Index API results')
+        index_group.add_argument('--no-cache', action='store_true', dest='no_index_cache', default=False,
+                                 help='Do not use the Index cache.')
+        index_group.add_argument('--refresh', action='store_true', dest='refresh_index_cache', default=False,
+                                 help='Query the Index API and update the Index cache.')
+        index_group.add_argument('--stale-while-revalidate', action='store_true', dest='stale_while_revalidate',
+                                 default=False,
+                                 help='Use the expired Index cache entries, and update them in background.')
+        prefetch_group = parser.add_argument_group('Prefetch', 'Fetch the child namespaces and artifacts lists '
+                                                               'in background while selecting')
+        prefetch_group.add_argument('--prefetch-depth', action='store', type=int, default=self.prefetch_depth,
+                                    dest='prefetch_depth',
+                                    help='The levels of namespaces to prefetch, 0 for no prefetch\n'
+                                         '(default: {})'.format(self.prefetch_depth))
+        prefetch_group.add_argument('--prefetch-workers', action='store', type=int, default=self.prefetch_workers,
+                                    dest='prefetch_workers',
+                                    help='The number of concurrent prefetches\n'
+                                         '(default: {})'.format(self.prefetch_workers))
+        search_group = parser.add_argument_group('Search', 'The local search index of the namespaces and tasks, '
+                                                           'filled by traversing or crawling')
+        search_group.add_argument('--search', action='store', dest='search_query', metavar='QUERY',
+                                  help='Search the namespaces and tasks by glob pattern, prefix, substring\n'
+                                       'or fuzzy match, and start from the selected one,\n'
+                                       'e.g. \'gecko.v2.*.latest.firefox.linux64-opt\'')
+        search_group.add_argument('--search-index', action='store', dest='search_index_path',
+                                  default=self.search_index_path,
+                                  help='The search index file\n(default: {})'.format(self.search_index_path))
         parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False,
                             help='Turn on verbose output, with all the debug logger.')
         return parser.parse_args(sys.argv[1:])
@@ -78,6 +117,13 @@ class TraverseRunner(object):
         self.entry_namespace = options.namespace
         self.origin_dest_dir = options.dest_dir
         self.dest_dir = options.dest_dir
+        self.no_index_cache = options.no_index_cache
+        self.refresh_index_cache = options.refresh_index_cache
+        self.stale_while_revalidate = options.stale_while_revalidate
+        self.prefetch_depth = max(0, options.prefetch_depth)
+        self.prefetch_workers = max(0, options.prefetch_workers)
+        self.search_query = options.search_query
+        self.search_index_path = options.search_index_path
 
         # setup the logging config
         self._configure_login()
@@ -149,25 +195,59 @@ class TraverseRunner(object):
         """
         If entry_namespace is task, show GUI for downloading and return parent namespace.
         """
-        if self.task_finder.is_task(self.entry_namespace):
+        resolution = self.task_finder.resolve(self.entry_namespace)
+        if resolution.is_task:
             task_name = self.entry_namespace
-            task_id = self.task_finder.get_taskid_by_namespace(task_name)
             parent = self.task_finder.get_parent_namespace(task_name)
-            self.gui_download_artifacts(task_name, task_id)
+            self.gui_download_artifacts(task_name, resolution.task_id)
             return parent
+        elif resolution.is_not_found:
+            raise Exception('Can not find the Namespace [{}].'.format(self.entry_namespace))
         else:
             return self.entry_namespace
 
+    def _search_entry_namespace(self):
+        """
+        GUI: show the namespaces and tasks which match the "--search" query, and set the selected one as entry.
+        """
+        results = self.search_index.search(self.search_query)
+        logger.debug('Search [{}]: {} results.'.format(self.search_query, len(results)))
+        if not results:
+            title = 'Search'
+            msg = textwrap.dedent('''\
+            No namespace matches [{}] in the search index.
+
+            The index is filled by traversing, or by "taskcluster_crawl --search-index".
+
+            * Tips: [Enter] OK
+            ''').format(self.search_query)
+            easygui.msgbox(msg, title)
+            return
+        choices = []
+        for namespace, task_id in results:
+            if task_id:
+                choices.append('{} {} {}'.format(self._TYPE_TASK, namespace, task_id))
+            else:
+                choices.append('{} {}'.format(self._TYPE_NAMESPACE, namespace))
+        msg = textwrap.dedent('''\
+        Please select the namespace.
+
+        - Search: [{}]
+
+        * Tips: [↑][↓] Select, [Enter] OK, [Esc] Cancel
+        ''').format(self.search_query)
+        title = 'Search Namespace'
+        user_choice = easygui.choicebox(msg, title, choices)
+        logger.debug('Select: {}'.format(user_choice))
+        if user_choice:
+            self.entry_namespace = user_choice.split()[1]
+
     def _get_latest_artifacts(self, task_id):
         """
         Return the latest artifacts name list
         """
         logger.debug('Getting latest artifacts of TaskID {} ...'.format(task_id))
-        ret = self.artifact_downloader.get_latest_artifacts(task_id)
-        artifacts_list = ret.get('artifacts')
-        artifacts_name_list = []
-        for artifact in artifacts_list:
-            artifacts_name_list.append(artifact.get('name'))
+        artifacts_name_list = self.prefetcher.get_artifacts(task_id)
         logger.debug('artifact list: {}'.format(artifacts_name_list))
         return artifacts_name_list
 
@@ -317,18 +397,45 @@ class TraverseRunner(object):
         # check the credentials for Taskcluster
         self._check_credentials()
         # prepare the utilies
-        self.task_finder = TaskFinder(self.connection_options)
+        from util.finder import TaskFinder
+        from util.downloader import Downloader
+        from util.index_cache import open_index_cache
+
+        index_cache = open_index_cache(self.no_index_cache, self.refresh_index_cache, self.stale_while_revalidate)
+        self.task_finder = TaskFinder(self.connection_options, cache=index_cache)
         self.artifact_downloader = Downloader(self.connection_options)
-        # traverse the Taskcluster
+        self.prefetcher = ListingPrefetcher(self.task_finder, self.artifact_downloader, workers=self.prefetch_workers,
+                                            max_depth=self.prefetch_depth)
+        self.search_index = NamespaceIndex(self.search_index_path)
+        try:
+            if self.search_query:
+                self._search_entry_namespace()
+            self.traverse()
+        finally:
+            self.prefetcher.close()
+            if self.search_index.is_changed:
+                try:
+                    self.search_index.save()
+                except Exception as e:
+                    logger.warning('Can not save the search index [{}]: {}'.format(self.search_index_path, e))
+
+    def traverse(self):
+        """
+        Show the namespaces and tasks, and go into the selected one.
+        The visited listings are kept and added into the search index,
+        and the children of current listing are prefetched while selecting.
+        """
         current_node = self._get_entry_namespace()
         while True:
-            ret_ns_task_dict = self.task_finder.get_namespaces_and_tasks(current_node)
+            ret_ns_task_dict = self.prefetcher.get_listing(current_node)
+            self.prefetcher.prefetch(ret_ns_task_dict)
+            self.search_index.add_listing(ret_ns_task_dict)
             ns_task_list = []
             # namespace format = "namespace FOO.BAR"
-            for item in ret_ns_task_dict.get(TaskFinder._NAMESPACES):
+            for item in ret_ns_task_dict.get(self.task_finder._NAMESPACES):
                 ns_task_list.append('{} {}'.format(self._TYPE_NAMESPACE, item))
             # task format = "task FOO.BAR.TASK TASKID"
-            for item in ret_ns_task_dict.get(TaskFinder._TASKS):
+            for item in ret_ns_task_dict.get(self.task_finder._TASKS):
                 ns_task_list.append('{} {} {}'.format(self._TYPE_TASK, item[0], item[1]))
             # append the ".." for going back to parent
             if not self.task_finder.is_root(current_node):
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+import transfer
+from finder import TaskFinder
+from downloader import Downloader
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 32
+# each in-flight call holds a worker thread and a keep-alive connection, so the pool size is limited
+MAX_CONCURRENCY = 128
+
+
+class AsyncPool(object):
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        The thread pool shared by async clients, which limits the number of concurrent calls.
+        The calls are still blocking I/O, each in-flight call holds a worker thread until it returns,
+        so the calls over the pool size wait in the queue.
+        The keep-alive connection pool of artifact transfers is enlarged to the same size.
+        @param max_concurrency: the max number of concurrent calls, from 1 to L{MAX_CONCURRENCY}.
+        """
+        if max_concurrency > MAX_CONCURRENCY:
+            logger.warning('The max concurrency {} is limited to {}.'.format(max_concurrency, MAX_CONCURRENCY))
+        self.max_concurrency = min(max(1, max_concurrency), MAX_CONCURRENCY)
+        if transfer.POOL_MAXSIZE < self.max_concurrency:
+            transfer.set_pool_maxsize(self.max_concurrency)
+        self._pool = ThreadPool(self.max_concurrency)
+
+    def submit(self, func, args=(), kwargs=None, callback=None):
+        """
+        Run the function in the pool.
+        @param func: the function.
+        @param args: the arguments.
+        @param kwargs: the keyword arguments.
+        @param callback: the function called with the result when it succeeds.
+        @return: the AsyncResult, get() returns the result or raises the exception.
+        """
+        return self._pool.apply_async(func, args, kwargs or {}, callback)
+
+    def close(self):
+        """
+        Wait for the submitted calls, and stop the workers.
+        """
+        self._pool.close()
+        self._pool.join()
+
+
+class _AsyncClient(object):
+    def __init__(self, pool=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        @param pool: the shared L{AsyncPool}, a new pool is created if not given.
+        @param max_concurrency: the max number of concurrent calls of the new pool, up to L{MAX_CONCURRENCY}.
+        """
+        self._own_pool = pool is None
+        self.pool = pool or AsyncPool(max_concurrency)
+
+    def close(self):
+        """
+        Stop the pool if it is created by this client.
+        """
+        if self._own_pool:
+            self.pool.close()
+
+
+class AsyncTaskFinder(_AsyncClient):
+    def __init__(self, options={}, cache=None, pool=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        The L{TaskFinder} running in the thread pool. The methods return AsyncResult immediately,
+        the Index API calls block the worker threads of pool.
+        @param options: the options argument for connection.
+        @param cache: the L{IndexCache} of Index API results.
+        @param pool: the shared L{AsyncPool}.
+        @param max_concurrency: the max number of concurrent calls if no shared pool, up to L{MAX_CONCURRENCY}.
+        """
+        super(AsyncTaskFinder, self).__init__(pool, max_concurrency)
+        self.task_finder = TaskFinder(options, cache=cache)
+
+    def get_namespaces(self, ns_node='', limit=1000, callback=None):
+        return self.pool.submit(self.task_finder.get_namespaces, (ns_node, limit), callback=callback)
+
+    def get_tasks(self, ns_node='', limit=1000, callback=None):
+        return self.pool.submit(self.task_finder.get_tasks, (ns_node, limit), callback=callback)
+
+    def get_namespaces_and_tasks(self, ns_node='', limit=1000, callback=None):
+        return self.pool.submit(self.task_finder.get_namespaces_and_tasks, (ns_node, limit), callback=callback)
+
+    def get_taskid_by_namespace(self, namespace, callback=None):
+        return self.pool.submit(self.task_finder.get_taskid_by_namespace, (namespace,), callback=callback)
+
+    def resolve(self, namespace, callback=None):
+        return self.pool.submit(self.task_finder.resolve, (namespace,), callback=callback)
+
+
+class AsyncDownloader(_AsyncClient):
+    def __init__(self, options={}, connections=1, cache=None, pool=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        The L{Downloader} running in the thread pool. The methods return AsyncResult immediately,
+        the Queue API calls and downloads block the worker threads of pool.
+        The progress bar is not displayed.
+        @param options: the options argument for connection.
+        @param connections: the number of parallel connections for downloading one artifact.
+        @param cache: the L{ArtifactCache}.
+        @param pool: the shared L{AsyncPool}.
+        @param max_concurrency: the max number of concurrent calls if no shared pool, up to L{MAX_CONCURRENCY}.
+        """
+        super(AsyncDownloader, self).__init__(pool, max_concurrency)
+        self.downloader = Downloader(options, connections=connections, cache=cache, show_progress=False)
+
+    def get_latest_artifacts(self, task_id, callback=None):
+        return self.pool.submit(self.downloader.get_latest_artifacts, (task_id,), callback=callback)
+
+    def get_signed_url(self, task_id, full_filename, callback=None):
+        return self.pool.submit(self.downloader.get_signed_url, (task_id, full_filename), callback=callback)
+
+    def get_signed_urls(self, artifacts, callback=None):
+        return self.pool.submit(self.downloader.get_signed_urls, (artifacts,), callback=callback)
+
+    def download_latest_artifact(self, task_id, full_filename, dest_dir, digest=None, callback=None):
+        return self.pool.submit(self.downloader.download_latest_artifact, (task_id, full_filename, dest_dir),
+                                {'digest': digest}, callback=callback)
@@ -0,0 +1,220 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+logger = logging.getLogger(__name__)
+
+# the format of TaskId (slugid)
+_TASK_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{22}$')
+# the format of namespace, e.g. 'gecko.v2.mozilla-central.latest'
+_NAMESPACE_PATTERN = re.compile(r'^[A-Za-z0-9_-]*[A-Za-z0-9_][A-Za-z0-9_-]*(\.[A-Za-z0-9_-]+)*$')
+# the first line of YAML document, list item, or mapping
+_YAML_PATTERN = re.compile(r'^(---|-\s|-$|[\w.-]+:(\s|$))')
+
+
+class BatchItem(object):
+    def __init__(self, artifact_name, namespace=None, task_id=None, dest_dir=None, digest=None):
+        """
+        The artifact for batch downloading.
+        @param artifact_name: the artifact name.
+        @param namespace: the namespace of task.
+        @param task_id: the TaskId of task, it will be resolved from namespace if not given.
+        @param dest_dir: the dest folder.
+        @param digest: the expected digest. e.g. 'sha256:HEX'.
+        """
+        if not artifact_name or not (namespace or task_id):
+            raise Exception('The item should have the artifact and the namespace or taskId.')
+        self.artifact_name = artifact_name
+        self.namespace = namespace
+        self.task_id = task_id
+        self.dest_dir = dest_dir
+        self.digest = digest
+        self.local_file = None
+        self.error = None
+
+    def __str__(self):
+        return '{} {}'.format(self.namespace or self.task_id, self.artifact_name)
+
+    def get_local_path(self, dest_dir=None):
+        """
+        Get the local file path of item, the artifact is saved by its base name.
+        @param dest_dir: the default dest folder, if the item has no dest folder.
+        @return: the absolute path.
+        """
+        dest_dir = self.dest_dir or dest_dir
+        abs_dest_dir = os.path.abspath(dest_dir) if dest_dir else os.getcwd()
+        return os.path.join(abs_dest_dir, os.path.basename(self.artifact_name))
+
+    @staticmethod
+    def from_dict(item):
+        """
+        Create the item from dict. e.g. {'namespace': ..., 'taskid': ..., 'artifact': ..., 'dest': ..., 'digest': ...}
+        """
+        return BatchItem(item.get('artifact'),
+                         namespace=item.get('namespace'),
+                         task_id=item.get('taskid') or item.get('task_id') or item.get('taskId'),
+                         dest_dir=item.get('dest') or item.get('dest_dir'),
+                         digest=item.get('digest'))
+
+    @staticmethod
+    def from_line(line):
+        """
+        Create the item from line. e.g. "NAMESPACE_OR_TASKID ARTIFACT [DEST]"
+        """
+        fields = line.split()
+        if len(fields) not in (2, 3) or not _NAMESPACE_PATTERN.match(fields[0]):
+            raise Exception('Can not parse the line: [{}]'.format(line))
+        task = fields[0]
+        dest_dir = fields[2] if len(fields) == 3 else None
+        if _TASK_ID_PATTERN.match(task):
+            return BatchItem(fields[1], task_id=task, dest_dir=dest_dir)
+        return BatchItem(fields[1], namespace=task, dest_dir=dest_dir)
+
+
+def _is_yaml(content):
+    """
+    Check the first line of content, which is not empty nor comment, is YAML or not.
+    """
+    for line in content.splitlines():
+        if line.strip() and not line.strip().startswith('#'):
+            return bool(_YAML_PATTERN.match(line))
+    return False
+
+
+def load_manifest(path):
+    """
+    Load the batch items from manifest file.
+    The manifest can be a JSON/YAML list of dict, or lines of "NAMESPACE_OR_TASKID ARTIFACT [DEST]".
+    The format is detected by the file extension, or by the content, e.g. the manifest from stdin.
+    Raise exception if the manifest can not be parsed.
+    @param path: the manifest file path, "-" for stdin.
+    @return: the list of L{BatchItem}.
+    """
+    if path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(path) as fd:
+            content = fd.read()
+
+    if path.endswith('.json') or content.lstrip().startswith(('[', '{')):
+        items = json.loads(content)
+    elif path.endswith(('.yml', '.yaml')) or _is_yaml(content):
+        try:
+            import yaml
+        except ImportError:
+            raise Exception('Please install PyYAML for loading YAML manifest.')
+        items = yaml.safe_load(content) or []
+    else:
+        return [BatchItem.from_line(line) for line in content.splitlines()
+                if line.strip() and not line.strip().startswith('#')]
+
+    if isinstance(items, dict):
+        items = items.get('items', [])
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise Exception('The manifest should be a list of {"namespace"|"taskid", "artifact", "dest", "digest"}.')
+    return [BatchItem.from_dict(item) for item in items]
+
+
+class BatchDownloader(object):
+    def __init__(self, task_finder, downloader, jobs=4, dest_dir=None):
+        """
+        Download many artifacts by a bounded worker pool, with shared TaskFinder and Downloader.
+        @param task_finder: the L{TaskFinder}.
+        @param downloader: the L{Downloader}.
+        @param jobs: the number of parallel downloads.
+        @param dest_dir: the default dest folder of items.
+        """
+        self.task_finder = task_finder
+        self.downloader = downloader
+        self.jobs = max(1, jobs)
+        self.dest_dir = dest_dir
+        self._task_ids = {}
+        self._lock = threading.Lock()
+
+    def _get_task_id(self, namespace):
+        with self._lock:
+            if namespace in self._task_ids:
+                return self._task_ids[namespace]
+        task_id = self.task_finder.get_taskid_by_namespace(self.task_finder.normalize_namespace(namespace))
+        with self._lock:
+            self._task_ids[namespace] = task_id
+        return task_id
+
+    def _resolve(self, item):
+        try:
+            if not item.task_id:
+                item.task_id = self._get_task_id(item.namespace)
+        except Exception as e:
+            logger.debug('Resolve [{}] failed: {}'.format(item, e))
+            item.error = e
+        return item
+
+    def _download(self, item):
+        if item.error is not None:
+            return item
+        try:
+            logger.info('Downloading [{}] from TaskID [{}] ...'.format(item.artifact_name, item.task_id))
+            item.local_file = self.downloader.download_latest_artifact(item.task_id, item.artifact_name,
+                                                                       item.dest_dir or self.dest_dir,
+                                                                       digest=item.digest)
+        except Exception as e:
+            logger.debug('Download [{}] failed: {}'.format(item, e))
+            item.error = e
+        return item
+
+    def check_collisions(self, items):
+        """
+        Check the different artifacts are not saved to the same local file.
+        e.g. 'public/a/log.txt' and 'public/b/log.txt' in one dest folder.
+        The artifacts are compared by the resolved TaskId, so the same artifact given by namespace and TaskId is
+        not a collision. Raise exception with all collisions if any.
+        @param items: the list of L{BatchItem}.
+        """
+        artifacts = {}
+        for item in items:
+            artifacts.setdefault(item.get_local_path(self.dest_dir), {})[
+                (item.task_id or item.namespace, item.artifact_name)] = str(item)
+        collisions = ['[{}] <- {}'.format(path, ', '.join('[{}]'.format(name) for name in sorted(names.values())))
+                      for path, names in sorted(artifacts.items()) if len(names) > 1]
+        if collisions:
+            raise Exception('The artifacts are saved to the same file, please narrow the pattern, '
+                            'or give them different dest folders by manifest: {}'.format('; '.join(collisions)))
+
+    def resolve(self, items):
+        """
+        Resolve the TaskId of items from their namespaces, each namespace is resolved once.
+        The item which can not be resolved gets the error.
+        @param items: the list of L{BatchItem}.
+        @return: the items.
+        """
+        pool = ThreadPool(min(self.jobs, len(items)) or 1)
+        try:
+            return pool.map(self._resolve, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run(self, items):
+        """
+        Resolve and download the items.
+        Raise exception before downloading if the different artifacts are saved to the same file.
+        @param items: the list of L{BatchItem}.
+        @return: the items, with local_file or error.
+        """
+        self.resolve(items)
+        self.check_collisions(items)
+        pool = ThreadPool(min(self.jobs, len(items)) or 1)
+        try:
+            return pool.map(self._download, items)
+        finally:
+            pool.close()
+            pool.join()
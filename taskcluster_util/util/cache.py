@@ -0,0 +1,277 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import stat
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# the ioctl request code for cloning file on Linux (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+def parse_size(size):
+    """
+    Parse the size string.
+    @param size: the size string. e.g. '1024', '500M', '10G'.
+    @return: the size in bytes.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def get_file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Get the SHA-256 hex digest of file.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _link_or_copy(origin, target, hardlink=True):
+    if hardlink:
+        try:
+            os.link(origin, target)
+            return
+        except (AttributeError, OSError) as e:
+            logger.debug('Can not hardlink [{}] to [{}]: {}'.format(origin, target, e))
+    try:
+        import fcntl
+        with open(origin, 'rb') as origin_fd:
+            with open(target, 'wb') as target_fd:
+                fcntl.ioctl(target_fd.fileno(), _FICLONE, origin_fd.fileno())
+        return
+    except (ImportError, IOError, OSError) as e:
+        logger.debug('Can not reflink [{}] to [{}]: {}'.format(origin, target, e))
+    shutil.copyfile(origin, target)
+
+
+def link_or_copy(origin, target, hardlink=True):
+    """
+    Put the origin file to target path by hardlink, reflink, or copy.
+    The file is put to a temporary path in the target folder first, then renamed to the target path,
+    so the target path is never missing or half-written.
+    @param origin: the origin file path.
+    @param target: the target file path, it will be replaced if it exists.
+    @param hardlink: try hardlink or not. The hardlinked files share the content, the in-place edit of one changes both.
+    """
+    if os.path.exists(target) and os.path.samefile(origin, target):
+        return
+    temp_path = '{}.{}-{}.tmp'.format(target, os.getpid(), threading.current_thread().ident)
+    try:
+        _link_or_copy(origin, temp_path, hardlink)
+        if os.name == 'nt' and os.path.exists(target):
+            os.remove(target)
+        os.rename(temp_path, target)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ArtifactCache(object):
+    """
+    The local artifact cache shared across runs.
+    The artifacts are stored by the SHA-256 of content, and indexed by (TaskId, artifact name).
+    The stored objects are read-only, and never hardlinked to the downloaded files,
+    so editing a downloaded file does not change the cached artifact.
+    """
+    DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+    _INDEX_FILE = 'index.json'
+    _OBJECTS_DIR = 'objects'
+    # the objects which are not indexed, and older than this (seconds), are removed.
+    # the younger ones may be indexed soon by another process.
+    _ORPHAN_GRACE = 10 * 60
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        @param cache_dir: the cache folder.
+        @param max_size: the max total size of cached artifacts. 0 for no limit.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.objects_dir = os.path.join(self.cache_dir, ArtifactCache._OBJECTS_DIR)
+        self.index_path = os.path.join(self.cache_dir, ArtifactCache._INDEX_FILE)
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir)
+
+    @staticmethod
+    def _get_key(task_id, artifact_name):
+        return u'{}/{}'.format(task_id, artifact_name)
+
+    def _get_object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as fd:
+                return json.load(fd)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        temp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            json.dump(index, fd)
+        if os.name == 'nt' and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.rename(temp_path, self.index_path)
+
+    def get_entry(self, task_id, artifact_name):
+        """
+        Get the cache entry of artifact.
+        @param task_id: the TaskId of artifact.
+        @param artifact_name: the artifact name.
+        @return: the entry dict. e.g. {'sha256': ..., 'size': ..., 'etag': ..., 'last_modified': ..., 'last_access': ...}
+        Or None if the artifact is not cached.
+        """
+        with self._lock:
+            entry = self._load_index().get(ArtifactCache._get_key(task_id, artifact_name))
+        if entry and os.path.isfile(self._get_object_path(entry['sha256'])):
+            return entry
+        return None
+
+    @staticmethod
+    def get_validators(entry):
+        """
+        Get the headers of conditional request for validating the cache entry.
+        @param entry: the cache entry.
+        @return: the headers dict.
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def materialize(self, entry, dest_path):
+        """
+        Put the cached artifact to dest path by reflink or copy, and update the access time of entry.
+        @param entry: the cache entry.
+        @param dest_path: the dest file path.
+        @return: the dest file path.
+        """
+        link_or_copy(self._get_object_path(entry['sha256']), dest_path, hardlink=False)
+        with self._lock:
+            index = self._load_index()
+            for item in index.values():
+                if item['sha256'] == entry['sha256']:
+                    item['last_access'] = time.time()
+            self._save_index(index)
+        return dest_path
+
+    def put(self, task_id, artifact_name, local_file, etag=None, last_modified=None, sha256=None):
+        """
+        Add the downloaded artifact into cache.
+        @param task_id: the TaskId of artifact.
+        @param artifact_name: the artifact name.
+        @param local_file: the downloaded file path.
+        @param etag: the ETag of artifact.
+        @param last_modified: the Last-Modified of artifact.
+        @param sha256: the SHA-256 of file, it will be computed if not given.
+        @return: the cache entry.
+        """
+        if not etag and not last_modified:
+            logger.debug('No validator of [{}], skip caching.'.format(artifact_name))
+            return None
+        sha256 = sha256 or get_file_sha256(local_file)
+        size = os.path.getsize(local_file)
+        if self.max_size and size > self.max_size:
+            logger.debug('[{}] is larger than the cache size, skip caching.'.format(artifact_name))
+            return None
+        object_path = self._get_object_path(sha256)
+        if not os.path.isfile(object_path):
+            link_or_copy(local_file, object_path, hardlink=False)
+            os.chmod(object_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        entry = {
+            'sha256': sha256,
+            'size': size,
+            'etag': etag,
+            'last_modified': last_modified,
+            'last_access': time.time()
+        }
+        with self._lock:
+            index = self._load_index()
+            index[ArtifactCache._get_key(task_id, artifact_name)] = entry
+            self._evict(index)
+            self._save_index(index)
+        logger.debug('Cached [{}] of TaskID [{}] as [{}].'.format(artifact_name, task_id, sha256))
+        return entry
+
+    def _get_objects(self, index):
+        """
+        Walk the objects folder, and remove the orphan objects and the temporary files which are out of grace.
+        The orphan object is left when its entry is replaced by put, or by the process losing the race of index.
+        @return: the dict {SHA-256: (last access, size)} of objects.
+        """
+        last_access = {}
+        for entry in index.values():
+            last_access[entry['sha256']] = max(last_access.get(entry['sha256'], 0), entry['last_access'])
+        objects = {}
+        now = time.time()
+        for name in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, name)
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            is_orphan = name not in last_access
+            if is_orphan and now - file_stat.st_mtime > ArtifactCache._ORPHAN_GRACE:
+                try:
+                    ArtifactCache._remove_object(path)
+                    logger.debug('Removed the orphan [{}] from cache.'.format(name))
+                    continue
+                except OSError as e:
+                    logger.debug(e)
+            objects[name] = (file_stat.st_mtime if is_orphan else last_access[name], file_stat.st_size)
+        return objects
+
+    def _evict(self, index):
+        """
+        Remove the least recently used objects until the total size of objects folder is under the max size.
+        The objects which are not indexed are counted, and evicted by their modified time.
+        """
+        objects = self._get_objects(index)
+        for key, entry in index.items():
+            if entry['sha256'] not in objects:
+                del index[key]
+        total_size = sum(size for _, size in objects.values())
+        if not self.max_size or total_size <= self.max_size:
+            return
+        for sha256, (_, size) in sorted(objects.items(), key=lambda item: item[1][0]):
+            if total_size <= self.max_size:
+                break
+            for key in [key for key, entry in index.items() if entry['sha256'] == sha256]:
+                del index[key]
+            try:
+                ArtifactCache._remove_object(self._get_object_path(sha256))
+            except OSError as e:
+                logger.debug(e)
+            total_size -= size
+            logger.debug('Evicted [{}] from cache.'.format(sha256))
+
+    @staticmethod
+    def _remove_object(path):
+        if os.name == 'nt':
+            # the read-only file can not be removed on Windows
+            os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import Queue
+import fnmatch
+import logging
+import threading
+
+from resilience import PartialResultError
+
+
+logger = logging.getLogger(__name__)
+
+
+class NamespaceCrawler(object):
+    TYPE_NAMESPACE = 'namespace'
+    TYPE_TASK = 'task'
+    _DONE = object()
+
+    def __init__(self, task_finder, workers=8, max_depth=None, includes=None, excludes=None):
+        """
+        Breadth-first crawler of the Index namespace tree.
+        @param task_finder: the L{TaskFinder}.
+        @param workers: the number of namespaces listed concurrently. Each listing loads the namespaces and tasks
+        in background, bound the Index API calls by the max_calls of L{TaskFinder}.
+        @param max_depth: the max depth under root namespace, None for no limit. 0 reports nothing.
+        @param includes: the glob patterns of namespace, only the matched namespaces and tasks are reported.
+        @param excludes: the glob patterns of namespace, the matched namespaces are not reported nor traversed.
+        """
+        self.task_finder = task_finder
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.includes = includes or []
+        self.excludes = excludes or []
+
+    @staticmethod
+    def _match(namespace, patterns):
+        return any(fnmatch.fnmatchcase(namespace, pattern) for pattern in patterns)
+
+    def _is_included(self, namespace):
+        return not self.includes or NamespaceCrawler._match(namespace, self.includes)
+
+    def _is_excluded(self, namespace):
+        return NamespaceCrawler._match(namespace, self.excludes)
+
+    def crawl(self, root=''):
+        """
+        Crawl the namespaces and tasks under root namespace.
+        The records are yielded while crawling, e.g.
+            {'type': 'namespace', 'namespace': 'foo.bar', 'depth': 1}
+            {'type': 'task', 'namespace': 'foo.bar.task', 'taskId': 'TASK_ID', 'depth': 2}
+        @param root: the root namespace.
+        @return: the generator of records.
+        """
+        pending_queue = Queue.Queue()
+        result_queue = Queue.Queue()
+        stop_event = threading.Event()
+        # the number of namespaces which are queued or being listed
+        unfinished = [1]
+        lock = threading.Lock()
+
+        def list_namespace(namespace, depth):
+            # the children of namespace are under the max depth
+            if self.max_depth is not None and depth >= self.max_depth:
+                return []
+            children = []
+            try:
+                # the namespaces and tasks are reported page by page while the later pages are loading
+                for page in self.task_finder.iter_namespaces_and_tasks(namespace):
+                    for child in page['namespaces']:
+                        if self._is_excluded(child):
+                            continue
+                        children.append(child)
+                        if self._is_included(child):
+                            result_queue.put({'type': NamespaceCrawler.TYPE_NAMESPACE, 'namespace': child,
+                                              'depth': depth + 1})
+                    for name, task_id in page['tasks']:
+                        if not self._is_excluded(name) and self._is_included(name):
+                            result_queue.put({'type': NamespaceCrawler.TYPE_TASK, 'namespace': name,
+                                              'taskId': task_id, 'depth': depth + 1})
+            except PartialResultError as e:
+                # keep crawling into the listed namespaces
+                logger.warning('The listing of namespace [{}] is incomplete: {}'.format(namespace, e.cause))
+            if self.max_depth is None or depth + 1 < self.max_depth:
+                return children
+            return []
+
+        def worker():
+            while True:
+                item = pending_queue.get()
+                if item is NamespaceCrawler._DONE or stop_event.is_set():
+                    return
+                namespace, depth = item
+                try:
+                    children = list_namespace(namespace, depth)
+                except Exception as e:
+                    logger.warning('Can not list namespace [{}]: {}'.format(namespace, e))
+                    children = []
+                with lock:
+                    unfinished[0] += len(children) - 1
+                    is_done = unfinished[0] == 0
+                for child in children:
+                    pending_queue.put((child, depth + 1))
+                if is_done:
+                    result_queue.put(NamespaceCrawler._DONE)
+
+        pending_queue.put((root, 0))
+        threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        is_finished = False
+        try:
+            while True:
+                record = result_queue.get()
+                if record is NamespaceCrawler._DONE:
+                    is_finished = True
+                    break
+                yield record
+        finally:
+            # stop the workers, and do not wait for the running calls if the crawling is stopped early
+            stop_event.set()
+            for _ in threads:
+                pending_queue.put(NamespaceCrawler._DONE)
+            if is_finished:
+                for thread in threads:
+                    thread.join()
@@ -2,23 +2,85 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+import re
+import time
+import fnmatch
 import shutil
+import hashlib
 import logging
-import urllib2
 import tempfile
+import threading
+import contextlib
 
-from progressbar import *
 import taskcluster
 
+from cache import ArtifactCache, link_or_copy
+from journal import DownloadJournal
+from url_cache import SignedUrlCache
+from resilience import PartialResultError, get_default_resilience
+from stats import NULL_STATS, QUEUE_API, SIGN, FIRST_BYTE, TRANSFER, DECODE, VERIFY, CACHE, PUBLISH, DOWNLOAD
+from integrity import IntegrityError, IncompleteContentError, StreamHasher, parse_digest, parse_checksums, \
+    get_file_digests, verify_digests
+from transfer import open_url, release_response, get_content_length, get_content_range, is_range_supported, \
+    is_gzip_encoded, copy_stream, split_missing_ranges, ensure_pool_maxsize, ChunkReader, NullProgress, \
+    ThrottledProgress, RangedFetcher, GzipDecoder, RangeNotSupportedError, MIN_CHUNK_SIZE, SEGMENT_RETRIES
+
 logger = logging.getLogger(__name__)
 
 
+class _Flight(object):
+    """
+    The in-process download of artifact, shared by the concurrent callers.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class Downloader(object):
-    def __init__(self, options={}):
+    # the in-process downloads, {(TaskId, artifact name): _Flight}
+    _flights = {}
+    _flights_lock = threading.Lock()
+    # the interval (seconds) of writing the journal of partial downloaded file
+    _JOURNAL_SAVE_INTERVAL = 1
+    _PARTIAL_SUFFIX = '.tcdl-part'
+
+    # the default expiration (seconds) of signed URL of taskcluster client
+    _SIGNED_URL_EXPIRATION = 15 * 60
+    _QUEUE_URL = 'https://queue.taskcluster.net/v1'
+
+    def __init__(self, options={}, connections=1, cache=None, show_progress=True, signed_url_cache=None,
+                 checksums_artifact=None, resilience=None, stats=None):
         """
         Ref: U{http://docs.taskcluster.net/queue/}
+        @param options: the options argument for connection. e.g. {'credentials': ...}
+        @param connections: the number of parallel connections for downloading one artifact.
+        @param cache: the L{ArtifactCache} for sharing the downloaded artifacts across runs.
+        @param show_progress: display the progress bar or not.
+        @param signed_url_cache: the L{SignedUrlCache}, a new one is created if not given.
+        @param checksums_artifact: the checksums artifact name of the same task, for verifying the downloads.
+        @param resilience: the L{Resilience} of API calls and downloads, the shared one is used if not given.
+        @param stats: the L{Stats} of API calls and download phases, None for no stats.
         """
-        self.queue = taskcluster.Queue(options)
+        # the API calls are retried by resilience, with jitter and the rate limit
+        queue_options = dict(options or {})
+        queue_options.setdefault('maxRetries', 0)
+        self.queue = taskcluster.Queue(queue_options)
+        self.resilience = resilience or get_default_resilience()
+        self.stats = stats or NULL_STATS
+        self._queue_url = (options.get('baseUrl') if options else None) or Downloader._QUEUE_URL
+        self.connections = connections
+        # keep the parallel connections of one artifact alive
+        ensure_pool_maxsize(connections)
+        self.cache = cache
+        self.show_progress = show_progress
+        self.signed_url_cache = signed_url_cache if signed_url_cache is not None else SignedUrlCache()
+        self.checksums_artifact = checksums_artifact
+        # the content of checksums artifacts, {TaskId: content}
+        self._checksums = {}
+        self._checksums_lock = threading.Lock()
 
     def get_latest_artifacts(self, task_id):
         """
@@ -26,77 +88,660 @@ class Downloader(object):
         @param task_id: the given task.
         @return: the artifacts list.
         """
-        ret = self.queue.listLatestArtifacts(task_id)
+        with self.stats.timer(QUEUE_API):
+            ret = self.resilience.call(self.queue.listLatestArtifacts, (task_id,), url=self._queue_url,
+                                       on_retry=lambda e: self.stats.add_retry(QUEUE_API, e))
         return ret
 
+    @staticmethod
+    def is_artifact_pattern(full_filename):
+        """
+        Check the artifact name is glob pattern or not.
+        @param full_filename: the given artifact name.
+        @return: True if the name has glob wildcards.
+        """
+        return any(char in full_filename for char in '*?[')
+
+    def find_artifacts(self, task_id, pattern=None, regex=None):
+        """
+        Find the latest artifacts of given task by glob pattern or regular expression.
+        @param task_id: the given task.
+        @param pattern: the glob pattern of artifact name. e.g. 'public/build/*.tar.gz'
+        @param regex: the regular expression, which is searched in artifact name.
+        @return: the matched artifact names list.
+        """
+        compiled_regex = re.compile(regex) if regex else None
+        names = []
+        for artifact in self.get_latest_artifacts(task_id).get('artifacts', []):
+            name = artifact.get('name')
+            if pattern and not fnmatch.fnmatchcase(name, pattern):
+                continue
+            if compiled_regex and not compiled_regex.search(name):
+                continue
+            names.append(name)
+        logger.debug('Matched artifacts: {}'.format(names))
+        return names
+
+    def _build_url(self, task_id, full_filename):
+        """
+        Sign the URL of artifact.
+        @return: the tuple (URL, the expiration timestamp of signature, or None if the URL is not signed).
+        """
+        with self.stats.timer(SIGN):
+            # if there is no credentials, then try to download artifact as public file
+            if not self.queue._hasCredentials():
+                return self.queue.buildUrl('getLatestArtifact', task_id, full_filename), None
+            expiration = self.queue.options.get('signedUrlExpiration', Downloader._SIGNED_URL_EXPIRATION)
+            expires = time.time() + float(expiration)
+            return self.queue.buildSignedUrl('getLatestArtifact', task_id, full_filename), expires
+
     def get_signed_url(self, task_id, full_filename):
-        # if there is no credentials, then try to download artifact as public file
-        return self.queue.buildSignedUrl('getLatestArtifact', task_id, full_filename) \
-            if self.queue._hasCredentials() \
-            else self.queue.buildUrl('getLatestArtifact', task_id, full_filename)
+        """
+        Get the signed URL of artifact. The signed URL is reused until it is going to expire.
+        @param task_id: the given TaskId.
+        @param full_filename: the artifact name.
+        @return: the URL.
+        """
+        if not self.queue._hasCredentials():
+            return self._build_url(task_id, full_filename)[0]
+        key = (task_id, full_filename, self.queue.options['credentials']['clientId'])
+        url = self.signed_url_cache.get(key)
+        if url is None:
+            url, expires = self._build_url(task_id, full_filename)
+            self.signed_url_cache.put(key, url, expires)
+        return url
+
+    def get_signed_urls(self, artifacts):
+        """
+        Get the signed URLs of many artifacts.
+        @param artifacts: the list of (TaskId, artifact name).
+        @return: the list of URLs.
+        """
+        return [self.get_signed_url(task_id, full_filename) for task_id, full_filename in artifacts]
+
+    def _get_checksums(self, task_id):
+        """
+        Get the content of checksums artifact of task, it is fetched once per task.
+        """
+        with self._checksums_lock:
+            if task_id in self._checksums:
+                return self._checksums[task_id]
+        try:
+            content = self.resilience.call(self._fetch_content, (task_id, self.checksums_artifact))
+        except Exception as e:
+            logger.debug(e)
+            raise IntegrityError('Can not get the checksums artifact [{}] of TaskID [{}].'.format(
+                self.checksums_artifact, task_id))
+        with self._checksums_lock:
+            self._checksums[task_id] = content
+        return content
+
+    def _fetch_content(self, task_id, full_filename):
+        return open_url(self.get_signed_url(task_id, full_filename)).content
+
+    def get_expected_digests(self, task_id, full_filename, digest=None):
+        """
+        Get the expected digests of artifact, from the given digest and the checksums artifact.
+        @param task_id: the given task.
+        @param full_filename: the given artifact name.
+        @param digest: the digest string. e.g. 'sha256:HEX'.
+        @return: the dict {algorithm: hex digest}, it's empty if there is nothing to verify.
+        """
+        expected_digests = {}
+        if self.checksums_artifact and self.checksums_artifact != full_filename:
+            expected_digests = parse_checksums(self._get_checksums(task_id), full_filename)
+            if not expected_digests:
+                logger.warning('[{}] is not listed in [{}], skip the checksums verification.'.format(
+                    full_filename, self.checksums_artifact))
+        if digest:
+            expected_digests.update(parse_digest(digest))
+        return expected_digests
 
-    def download_latest_artifact(self, task_id, full_filename, dest_dir):
+    @staticmethod
+    def get_partial_file(task_id, full_filename, dest_dir):
+        """
+        Get the partial file path for downloading artifact.
+        The partial file is in the dest folder, so it can be published by renaming.
+        The path is the same for the same artifact, so the partial downloaded file can be resumed.
+        @param task_id: the given task.
+        @param full_filename: the given artifact name.
+        @param dest_dir: the target local folder.
+        @return: the partial file path.
+        """
+        key = hashlib.sha1(u'{}/{}'.format(task_id, full_filename).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(dest_dir, '.{}.{}{}'.format(os.path.basename(full_filename), key, Downloader._PARTIAL_SUFFIX))
+
+    @staticmethod
+    def _get_fallback_partial_file(partial_file):
+        """
+        Get the partial file path in temp folder, for the dest folder which can not hold the partial file.
+        """
+        key = hashlib.sha1(partial_file.encode('utf-8')).hexdigest()[:16]
+        work_dir = os.path.join(tempfile.gettempdir(), 'tmp_tcdl_{}'.format(key))
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        return os.path.join(work_dir, os.path.basename(partial_file))
+
+    @staticmethod
+    def _can_create_file(path):
+        """
+        Check the file can be created or not.
+        """
+        existed = os.path.exists(path)
+        try:
+            with open(path, 'ab'):
+                pass
+            if not existed:
+                os.remove(path)
+            return True
+        except (IOError, OSError) as e:
+            logger.debug('Can not create [{}]: {}'.format(path, e))
+            return False
+
+    def download_latest_artifact(self, task_id, full_filename, dest_dir, digest=None):
         """
         Download latest artifact.
+        The artifact is downloaded into a partial file in the dest folder, then renamed to the final file,
+        so the final file is never half-written.
+        The partial downloaded file will be resumed if the artifact is not changed.
+        The concurrent downloads of the same artifact in one process share one download,
+        and the downloads in other processes wait for it by the file lock.
+        The content is hashed while downloading, and verified against the given digest and the checksums artifact.
+        The temporary errors are retried with backoff, and the resumable download continues from the written bytes.
+        L{PartialResultError} is raised if it still fails after some bytes of the resumable download are written.
         @param task_id: the given task.
         @param full_filename: the given artifact name.
         @param dest_dir: the target local folder.
+        @param digest: the expected digest. e.g. 'sha256:HEX'.
         @return: the downloaded file path.
         """
-        temp_dir = tempfile.mkdtemp(prefix='tmp_tcdl_')
+        abs_dest_dir = os.path.abspath(dest_dir) if dest_dir else os.getcwd()
+        final_file_path = os.path.join(abs_dest_dir, os.path.basename(full_filename))
+        key = (task_id, full_filename)
+        while True:
+            flight, is_leader = Downloader._join_flight(key)
+            if is_leader:
+                break
+            logger.info('Waiting for the downloading [{}] of TaskID [{}] ...'.format(full_filename, task_id))
+            flight.done.wait()
+            if flight.error is None:
+                # the shared download is verified against the digest of its leader, not this one
+                self._verify_file(flight.result, self.get_expected_digests(task_id, full_filename, digest),
+                                  full_filename)
+                if flight.result != final_file_path:
+                    FolderHandler(abs_dest_dir)
+                    # the callers own their files, the in-place edit of one does not change the others
+                    link_or_copy(flight.result, final_file_path, hardlink=False)
+                return final_file_path
+            # the shared download failed, try again
+        try:
+            origin_stat = Downloader._get_file_stat(final_file_path)
+            with self._lock_artifact(task_id, full_filename, abs_dest_dir) as is_waited:
+                # without cache, check the final file is published by another process or not
+                stat = Downloader._get_file_stat(final_file_path) if is_waited and not self.cache else None
+                expected_digests = self.get_expected_digests(task_id, full_filename, digest)
+                if stat and stat != origin_stat:
+                    logger.info('[{}] is downloaded by another process.'.format(full_filename))
+                    self._verify_file(final_file_path, expected_digests, full_filename)
+                    flight.result = final_file_path
+                else:
+                    with self.stats.timer(DOWNLOAD) as timer:
+                        flight.result = self.resilience.call(
+                            self._download_latest_artifact, (task_id, full_filename, abs_dest_dir, expected_digests),
+                            on_retry=lambda e: self.stats.add_retry(DOWNLOAD, e))
+                        if self.stats.enabled:
+                            timer.bytes_count = os.path.getsize(flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            Downloader._leave_flight(key, flight)
+
+    def _verify_file(self, path, expected_digests, full_filename):
+        """
+        Verify the file downloaded by another caller or process against the expected digests.
+        Raise L{IntegrityError} if it does not match.
+        @param path: the downloaded file path.
+        @param expected_digests: the expected dict {algorithm: hex digest}.
+        @param full_filename: the given artifact name.
+        """
+        if not expected_digests:
+            return
+        with self.stats.timer(VERIFY):
+            verify_digests(get_file_digests(path, expected_digests.keys()), expected_digests, full_filename)
+
+    @staticmethod
+    def _join_flight(key):
+        """
+        Join the in-process download of artifact, or start a new one.
+        @return: the tuple (L{_Flight}, True if it's a new one).
+        """
+        with Downloader._flights_lock:
+            flight = Downloader._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = _Flight()
+            Downloader._flights[key] = flight
+            return flight, True
+
+    @staticmethod
+    def _leave_flight(key, flight):
+        with Downloader._flights_lock:
+            if Downloader._flights.get(key) is flight:
+                del Downloader._flights[key]
+        flight.done.set()
+
+    @staticmethod
+    def _get_file_stat(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_ino, stat.st_size, stat.st_mtime
+        except OSError:
+            return None
+
+    def _get_lock_file(self, task_id, full_filename, dest_dir):
+        """
+        Get the lock file path of downloading artifact across processes.
+        With cache, the downloads into different folders share the lock, and the later ones get it from cache.
+        """
+        if self.cache:
+            lock_dir = os.path.join(self.cache.cache_dir, 'locks')
+            name = u'{}/{}'.format(task_id, full_filename)
+        else:
+            lock_dir = os.path.join(tempfile.gettempdir(), 'tcdl_locks')
+            name = u'{}/{}/{}'.format(task_id, full_filename, dest_dir)
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir)
+        return os.path.join(lock_dir, '{}.lock'.format(hashlib.sha1(name.encode('utf-8')).hexdigest()))
+
+    @contextlib.contextmanager
+    def _lock_artifact(self, task_id, full_filename, dest_dir):
+        """
+        Hold the file lock of artifact, for one download at a time across processes.
+        The lock is skipped if the platform does not support it.
+        @return: the context manager, which gives True if it waited for another process.
+        """
+        try:
+            import fcntl
+            lock_fd = open(self._get_lock_file(task_id, full_filename, dest_dir), 'a')
+        except (ImportError, IOError, OSError) as e:
+            logger.debug('Can not lock [{}]: {}'.format(full_filename, e))
+            yield False
+            return
+        is_waited = False
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                is_waited = True
+                logger.info('Waiting for the downloading [{}] in another process ...'.format(full_filename))
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield is_waited
+        finally:
+            lock_fd.close()
+
+    def _download_latest_artifact(self, task_id, full_filename, abs_dest_dir, expected_digests=None):
+        expected_digests = expected_digests or {}
         base_filename = os.path.basename(full_filename)
+        dest_folder = FolderHandler(abs_dest_dir)
+        final_file_path = os.path.join(abs_dest_dir, base_filename)
+        temp_local_file = self.get_partial_file(task_id, full_filename, abs_dest_dir)
+        is_in_dest_dir = self._can_create_file(temp_local_file)
+        if not is_in_dest_dir:
+            temp_local_file = self._get_fallback_partial_file(temp_local_file)
+            logger.debug('Download into temporary file: [{}]'.format(temp_local_file))
 
-        signed_url = self.get_signed_url(task_id, full_filename)
-        url_handler = urllib2.urlopen(signed_url)
+        headers = {}
+        cache_entry = None
+        journal = DownloadJournal.load(temp_local_file, task_id, full_filename)
+        if journal:
+            # ask for the missing content only, if the artifact is not changed
+            missing_ranges = journal.get_missing_ranges()
+            resume_offset = missing_ranges[0][0] if missing_ranges else journal.total_length - 1
+            headers = {'Range': 'bytes={}-'.format(resume_offset), 'If-Range': journal.validator}
+        elif self.cache:
+            # ask for the content only if the cached artifact is modified
+            cache_entry = self.cache.get_entry(task_id, full_filename)
+            if cache_entry and cache_entry['sha256'] != expected_digests.get('sha256', cache_entry['sha256']):
+                logger.info('The cached [{}] does not match the expected SHA-256, download it again.'.format(
+                    full_filename))
+                cache_entry = None
+            if cache_entry:
+                headers = ArtifactCache.get_validators(cache_entry)
 
-        total_length = 0
-        content_length = url_handler.info().getheader('Content-Length')
-        if content_length is not None:
-            total_length = int(content_length.strip())
+        # sign a new URL, the reused one may expire during a long download
+        signed_url = self._build_url(task_id, full_filename)[0]
+        # connect, TLS, and wait for the response headers
+        with self.stats.timer(FIRST_BYTE):
+            response = open_url(signed_url, headers)
+        if response.status_code == 304 and cache_entry:
+            release_response(response)
+            logger.info('[{}] is not modified, use the cached artifact.'.format(full_filename))
+            with self.stats.timer(CACHE) as timer:
+                self.cache.materialize(cache_entry, final_file_path)
+                timer.bytes_count = cache_entry['size']
+                # the cache objects are stored by SHA-256, other algorithms need to read the file
+                other_digests = dict((algorithm, hex_digest) for algorithm, hex_digest in expected_digests.items()
+                                     if algorithm != 'sha256')
+                if other_digests:
+                    verify_digests(get_file_digests(final_file_path, other_digests), other_digests, full_filename)
+            return final_file_path
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
 
-        # handle GZip format
-        is_gzip = False
-        content_encoding = url_handler.info().getheader('Content-Encoding')
-        if content_encoding and 'gzip' in content_encoding.strip():
-            logger.debug('Content-Encoding={}'.format(content_encoding))
-            is_gzip = True
+        content_range = get_content_range(response) if response.status_code == 206 else None
+        # the reason of downloading by single connection, when it can not be resumed
+        single_reason = None
+        if journal and content_range and content_range[2] == journal.total_length:
+            logger.info('Resume downloading from {} of {} bytes.'.format(journal.get_completed_size(), journal.total_length))
+        else:
+            if journal:
+                logger.debug('The artifact has been changed, download it again.')
+            if content_range:
+                response.close()
+                response = open_url(signed_url)
+            content_range = None
+            journal = None
+            if is_gzip_encoded(response):
+                # the GZip content is decoded while downloading, so it can not be resumed
+                single_reason = 'The content is GZip encoded'
+            else:
+                single_reason = Downloader._get_unresumable_reason(response)
+                if single_reason is None:
+                    journal = self._create_journal(response, temp_local_file, task_id, full_filename)
+        total_length = journal.total_length if journal else get_content_length(response)
 
-        chunk_size = 1024
-        current_size = 0
-        # download file into temp folder
-        temp_local_file = os.path.join(temp_dir, base_filename)
-        with open(temp_local_file, 'wb') as fd:
+        # handle GZip format, the resumable content is never encoded
+        is_gzip = is_gzip_encoded(response)
+
+        # hash the content while downloading, the cache is indexed by SHA-256
+        algorithms = set(expected_digests)
+        if self.cache:
+            algorithms.add('sha256')
+        hasher = StreamHasher(algorithms) if algorithms else None
+
+        # download file into partial file
+        if self.show_progress:
+            # the progress bar is loaded only when it is displayed
+            from progressbar import ProgressBar, AnimatedMarker, Percentage, SimpleProgress, ETA, FileTransferSpeed
             progress_format = ['Progress: ', AnimatedMarker(), ' ', Percentage(), ', ', SimpleProgress(), ', ', ETA(), ' ', FileTransferSpeed()]
-            progress = ProgressBar(widgets=progress_format, maxval=total_length).start()
+            progress = ThrottledProgress(ProgressBar(widgets=progress_format, maxval=total_length).start())
+        else:
+            progress = NullProgress()
+        with self.stats.timer(TRANSFER) as timer:
+            if journal is None:
+                if self.connections > 1:
+                    logger.debug('{}, download by single connection.'.format(single_reason))
+                decoder = GzipDecoder() if is_gzip else None
+                try:
+                    timer.bytes_count = self._download_stream(response, temp_local_file, total_length, progress,
+                                                              decoder, hasher, self.stats)
+                except:
+                    # it can not be resumed, remove it
+                    self._remove_file(temp_local_file)
+                    raise
+            else:
+                if content_range or self.connections > 1:
+                    # the content is not written in order, it is hashed after downloading
+                    hasher = None
+                completed_size = journal.get_completed_size()
+                try:
+                    self._download_missing_ranges(response, content_range, journal, progress, hasher)
+                except Exception as e:
+                    # keep the partial downloaded file and journal for resuming
+                    journal.save()
+                    logger.debug('Partial downloaded file: [{}]'.format(temp_local_file))
+                    raise PartialResultError('Downloaded {} of {} bytes of [{}]: {}'.format(
+                        journal.get_completed_size(), journal.total_length, full_filename, e),
+                        partial_result=temp_local_file, resume_from=journal.get_completed_size(), cause=e)
+                except:
+                    journal.save()
+                    raise
+                journal.remove()
+                timer.bytes_count = journal.total_length - completed_size
+        progress.finish()
+
+        digests = hasher.hexdigests() if hasher else {}
+        if expected_digests:
+            with self.stats.timer(VERIFY):
+                if not hasher:
+                    digests = get_file_digests(temp_local_file, algorithms)
+                try:
+                    verify_digests(digests, expected_digests, full_filename)
+                except IntegrityError:
+                    self._remove_file(temp_local_file)
+                    raise
+
+        # publish the partial file to dest folder
+        try:
+            with self.stats.timer(PUBLISH):
+                if is_in_dest_dir:
+                    dest_folder.move_element_from(temp_local_file, base_filename)
+                else:
+                    dest_folder.copy_elements_from(temp_local_file, name=base_filename)
+                    # remove temp folder
+                    work_dir = os.path.dirname(temp_local_file)
+                    try:
+                        shutil.rmtree(work_dir)  # delete directory
+                    except OSError:
+                        logger.warning('Can not remove temporary folder: {}'.format(work_dir))
+        except Exception as e:
+            logger.debug(e)
+            raise Exception('Can not publish [{}] to [{}], the downloaded file is [{}]: {}'.format(
+                full_filename, final_file_path, temp_local_file, e))
+
+        if self.cache:
+            try:
+                self.cache.put(task_id, full_filename, final_file_path, etag=etag, last_modified=last_modified,
+                               sha256=digests.get('sha256'))
+            except Exception as e:
+                logger.warning('Can not add [{}] into cache: {}'.format(full_filename, e))
+        return final_file_path
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.debug(e)
+
+    @staticmethod
+    def _get_unresumable_reason(response):
+        """
+        Check the response can be downloaded by byte ranges and resumed or not.
+        The byte ranges need the validator, so the ranges of a changed artifact are not mixed.
+        @return: the reason why it can not be resumed, or None if it can be resumed.
+        """
+        if get_content_length(response) <= 0:
+            return 'Server does not send the Content-Length'
+        if not is_range_supported(response):
+            return 'Server does not support byte ranges'
+        if not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            return 'Server does not send the ETag or Last-Modified for validating byte ranges'
+        return None
+
+    @staticmethod
+    def _create_journal(response, local_file, task_id, full_filename):
+        """
+        Create the journal and the empty local file for resumable downloading.
+        @return: the journal, or None if the response can not be resumed.
+        """
+        reason = Downloader._get_unresumable_reason(response)
+        if reason:
+            logger.debug('The artifact can not be resumed: {}.'.format(reason))
+            return None
+        total_length = get_content_length(response)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with open(local_file, 'wb') as fd:
+            fd.truncate(total_length)
+        journal = DownloadJournal(local_file, task_id, full_filename, etag=etag, last_modified=last_modified,
+                                  total_length=total_length, content_encoding=response.headers.get('Content-Encoding'))
+        journal.save()
+        return journal
+
+    @staticmethod
+    def _download_stream(response, local_file, total_length, progress, decoder=None, hasher=None, stats=NULL_STATS):
+        """
+        Download the content of response by single connection.
+        Raise L{IntegrityError} if the received size does not match the Content-Length.
+        @param decoder: the L{GzipDecoder} for decoding the content while downloading.
+        @param hasher: the L{StreamHasher} of the decoded content.
+        @param stats: the L{Stats} for the decoding time.
+        @return: the received size.
+        """
+        if decoder and stats.enabled:
+            decoder = _TimedDecoder(decoder)
+        current_size = 0
+        reader = ChunkReader(response.raw)
+        with open(local_file, 'wb') as fd:
             while True:
-                chunk = url_handler.read(chunk_size)
+                chunk = reader.read()
                 current_size = current_size + len(chunk)
                 if not chunk:
                     break
-                fd.write(chunk)
+                for data in decoder.iter_decode(chunk) if decoder else (chunk,):
+                    fd.write(data)
+                    if hasher:
+                        hasher.update(data)
                 if total_length > 0:
                     if current_size > total_length:
-                        # the content-length is not correct
-                        progress.maxval = current_size + chunk_size
+                        break
                     progress.update(current_size)
-        progress.finish()
+            if decoder:
+                data = decoder.flush()
+                fd.write(data)
+                if hasher:
+                    hasher.update(data)
+        release_response(response)
+        if decoder and stats.enabled:
+            stats.record(DECODE, decoder.seconds, decoder.decoded_size)
+        # the Content-Length is the size of encoded content, which is the size of received chunks
+        if total_length > 0 and current_size != total_length:
+            raise IncompleteContentError('Received {} of {} bytes.'.format(current_size, total_length))
+        return current_size
 
-        # move file to dest folder
-        final_file_path = temp_local_file
-        abs_dest_dir = os.path.abspath(dest_dir) if dest_dir else os.getcwd()
-        try:
-            FolderHandler(abs_dest_dir).copy_elements_from(temp_local_file, is_gzip)
-            final_file_path = os.path.join(abs_dest_dir, base_filename)
-            # remove temp folder
+    def _download_missing_ranges(self, response, content_range, journal, progress, hasher=None):
+        """
+        Download the missing ranges of journal, and mark the written ranges as completed.
+        The broken or short ranges are retried for the remaining bytes.
+        If the server does not honour the parallel byte ranges, the content is downloaded by single connection.
+        @param response: the response, which is the full content or the partial content from content_range.
+        @param content_range: the Content-Range tuple of url handler, or None if it is the full content.
+        @param journal: the journal of local file.
+        @param progress: the progress bar.
+        @param hasher: the L{StreamHasher}, the content is hashed in order by single connection.
+        """
+        lock = threading.Lock()
+        last_saved = [time.time()]
+
+        def on_written(start, end):
+            journal.add_range(start, end)
+            with lock:
+                progress.update(journal.get_completed_size())
+                # keep the journal on disk up to date, for resuming after interrupted
+                if time.time() - last_saved[0] > Downloader._JOURNAL_SAVE_INTERVAL:
+                    journal.save()
+                    last_saved[0] = time.time()
+
+        missing_ranges = journal.get_missing_ranges()
+        ranges = split_missing_ranges(missing_ranges, self.connections) if self.connections > 1 else missing_ranges
+        progress.update(journal.get_completed_size())
+        if not missing_ranges:
+            response.close()
+            return
+        # fetch the ranges from the redirected url
+        ranged_url = response.url
+        if self.connections > 1 and len(ranges) > 1:
+            response.close()
+            logger.debug('Downloading {} ranges by {} connections.'.format(len(ranges), self.connections))
             try:
-                shutil.rmtree(temp_dir)  # delete directory
-            except OSError:
-                logger.warning('Can not remove temporary folder: {}'.format(self.temp_dir))
+                RangedFetcher(ranged_url, journal.local_file, ranges, self.connections, on_written,
+                              on_retry=lambda e: self.stats.add_retry(TRANSFER, e)).run()
+                return
+            except RangeNotSupportedError as e:
+                # the server advertises byte ranges, but does not honour them
+                logger.debug('{} Download by single connection.'.format(e))
+            response = open_url(ranged_url)
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if validator != journal.validator:
+                response.close()
+                raise IncompleteContentError('The artifact is changed while downloading.')
+            content_range = None
+        offset = content_range[0] if content_range else 0
+        attempt = 0
+        while True:
+            offset, error = Downloader._copy_response(response, journal, offset, on_written, hasher)
+            if offset == journal.total_length:
+                break
+            if attempt >= SEGMENT_RETRIES:
+                raise IncompleteContentError('Connection closed at {} of {} bytes.'.format(offset,
+                                                                                         journal.total_length))
+            attempt += 1
+            logger.debug('Connection closed at {} of {} bytes, retry {}: {}'.format(offset, journal.total_length,
+                                                                                  attempt, error))
+            self.stats.add_retry(TRANSFER, error)
+            time.sleep(self.resilience.get_backoff(attempt, error))
+            # ask for the remaining bytes, if the artifact is not changed
+            response = open_url(ranged_url, {'Range': 'bytes={}-'.format(offset), 'If-Range': journal.validator})
+            remaining_range = get_content_range(response) if response.status_code == 206 else None
+            if remaining_range is None or remaining_range[0] != offset:
+                response.close()
+                raise IncompleteContentError('The artifact is changed while downloading.')
+
+    @staticmethod
+    def _copy_response(response, journal, offset, on_written, hasher):
+        """
+        Copy the response into the journal file from offset.
+        @return: the tuple (the end offset of written content, the error or None).
+        """
+        written = [offset]
+
+        def on_chunk_written(start, end):
+            written[0] = end
+            on_written(start, end)
+
+        error = None
+        try:
+            with open(journal.local_file, 'r+b') as fd:
+                copy_stream(response, fd, offset, journal.total_length, on_chunk_written, hasher)
         except Exception as e:
-            logger.error(e.message)
-            logger.debug('local file: [{}]'.format(temp_local_file))
+            error = e
+        finally:
+            release_response(response)
+        return written[0], error
 
-        return final_file_path
+
+class _TimedDecoder(object):
+    """
+    The decoder which counts the decoding time and the decoded size, when the stats are on.
+    """
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.seconds = 0.0
+        self.decoded_size = 0
+
+    def _timed(self, func, *args):
+        started = time.time()
+        data = func(*args)
+        self.seconds += time.time() - started
+        self.decoded_size += len(data)
+        return data
+
+    def iter_decode(self, chunk):
+        pieces = self.decoder.iter_decode(chunk)
+        while True:
+            started = time.time()
+            data = next(pieces, None)
+            self.seconds += time.time() - started
+            if data is None:
+                return
+            self.decoded_size += len(data)
+            yield data
+
+    def flush(self):
+        return self._timed(self.decoder.flush)
 
 
 class FolderHandler:
@@ -123,17 +768,37 @@ class FolderHandler:
             logger.debug('errno: [{}], strerror: [{}], filename: [{}]'.format(e.errno, e.strerror, e.filename))
             raise Exception('Can not create the folder: [{}]'.format(self.path))
 
-    def copy_elements_from(self, origin, is_gzip=False):
+    def copy_elements_from(self, origin, is_gzip=False, name=None):
         """
         Copy file from origin to target folder.
         @param origin: the origin file path.
+        @param is_gzip: decode the origin file by GZip or not.
+        @param name: the target file name. (default: the name of origin file)
         """
+        target = os.path.join(self.path, name or os.path.basename(origin))
         if is_gzip:
-            import gzip
             logger.debug('Doing gzip decode...')
-            with gzip.open(origin, 'rb') as gzip_buffer:
-                file_content = gzip_buffer.read()
-                with open(os.path.join(self.path, os.path.basename(origin)), 'wb') as fd:
-                    fd.write(file_content)
+            decoder = GzipDecoder()
+            with open(origin, 'rb') as origin_fd:
+                with open(target, 'wb') as fd:
+                    while True:
+                        chunk = origin_fd.read(MIN_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        for data in decoder.iter_decode(chunk):
+                            fd.write(data)
+                    fd.write(decoder.flush())
         else:
-            shutil.copy(origin, self.path)
+            shutil.copy(origin, target)
+
+    def move_element_from(self, origin, name=None):
+        """
+        Move file from origin to target folder by renaming, the origin file should be in the same file system.
+        The existing target file is replaced atomically, except on Windows.
+        @param origin: the origin file path.
+        @param name: the target file name. (default: the name of origin file)
+        """
+        target = os.path.join(self.path, name or os.path.basename(origin))
+        if os.name == 'nt' and os.path.exists(target):
+            os.remove(target)
+        os.rename(origin, target)
@@ -2,15 +2,144 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import Queue
 import logging
+import functools
+import threading
 
 import taskcluster
+from index_cache import get_min_expires, parse_expires
+from resilience import PartialResultError, get_default_resilience
+from stats import NULL_STATS, RESOLVE, INDEX_API
 
 
 logger = logging.getLogger(__name__)
 
 
+class Resolution(object):
+    """
+    The resolved result of namespace.
+    """
+    TASK = 'task'
+    NAMESPACE = 'namespace'
+    NOT_FOUND = 'not_found'
+
+    def __init__(self, kind, namespace, task_id=None, rank=None, expires=None):
+        """
+        @param kind: L{Resolution.TASK}, L{Resolution.NAMESPACE}, or L{Resolution.NOT_FOUND}.
+        @param namespace: the namespace.
+        @param task_id: the TaskId of task.
+        @param rank: the rank of task.
+        @param expires: the expires of task.
+        """
+        self.kind = kind
+        self.namespace = namespace
+        self.task_id = task_id
+        self.rank = rank
+        self.expires = expires
+
+    @property
+    def is_task(self):
+        return self.kind == Resolution.TASK
+
+    @property
+    def is_namespace(self):
+        return self.kind == Resolution.NAMESPACE
+
+    @property
+    def is_not_found(self):
+        return self.kind == Resolution.NOT_FOUND
+
+    def __repr__(self):
+        return '<Resolution {} [{}] {}>'.format(self.kind, self.namespace, self.task_id or '')
+
+
+class ListingIterator(object):
+    """
+    Iterate the items of Index listing API, e.g. listNamespaces and listTasks, page by page.
+    The next page is prefetched in background while the items of current page are consumed.
+    """
+
+    def __init__(self, list_method, items_key, ns_node='', limit=1000, continuation_token=None, parse_item=None,
+                 prefetch=True):
+        """
+        @param list_method: the listing API method. e.g. Index.listNamespaces.
+        @param items_key: the key of items in API result. e.g. 'namespaces'.
+        @param ns_node: the given namespace.
+        @param limit: 1-1000, the return list of API up to 1000 items per-call.
+        @param continuation_token: resume the listing from the saved continuation token.
+        @param parse_item: the function converts the item of API, the item is skipped if it returns None.
+        @param prefetch: fetch the next page in background.
+        """
+        self.list_method = list_method
+        self.items_key = items_key
+        self.ns_node = ns_node
+        self.limit = limit
+        self.parse_item = parse_item
+        self.prefetch = prefetch
+        # the token of the page which the last yielded item comes from
+        self.continuation_token = continuation_token
+
+    def _fetch(self, token):
+        payload = {TaskFinder._LIMIT: self.limit}
+        if token:
+            payload[TaskFinder._CONTINUATION_TOKEN] = token
+        ret = self.list_method(self.ns_node, payload)
+        return ret.get(self.items_key) or [], ret.get(TaskFinder._CONTINUATION_TOKEN)
+
+    def _fetch_in_background(self, token):
+        result = {}
+
+        def fetch():
+            try:
+                result['page'] = self._fetch(token)
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+
+        def wait():
+            thread.join()
+            if 'error' in result:
+                raise result['error']
+            return result['page']
+        return wait
+
+    def pages(self):
+        """
+        Raise L{PartialResultError} with the continuation token of the failed page, if it fails after the first page.
+        @return: the generator of the raw items list of each page.
+        """
+        token = self.continuation_token
+        page = self._fetch(token)
+        while True:
+            items, next_token = page
+            if next_token:
+                # prefetch the next page while the current page is consumed
+                wait = self._fetch_in_background(next_token) if self.prefetch else lambda: self._fetch(next_token)
+            self.continuation_token = token
+            yield items
+            if not next_token:
+                break
+            try:
+                page = wait()
+            except Exception as e:
+                raise PartialResultError('Listing [{}] stopped at continuation token [{}]: {}'.format(
+                    self.ns_node, next_token, e), resume_from=next_token, cause=e)
+            token = next_token
+
+    def __iter__(self):
+        for items in self.pages():
+            for item in items:
+                value = self.parse_item(item) if self.parse_item else item
+                if value is not None:
+                    yield value
+
+
 class TaskFinder(object):
+    _INDEX_URL = 'https://index.taskcluster.net/v1'
     _NODE = 'node'
     _NAMESPACES = 'namespaces'
     _TASKS = 'tasks'
@@ -20,11 +149,63 @@ class TaskFinder(object):
     _TASK = 'task'
     _TASK_ID = 'taskId'
 
-    def __init__(self, options={}):
+    def __init__(self, options={}, cache=None, resilience=None, stats=None, max_calls=None):
         """
         Ref: U{http://docs.taskcluster.net/services/index/}
+        @param options: the options argument for connection.
+        @param cache: the L{IndexCache} of Index API results, None for no cache.
+        @param resilience: the L{Resilience} of API calls, the shared one is used if not given.
+        @param stats: the L{Stats} of resolving and API calls, None for no stats.
+        @param max_calls: the max number of concurrent Index API calls, including the background listings,
+        None for no limit.
         """
-        self.index = taskcluster.Index(options)
+        # the API calls are retried by resilience, with jitter and the rate limit
+        index_options = dict(options or {})
+        index_options.setdefault('maxRetries', 0)
+        self.index = taskcluster.Index(index_options)
+        self.cache = cache
+        self.resilience = resilience or get_default_resilience()
+        self.stats = stats or NULL_STATS
+        self._base_url = options.get('baseUrl', '') if options else ''
+        self._resolutions = {}
+        self._resolutions_lock = threading.Lock()
+        self._call_slots = threading.BoundedSemaphore(max_calls) if max_calls else None
+
+    def _cached_call(self, method, ns_node, fetch):
+        """
+        Get the result from cache, or call the Index API by fetch function.
+        @param method: the name of API method.
+        @param ns_node: the namespace argument of API method.
+        @param fetch: the function returns (result, expires timestamp).
+        @return: the result.
+        """
+        if self.cache is None:
+            return fetch()[0]
+        return self.cache.fetch(self._get_cache_key(method, ns_node), fetch)
+
+    def _get_cache_key(self, method, ns_node):
+        return '{} {} {}'.format(self._base_url, method, ns_node)
+
+    def _call(self, method, *args):
+        """
+        Call the Index API method, with retries and the rate limit of Index host.
+        @param method: the name of API method.
+        @return: the result.
+        """
+        with self.stats.timer(INDEX_API):
+            return self.resilience.call(self._call_in_slot, (getattr(self.index, method),) + args,
+                                        url=self._base_url or TaskFinder._INDEX_URL,
+                                        on_retry=lambda e: self.stats.add_retry(INDEX_API, e))
+
+    def _call_in_slot(self, api_method, *args):
+        """
+        Call the API method in one of the slots of max concurrent calls.
+        The slot is not held while backing off between retries.
+        """
+        if self._call_slots is None:
+            return api_method(*args)
+        with self._call_slots:
+            return api_method(*args)
 
     def is_root(self, ns_node):
         """
@@ -43,13 +224,63 @@ class TaskFinder(object):
         @param namespace: the given namespace.
         @return: True if it's task. False if it's namespace.
         """
+        return self.resolve(namespace).is_task
+
+    @staticmethod
+    def _is_not_found_error(e):
+        return getattr(e, 'status_code', None) == 404
+
+    def resolve(self, namespace, use_memo=True):
+        """
+        Resolve the given namespace into task, namespace, or not found.
+        The result is memoized. The errors other than 404 Not Found, e.g. network errors, are raised.
+        @param namespace: the given namespace.
+        @param use_memo: use and keep the memoized result or not. The long running callers should not use the memo,
+        since the namespaces are re-pointed to the new tasks. The result still comes from the Index cache if any.
+        @return: the L{Resolution}.
+        """
+        if use_memo:
+            with self._resolutions_lock:
+                if namespace in self._resolutions:
+                    return self._resolutions[namespace]
+        with self.stats.timer(RESOLVE):
+            resolution = self._resolve(namespace)
+        logger.debug('Resolved {}'.format(resolution))
+        if use_memo:
+            with self._resolutions_lock:
+                self._resolutions[namespace] = resolution
+        return resolution
+
+    def _resolve(self, namespace):
+        if self.is_root(namespace):
+            return Resolution(Resolution.NAMESPACE, namespace)
         try:
-            # if it's a task
-            self.index.findTask(namespace)
-            return True
-        except:
-            # except if it's not task
-            return False
+            # format {'data':..., 'expires':..., 'namespace':..., 'rank':..., 'taskId':...}
+            ret = self._cached_call('findTask', namespace, lambda: self._fetch_task(namespace))
+            return Resolution(Resolution.TASK, namespace, task_id=ret.get(TaskFinder._TASK_ID),
+                              rank=ret.get('rank'), expires=ret.get('expires'))
+        except Exception as e:
+            if not TaskFinder._is_not_found_error(e):
+                raise
+        # the namespace exists only if there are namespaces or tasks under it
+        payload = {TaskFinder._LIMIT: 1}
+        if self._call('listNamespaces', namespace, payload).get(TaskFinder._NAMESPACES) or \
+                self._call('listTasks', namespace, payload).get(TaskFinder._TASKS):
+            return Resolution(Resolution.NAMESPACE, namespace)
+        return Resolution(Resolution.NOT_FOUND, namespace)
+
+    @staticmethod
+    def normalize_namespace(namespace):
+        """
+        Remove the 'index.' and 'root.' of namespace.
+        @param namespace: the given namespace.
+        @return: the namespace for Index API.
+        """
+        for prefix in ('index.', 'root.'):
+            if namespace.startswith(prefix):
+                logger.debug('Remove the ["{}"] of Namespace [{}].'.format(prefix, namespace))
+                return namespace[len(prefix):]
+        return namespace
 
     def get_taskid_by_namespace(self, namespace):
         """
@@ -59,9 +290,14 @@ class TaskFinder(object):
         """
         if namespace is None or namespace is "":
             return None
-        # format {'data':..., 'expires':..., 'namespace':..., 'rank':..., 'taskId':...}
-        ret = self.index.findTask(namespace)
-        return ret['taskId']
+        resolution = self.resolve(namespace)
+        if not resolution.is_task:
+            raise Exception('Can not find the task of Namespace [{}].'.format(namespace))
+        return resolution.task_id
+
+    def _fetch_task(self, namespace):
+        ret = self._call('findTask', namespace)
+        return ret, parse_expires(ret.get('expires'))
 
     def get_parent_namespace(self, ns_node=''):
         """
@@ -76,74 +312,204 @@ class TaskFinder(object):
             ret = ''
         return '.'.join(ret)
 
-    def get_namespaces(self, ns_node='', limit=1000):
+    def get_namespaces(self, ns_node='', limit=1000, strict=False):
         """
         Get the namespaces of given namespace.
         @param ns_node: given namespace.
         @param limit: 1-1000, the return list of API up to 1000 namespace per-call.
+        @param strict: raise the errors, and the L{PartialResultError} with the received namespaces.
         @return: return the namespaces list. e.g. [NAME, ...]
         """
-        result_list = []
-        continuationToken = None
+        return self._get_listing('listNamespaces', ns_node, lambda: self._fetch_namespaces(ns_node, limit), strict)
+
+    def _get_listing(self, method, ns_node, fetch, strict):
+        """
+        Get the full listing, the partial listing is never cached.
+        Without strict, the errors are logged, and the received items are returned.
+        """
         try:
-            while True:
-                # prepare payload
-                payload = {TaskFinder._LIMIT: limit}
-                if continuationToken:
-                    payload[TaskFinder._CONTINUATION_TOKEN] = continuationToken
-                # query API
-                ret = self.index.listNamespaces(ns_node, payload)
-                for item in ret.get(TaskFinder._NAMESPACES):
-                    if item.get(TaskFinder._NAMESPACE) != '':
-                        result_list.append(item.get(TaskFinder._NAMESPACE))
-                # if there is continuationToken, then query API agian with token.
-                if not ret.get(TaskFinder._CONTINUATION_TOKEN):
-                    break
-                else:
-                    continuationToken = ret.get(TaskFinder._CONTINUATION_TOKEN)
+            return self._cached_call(method, ns_node, fetch)
+        except PartialResultError as e:
+            if strict:
+                raise
+            logger.warning('The {} of [{}] is incomplete, only {} items are listed.'.format(
+                method, ns_node, len(e.partial_result or [])))
+            logger.debug(e)
+            return e.partial_result or []
         except Exception as e:
+            if strict:
+                raise
+            logger.warning('Can not call {} of [{}].'.format(method, ns_node))
             logger.debug(e)
-        return result_list
+        return []
 
-    def get_tasks(self, ns_node='', limit=1000):
+    def iter_namespaces(self, ns_node='', limit=1000, continuation_token=None):
         """
-        Get the tasks of given namespace.
+        Iterate the namespaces of given namespace page by page, without Index cache.
+        The next page is prefetched while the current page is consumed, and no more page is fetched after stopping.
         @param ns_node: given namespace.
         @param limit: 1-1000, the return list of API up to 1000 namespace per-call.
-        @return: return the tasks list. e.g. [(NAME, TASK_ID), ...]
+        @param continuation_token: resume from the saved continuation_token of L{ListingIterator}.
+        @return: the L{ListingIterator} of namespaces. e.g. NAME, ...
+        """
+        return ListingIterator(functools.partial(self._call, 'listNamespaces'), TaskFinder._NAMESPACES, ns_node,
+                               limit, continuation_token=continuation_token, parse_item=TaskFinder._parse_namespace)
+
+    @staticmethod
+    def _parse_namespace(item):
+        namespace = item.get(TaskFinder._NAMESPACE)
+        return namespace if namespace != '' else None
+
+    @staticmethod
+    def _parse_task(item):
+        if item.get(TaskFinder._TASK) == '':
+            return None
+        return item.get(TaskFinder._NAMESPACE), item.get(TaskFinder._TASK_ID)
+
+    @staticmethod
+    def _collect(listing):
+        """
+        Raise L{PartialResultError} with the received items if the listing stopped after the first page.
+        @return: the tuple (items list, the earliest expires timestamp) of L{ListingIterator}.
         """
         result_list = []
-        continuationToken = None
+        expires_items = []
         try:
-            while True:
-                # prepare payload
-                payload = {TaskFinder._LIMIT: limit}
-                if continuationToken:
-                    payload[TaskFinder._CONTINUATION_TOKEN] = continuationToken
-                # query API
-                ret = self.index.listTasks(ns_node, payload)
-                for item in ret.get(TaskFinder._TASKS):
-                    if item.get(TaskFinder._TASK) != '':
-                        result_list.append((item.get(TaskFinder._NAMESPACE), item.get(TaskFinder._TASK_ID)))
-                # if there is continuationToken, then query API agian with token.
-                if not ret.get(TaskFinder._CONTINUATION_TOKEN):
-                    break
-                else:
-                    continuationToken = ret.get(TaskFinder._CONTINUATION_TOKEN)
-        except Exception as e:
-            logger.debug(e)
-        return result_list
+            for items in listing.pages():
+                for item in items:
+                    value = listing.parse_item(item)
+                    if value is not None:
+                        result_list.append(value)
+                        expires_items.append(item)
+        except PartialResultError as e:
+            e.partial_result = result_list
+            raise
+        return result_list, get_min_expires(expires_items)
+
+    def _fetch_namespaces(self, ns_node, limit):
+        """
+        @return: the tuple (namespaces list, the earliest expires timestamp).
+        """
+        return TaskFinder._collect(self.iter_namespaces(ns_node, limit))
+
+    def get_tasks(self, ns_node='', limit=1000, strict=False):
+        """
+        Get the tasks of given namespace.
+        @param ns_node: given namespace.
+        @param limit: 1-1000, the return list of API up to 1000 namespace per-call.
+        @param strict: raise the errors, and the L{PartialResultError} with the received tasks.
+        @return: return the tasks list. e.g. [(NAME, TASK_ID), ...]
+        """
+        ret = self._get_listing('listTasks', ns_node, lambda: self._fetch_tasks(ns_node, limit), strict)
+        return [tuple(item) for item in ret]
+
+    def iter_tasks(self, ns_node='', limit=1000, continuation_token=None):
+        """
+        Iterate the tasks of given namespace page by page, without Index cache.
+        The next page is prefetched while the current page is consumed, and no more page is fetched after stopping.
+        @param ns_node: given namespace.
+        @param limit: 1-1000, the return list of API up to 1000 task per-call.
+        @param continuation_token: resume from the saved continuation_token of L{ListingIterator}.
+        @return: the L{ListingIterator} of tasks. e.g. (NAME, TASK_ID), ...
+        """
+        return ListingIterator(functools.partial(self._call, 'listTasks'), TaskFinder._TASKS, ns_node, limit,
+                               continuation_token=continuation_token, parse_item=TaskFinder._parse_task)
+
+    def _fetch_tasks(self, ns_node, limit):
+        """
+        @return: the tuple (tasks list, the earliest expires timestamp).
+        """
+        return TaskFinder._collect(self.iter_tasks(ns_node, limit))
 
-    def get_namespaces_and_tasks(self, ns_node='', limit=1000):
+    def get_namespaces_and_tasks(self, ns_node='', limit=1000, strict=False):
         """
-        Get the namespaces and tasks of given namespace.
+        Get the namespaces and tasks of given namespace. The namespaces and tasks are listed concurrently.
         @param ns_node: given namespace.
         @param limit: 1-1000, the return list of API up to 1000 namespace per-call.
+        @param strict: raise the errors of listing, instead of returning the partial lists.
         @return: return the namespaces and tasks dict. e.g. {'node': 'foo', 'tasks': [('tname', 'tid'), ...], 'namespaces': ['n1', 'n2', ...]}
         """
         result = {TaskFinder._NODE: ns_node}
-        # get namespaces
-        result[TaskFinder._NAMESPACES] = self.get_namespaces(ns_node, limit)
-        # get tasks
-        result[TaskFinder._TASKS] = self.get_tasks(ns_node, limit)
+        errors = []
+
+        def get_tasks():
+            try:
+                result[TaskFinder._TASKS] = self.get_tasks(ns_node, limit, strict)
+            except Exception as e:
+                errors.append(e)
+
+        # get tasks in background
+        thread = threading.Thread(target=get_tasks)
+        thread.daemon = True
+        thread.start()
+        try:
+            # get namespaces
+            result[TaskFinder._NAMESPACES] = self.get_namespaces(ns_node, limit, strict)
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
         return result
+
+    def iter_namespaces_and_tasks(self, ns_node='', limit=1000):
+        """
+        Get the namespaces and tasks of given namespace page by page.
+        The namespaces and tasks are listed concurrently, and each page is yielded as soon as it arrives,
+        while the later pages keep loading in background.
+        If the listing fails after some pages are yielded, L{PartialResultError} is raised at the end.
+        @param ns_node: given namespace.
+        @param limit: 1-1000, the return list of API up to 1000 namespace per-call.
+        @return: the generator of the namespaces and tasks dict of each page.
+        e.g. {'node': 'foo', 'tasks': [('tname', 'tid'), ...], 'namespaces': ['n1', 'n2', ...]}
+        """
+        pages = Queue.Queue()
+        stop_event = threading.Event()
+        errors = []
+
+        def load(kind, method, listing):
+            try:
+                key = self._get_cache_key(method, ns_node)
+                cached = self.cache.get_fresh(key) if self.cache is not None else None
+                if cached is not None:
+                    pages.put((kind, [tuple(item) if isinstance(item, list) else item for item in cached]))
+                    return
+                result_list = []
+                expires_items = []
+                for items in listing.pages():
+                    if stop_event.is_set():
+                        return
+                    page = [value for value in (listing.parse_item(item) for item in items) if value is not None]
+                    result_list.extend(page)
+                    expires_items.extend(items)
+                    pages.put((kind, page))
+                if self.cache is not None:
+                    self.cache.set(key, result_list, get_min_expires(expires_items))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pages.put((kind, None))
+
+        for args in ((TaskFinder._NAMESPACES, 'listNamespaces', self.iter_namespaces(ns_node, limit)),
+                     (TaskFinder._TASKS, 'listTasks', self.iter_tasks(ns_node, limit))):
+            thread = threading.Thread(target=load, args=args)
+            thread.daemon = True
+            thread.start()
+        try:
+            finished = 0
+            yielded = 0
+            while finished < 2:
+                kind, page = pages.get()
+                if page is None:
+                    finished += 1
+                elif page:
+                    result = {TaskFinder._NODE: ns_node, TaskFinder._NAMESPACES: [], TaskFinder._TASKS: []}
+                    result[kind] = page
+                    yielded += 1
+                    yield result
+        finally:
+            stop_event.set()
+        if errors:
+            if not yielded:
+                raise errors[0]
+            raise PartialResultError('Listing [{}] is incomplete: {}'.format(ns_node, errors[0]),
+                                     resume_from=getattr(errors[0], 'resume_from', None), cause=errors[0])
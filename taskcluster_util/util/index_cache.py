@@ -0,0 +1,193 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import time
+import calendar
+import logging
+import datetime
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_expires(expires):
+    """
+    Parse the expires field of Index API.
+    @param expires: the date string. e.g. '2016-02-01T12:00:00.000Z'.
+    @return: the timestamp, or None if it can not be parsed.
+    """
+    if not expires:
+        return None
+    for date_format in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return calendar.timegm(datetime.datetime.strptime(expires, date_format).utctimetuple())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def get_min_expires(items):
+    """
+    Get the earliest expires of the listing items.
+    @param items: the items of Index API, e.g. [{'expires': ...}, ...].
+    @return: the timestamp, or None if no item has expires.
+    """
+    timestamps = [parse_expires(item.get('expires')) for item in items]
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return min(timestamps) if timestamps else None
+
+
+class IndexCache(object):
+    """
+    The persistent cache of Index API results, stored in SQLite.
+    The entry is fresh until the expires of API result, but no longer than max_ttl.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'taskcluster_util', 'index.sqlite')
+    DEFAULT_MAX_TTL = 300
+    DEFAULT_MAX_STALE = 24 * 60 * 60
+
+    def __init__(self, path=DEFAULT_PATH, max_ttl=DEFAULT_MAX_TTL, max_stale=DEFAULT_MAX_STALE,
+                 stale_while_revalidate=False, refresh=False):
+        """
+        @param path: the SQLite file path.
+        @param max_ttl: the max seconds of an entry being fresh.
+        @param max_stale: the max seconds of an expired entry being used in stale-while-revalidate mode.
+        @param stale_while_revalidate: return the expired entry, and update it in background.
+        @param refresh: do not read the entries, but still store the new results.
+        """
+        self.path = os.path.abspath(path)
+        self.max_ttl = max_ttl
+        self.max_stale = max_stale
+        self.stale_while_revalidate = stale_while_revalidate
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # imported here, so the console scripts which do not open the cache start fast
+        import sqlite3
+        self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                                     '(key TEXT PRIMARY KEY, value TEXT, fresh_until REAL, stale_until REAL)')
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, key):
+        """
+        Get the cache entry.
+        @param key: the entry key.
+        @return: the tuple (value, fresh_until, stale_until), or None if there is no entry.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT value, fresh_until, stale_until FROM entries WHERE key = ?',
+                                           (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def get_fresh(self, key):
+        """
+        Get the value of fresh cache entry.
+        @param key: the entry key.
+        @return: the value, or None if there is no fresh entry or in refresh mode.
+        """
+        entry = None if self.refresh else self.get(key)
+        if entry is not None and time.time() < entry[1]:
+            return entry[0]
+        return None
+
+    def set(self, key, value, expires=None):
+        """
+        Store the cache entry.
+        @param key: the entry key.
+        @param value: the JSON serializable value.
+        @param expires: the expires timestamp of value from API.
+        """
+        now = time.time()
+        fresh_until = now + self.max_ttl
+        stale_until = fresh_until + self.max_stale
+        if expires is not None:
+            fresh_until = min(fresh_until, expires)
+            stale_until = min(stale_until, expires)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                                     (key, json.dumps(value), fresh_until, stale_until))
+            self._connection.commit()
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+            self._connection.commit()
+
+    def _revalidate(self, key, fetch):
+        try:
+            value, expires = fetch()
+            self.set(key, value, expires)
+            logger.debug('Revalidated [{}].'.format(key))
+        except Exception as e:
+            logger.debug('Can not revalidate [{}]: {}'.format(key, e))
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    def _revalidate_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        thread = threading.Thread(target=self._revalidate, args=(key, fetch))
+        thread.daemon = True
+        thread.start()
+
+    def fetch(self, key, fetch):
+        """
+        Get the value from cache, or fetch and store it.
+        @param key: the entry key.
+        @param fetch: the function returns (value, expires timestamp).
+        @return: the value.
+        """
+        entry = None if self.refresh else self.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            now = time.time()
+            if now < fresh_until:
+                logger.debug('Index cache hit [{}].'.format(key))
+                return value
+            if self.stale_while_revalidate and now < stale_until:
+                logger.debug('Index cache stale [{}], revalidating.'.format(key))
+                self._revalidate_in_background(key, fetch)
+                return value
+        value, expires = fetch()
+        self.set(key, value, expires)
+        return value
+
+
+def open_index_cache(no_cache=False, refresh=False, stale_while_revalidate=False, path=IndexCache.DEFAULT_PATH):
+    """
+    Open the Index cache for CLI tools.
+    @param no_cache: do not use the cache.
+    @param refresh: ignore the cached entries, and store the new results.
+    @param stale_while_revalidate: use the expired entries, and update them in background.
+    @param path: the SQLite file path.
+    @return: the L{IndexCache}, or None if no cache or the cache can not be opened.
+    """
+    if no_cache:
+        return None
+    try:
+        return IndexCache(path, stale_while_revalidate=stale_while_revalidate, refresh=refresh)
+    except Exception as e:
+        logger.warning('Can not open the Index cache [{}], run without cache.'.format(path))
+        logger.debug(e)
+        return None
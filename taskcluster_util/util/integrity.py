@@ -0,0 +1,137 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import re
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_ALGORITHMS = ('sha256', 'sha512')
+# the algorithm of bare hex digest, by its length
+_HEX_LENGTHS = {64: 'sha256', 128: 'sha512'}
+_HEX_PATTERN = re.compile(r'^[0-9a-f]+$')
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class IncompleteContentError(IntegrityError, IOError):
+    """
+    The received content is shorter or longer than expected, the download can be retried.
+    """
+    pass
+
+
+def _get_algorithm(algorithm, hex_digest):
+    algorithm = (algorithm or _HEX_LENGTHS.get(len(hex_digest), '')).lower()
+    if algorithm not in SUPPORTED_ALGORITHMS:
+        return None
+    if len(hex_digest) != hashlib.new(algorithm).digest_size * 2 or not _HEX_PATTERN.match(hex_digest):
+        return None
+    return algorithm
+
+
+def parse_digest(digest):
+    """
+    Parse the digest string.
+    @param digest: the digest. e.g. 'sha256:HEX', 'sha512:HEX', or the bare SHA-256/SHA-512 hex digest.
+    @return: the dict {algorithm: hex digest}.
+    """
+    algorithm, _, hex_digest = digest.strip().rpartition(':')
+    hex_digest = hex_digest.lower()
+    checked_algorithm = _get_algorithm(algorithm, hex_digest)
+    if checked_algorithm is None:
+        raise Exception('Can not parse the digest [{}], please use "sha256:HEX" or "sha512:HEX".'.format(digest))
+    return {checked_algorithm: hex_digest}
+
+
+def parse_checksums(content, artifact_name):
+    """
+    Find the digests of artifact in the content of checksums file.
+    The lines can be "HEX ALGORITHM SIZE NAME" (Mozilla checksums), or "HEX NAME" (sha256sum/sha512sum).
+    The names are compared by the base name, because the checksums file may not have the artifact folder.
+    @param content: the content of checksums file.
+    @param artifact_name: the artifact name. e.g. 'public/build/target.tar.bz2'.
+    @return: the dict {algorithm: hex digest}, it's empty if the artifact is not listed.
+    """
+    base_name = os.path.basename(artifact_name)
+    digests = {}
+    for line in content.splitlines():
+        fields = line.split()
+        if len(fields) == 4:
+            hex_digest, algorithm, _, name = fields
+        elif len(fields) == 2:
+            hex_digest, name = fields
+            algorithm = None
+        else:
+            continue
+        # sha256sum marks the binary mode by '*'
+        if os.path.basename(name.lstrip('*')) != base_name:
+            continue
+        hex_digest = hex_digest.lower()
+        checked_algorithm = _get_algorithm(algorithm, hex_digest)
+        if checked_algorithm:
+            digests[checked_algorithm] = hex_digest
+    return digests
+
+
+class StreamHasher(object):
+    """
+    Compute the digests of content chunk by chunk, while it is being downloaded.
+    """
+    def __init__(self, algorithms):
+        """
+        @param algorithms: the algorithm names. e.g. ['sha256'].
+        """
+        self._hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in set(algorithms))
+
+    def update(self, data):
+        """
+        @param data: the chunk, it can be a memoryview.
+        """
+        for hash_object in self._hashes.values():
+            hash_object.update(data)
+
+    def hexdigests(self):
+        """
+        @return: the dict {algorithm: hex digest}.
+        """
+        return dict((algorithm, hash_object.hexdigest()) for algorithm, hash_object in self._hashes.items())
+
+
+def get_file_digests(path, algorithms, chunk_size=1024 * 1024):
+    """
+    Compute the digests of file.
+    @param path: the file path.
+    @param algorithms: the algorithm names.
+    @return: the dict {algorithm: hex digest}.
+    """
+    hasher = StreamHasher(algorithms)
+    with open(path, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigests()
+
+
+def verify_digests(digests, expected_digests, name):
+    """
+    Compare the computed digests with the expected digests.
+    Raise L{IntegrityError} if any of them does not match.
+    @param digests: the computed dict {algorithm: hex digest}.
+    @param expected_digests: the expected dict {algorithm: hex digest}.
+    @param name: the artifact name, for the error message.
+    """
+    for algorithm, expected in expected_digests.items():
+        actual = digests.get(algorithm)
+        if actual != expected:
+            raise IntegrityError('The {} of [{}] is [{}], but [{}] is expected.'.format(algorithm, name, actual,
+                                                                                       expected))
+        logger.debug('The {} of [{}] is verified.'.format(algorithm, name))
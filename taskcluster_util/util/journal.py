@@ -0,0 +1,181 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadJournal(object):
+    """
+    The sidecar journal of partial downloaded file, for resuming the download.
+    """
+    SUFFIX = '.tcdl-journal'
+
+    def __init__(self, local_file, task_id, artifact_name, etag=None, last_modified=None, total_length=0,
+                 content_encoding=None, completed=None):
+        """
+        @param local_file: the partial downloaded file path.
+        @param task_id: the TaskId of artifact.
+        @param artifact_name: the artifact name.
+        @param etag: the ETag of artifact.
+        @param last_modified: the Last-Modified of artifact.
+        @param total_length: the expected length of artifact.
+        @param content_encoding: the Content-Encoding of artifact.
+        @param completed: the completed ranges list. e.g. [[START, END], ...], the END is exclusive.
+        """
+        self.local_file = local_file
+        self.task_id = task_id
+        self.artifact_name = artifact_name
+        self.etag = etag
+        self.last_modified = last_modified
+        self.total_length = total_length
+        self.content_encoding = content_encoding
+        self.completed = []
+        self._lock = threading.Lock()
+        for start, end in completed or []:
+            self.add_range(start, end)
+
+    @staticmethod
+    def get_path(local_file):
+        """
+        Get the journal path of the partial downloaded file.
+        """
+        return local_file + DownloadJournal.SUFFIX
+
+    @property
+    def path(self):
+        return DownloadJournal.get_path(self.local_file)
+
+    @property
+    def validator(self):
+        """
+        The validator for If-Range header, prefer ETag.
+        """
+        return self.etag or self.last_modified
+
+    @staticmethod
+    def load(local_file, task_id, artifact_name):
+        """
+        Load the journal of partial downloaded file.
+        @param local_file: the partial downloaded file path.
+        @param task_id: the TaskId of artifact.
+        @param artifact_name: the artifact name.
+        @return: the journal, or None if there is no usable journal.
+        """
+        path = DownloadJournal.get_path(local_file)
+        if not os.path.isfile(path) or not os.path.isfile(local_file):
+            return None
+        try:
+            with open(path) as fd:
+                data = json.load(fd)
+            journal = DownloadJournal(local_file, data['task_id'], data['artifact_name'],
+                                      etag=data.get('etag'),
+                                      last_modified=data.get('last_modified'),
+                                      total_length=data.get('total_length', 0),
+                                      content_encoding=data.get('content_encoding'),
+                                      completed=data.get('completed'))
+        except Exception as e:
+            logger.debug('Can not load journal [{}]: {}'.format(path, e))
+            return None
+        if journal.task_id != task_id or journal.artifact_name != artifact_name:
+            logger.debug('Journal [{}] is for another artifact.'.format(path))
+            return None
+        if not journal.validator or journal.total_length <= 0:
+            return None
+        if os.path.getsize(local_file) != journal.total_length:
+            logger.debug('The size of partial file [{}] is not expected.'.format(local_file))
+            return None
+        return journal
+
+    def add_range(self, start, end):
+        """
+        Mark the byte range as completed.
+        @param start: the start offset.
+        @param end: the end offset, exclusive.
+        """
+        if end <= start:
+            return
+        with self._lock:
+            merged = []
+            for item_start, item_end in self.completed:
+                if item_end < start or item_start > end:
+                    merged.append([item_start, item_end])
+                else:
+                    start = min(start, item_start)
+                    end = max(end, item_end)
+            merged.append([start, end])
+            merged.sort()
+            self.completed = merged
+
+    def get_completed_size(self):
+        with self._lock:
+            return sum(end - start for start, end in self.completed)
+
+    def get_missing_ranges(self):
+        """
+        Get the missing ranges of artifact.
+        @return: the ranges list. e.g. [(START, END), ...], the END is exclusive.
+        """
+        missing = []
+        offset = 0
+        with self._lock:
+            for start, end in self.completed:
+                if start > offset:
+                    missing.append((offset, start))
+                offset = max(offset, end)
+        if offset < self.total_length:
+            missing.append((offset, self.total_length))
+        return missing
+
+    def save(self):
+        """
+        Write the journal into disk.
+        The completed ranges are taken before syncing the partial downloaded file, so the recorded ranges are on disk
+        before the journal, even if the system crashes.
+        """
+        with self._lock:
+            data = {
+                'task_id': self.task_id,
+                'artifact_name': self.artifact_name,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'total_length': self.total_length,
+                'content_encoding': self.content_encoding,
+                'completed': [list(item) for item in self.completed]
+            }
+        self._sync_local_file()
+        with self._lock:
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as fd:
+                json.dump(data, fd)
+                fd.flush()
+                os.fsync(fd.fileno())
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+
+    def _sync_local_file(self):
+        """
+        Flush the written content of partial downloaded file from the OS buffers to disk.
+        The writers should flush their file objects before marking the ranges as completed.
+        """
+        try:
+            with open(self.local_file, 'r+b') as fd:
+                os.fsync(fd.fileno())
+        except (IOError, OSError) as e:
+            logger.debug('Can not sync [{}]: {}'.format(self.local_file, e))
+
+    def remove(self):
+        """
+        Remove the journal from disk.
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,168 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import Queue
+import logging
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class ListingPrefetcher(object):
+    """
+    Fetch the listings of child namespaces and the artifacts of tasks in background, while the user is looking at
+    the current listing. The results are kept in an in-memory LRU, and the visited entries are never evicted.
+    """
+    DEFAULT_WORKERS = 4
+    DEFAULT_MAX_DEPTH = 1
+    DEFAULT_MAX_SIZE = 256
+    _NAMESPACE = 'namespace'
+    _ARTIFACTS = 'artifacts'
+    _DONE = object()
+
+    def __init__(self, task_finder, downloader=None, workers=DEFAULT_WORKERS, max_depth=DEFAULT_MAX_DEPTH,
+                 max_size=DEFAULT_MAX_SIZE):
+        """
+        @param task_finder: the L{TaskFinder}.
+        @param downloader: the L{Downloader} for the artifacts of tasks, None for not prefetching artifacts.
+        @param workers: the number of concurrent prefetches, 0 for no prefetch.
+        @param max_depth: the levels under the current namespace to prefetch, 0 for no prefetch.
+        @param max_size: the max number of entries, the visited entries are not counted for eviction.
+        """
+        self.task_finder = task_finder
+        self.downloader = downloader
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._visited = set()
+        # the running prefetches, {key: Event}
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._threads = []
+
+    def get_listing(self, namespace):
+        """
+        Get the namespaces and tasks of namespace, from the prefetched entry, the running prefetch, or Index API.
+        @param namespace: the namespace.
+        @return: the dict of L{TaskFinder.get_namespaces_and_tasks}.
+        """
+        return self._get((ListingPrefetcher._NAMESPACE, namespace))
+
+    def get_artifacts(self, task_id):
+        """
+        Get the latest artifact names of task, from the prefetched entry, the running prefetch, or Queue API.
+        @param task_id: the TaskId.
+        @return: the artifact names list.
+        """
+        return self._get((ListingPrefetcher._ARTIFACTS, task_id))
+
+    def _fetch(self, key, strict=False):
+        kind, name = key
+        if kind == ListingPrefetcher._NAMESPACE:
+            return self.task_finder.get_namespaces_and_tasks(name, strict=strict)
+        ret = self.downloader.get_latest_artifacts(name)
+        return [artifact.get('name') for artifact in ret.get('artifacts', [])]
+
+    def _get(self, key):
+        with self._lock:
+            event = self._pending.get(key)
+        if event is not None:
+            logger.debug('Waiting for the prefetch of {}.'.format(key))
+            event.wait()
+        with self._lock:
+            if key in self._entries:
+                logger.debug('Prefetch hit {}.'.format(key))
+                self._visited.add(key)
+                return self._touch(key)
+        value = self._fetch(key)
+        with self._lock:
+            self._visited.add(key)
+            self._store(key, value)
+        return value
+
+    def _touch(self, key):
+        # move to the most recently used end
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        return value
+
+    def _store(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) - len(self._visited) <= self.max_size:
+            return
+        for old_key in list(self._entries):
+            if len(self._entries) - len(self._visited) <= self.max_size:
+                break
+            if old_key not in self._visited:
+                del self._entries[old_key]
+
+    def prefetch(self, listing):
+        """
+        Prefetch the children of the namespaces and the artifacts of the tasks in listing.
+        The queued prefetches of the previous listing are dropped.
+        @param listing: the dict of L{TaskFinder.get_namespaces_and_tasks}.
+        """
+        if self.workers <= 0 or self.max_depth <= 0:
+            return
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._worker)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+        self._enqueue(listing, 1, generation)
+
+    def _enqueue(self, listing, depth, generation):
+        keys = [(ListingPrefetcher._NAMESPACE, namespace) for namespace in listing.get('namespaces', [])]
+        if self.downloader is not None:
+            keys.extend((ListingPrefetcher._ARTIFACTS, task_id) for _, task_id in listing.get('tasks', []))
+        # the entries more than the LRU size would evict each other
+        for key in keys[:self.max_size]:
+            self._queue.put((generation, depth, key))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is ListingPrefetcher._DONE:
+                return
+            generation, depth, key = item
+            with self._lock:
+                if generation != self._generation or key in self._entries or key in self._pending:
+                    continue
+                event = self._pending[key] = threading.Event()
+            value = None
+            try:
+                value = self._fetch(key, strict=True)
+            except Exception as e:
+                logger.debug('Can not prefetch {}: {}'.format(key, e))
+            finally:
+                with self._lock:
+                    if value is not None:
+                        self._store(key, value)
+                    del self._pending[key]
+                event.set()
+            if value is not None and key[0] == ListingPrefetcher._NAMESPACE and depth < self.max_depth:
+                self._enqueue(value, depth + 1, generation)
+
+    def close(self):
+        """
+        Drop the queued prefetches, and wait for the running ones.
+        """
+        with self._lock:
+            self._generation += 1
+            threads = self._threads
+            self._threads = []
+        for _ in threads:
+            self._queue.put(ListingPrefetcher._DONE)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,389 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+import urllib
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from cache import ArtifactCache
+from index_cache import parse_expires
+from integrity import IncompleteContentError
+from resilience import get_default_resilience
+from transfer import open_url, release_response, get_content_length, get_content_range, is_range_supported, \
+    is_gzip_encoded, ChunkReader, GzipDecoder, MIN_CHUNK_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyError(Exception):
+    def __init__(self, status_code, message):
+        super(ProxyError, self).__init__(message)
+        self.status_code = status_code
+
+
+class ArtifactFetch(object):
+    """
+    One upstream fetch of artifact, which is written into the spool file and read by many clients at the same time.
+    """
+    # the max read size, keep it small so the clients get the content soon
+    _MAX_CHUNK_SIZE = 1024 * 1024
+    _SPOOL_SUFFIX = '.tcserve-spool'
+
+    def __init__(self, url, final_path, resilience=None):
+        """
+        @param url: the signed URL of artifact.
+        @param final_path: the file path of artifact after fetching.
+        @param resilience: the L{Resilience} of fetching, the shared one is used if not given.
+        The broken fetch is resumed from the written bytes, if the content is not GZip encoded.
+        """
+        self.url = url
+        self.final_path = final_path
+        self.resilience = resilience or get_default_resilience()
+        self.path = '{}.{}{}'.format(final_path, id(self), ArtifactFetch._SPOOL_SUFFIX)
+        self.content_length = None
+        self.content_type = None
+        self.written = 0
+        self._is_resumable = False
+        self.is_done = False
+        self.error = None
+        self.ready = threading.Event()
+        self.condition = threading.Condition()
+
+    def start(self, on_done=None):
+        """
+        Fetch in background.
+        @param on_done: the function called with this fetch when it's done.
+        """
+        def run():
+            try:
+                self._fetch()
+            finally:
+                if on_done:
+                    on_done(self)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _fetch(self):
+        try:
+            folder = os.path.dirname(self.path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(self.path, 'wb') as fd:
+                self.resilience.call(self._fetch_once, (fd,))
+            with self.condition:
+                os.rename(self.path, self.final_path)
+                self.path = self.final_path
+            self._finish()
+        except Exception as e:
+            if os.path.exists(self.path) and self.path != self.final_path:
+                os.remove(self.path)
+            self._finish(e)
+
+    def _fetch_once(self, fd):
+        """
+        Fetch the content into the spool file, from the written bytes if it is retried.
+        """
+        if self.written and not self._is_resumable:
+            raise Exception('The fetch of [{}] can not be resumed.'.format(self.final_path))
+        response = open_url(self.url, {'Range': 'bytes={}-'.format(self.written)} if self.written else None)
+        try:
+            if self.written:
+                content_range = get_content_range(response) if response.status_code == 206 else None
+                if not content_range or content_range[0] != self.written:
+                    raise Exception('The server does not resume [{}] from {} bytes.'.format(self.final_path,
+                                                                                           self.written))
+                decoder = None
+            else:
+                decoder = GzipDecoder() if is_gzip_encoded(response) else None
+                self.content_length = None if decoder else get_content_length(response)
+                self.content_type = response.headers.get('Content-Type')
+                self._is_resumable = decoder is None and bool(self.content_length) and is_range_supported(response)
+                self.ready.set()
+            reader = ChunkReader(response.raw, MIN_CHUNK_SIZE, ArtifactFetch._MAX_CHUNK_SIZE)
+            while True:
+                chunk = reader.read()
+                if not chunk:
+                    break
+                for data in decoder.iter_decode(chunk) if decoder else (chunk,):
+                    self._write(fd, data)
+            if decoder:
+                self._write(fd, decoder.flush())
+            if self.content_length is not None and self.written != self.content_length:
+                raise IncompleteContentError('Received {} of {} bytes of [{}].'.format(
+                    self.written, self.content_length, self.final_path))
+        finally:
+            release_response(response)
+
+    def _write(self, fd, data):
+        if not data:
+            return
+        fd.write(data)
+        fd.flush()
+        with self.condition:
+            self.written += len(data)
+            self.condition.notify_all()
+
+    def _finish(self, error=None):
+        with self.condition:
+            self.error = error
+            self.is_done = True
+            self.condition.notify_all()
+        self.ready.set()
+
+    def open(self):
+        """
+        Open the spool file for reading. It can be called after ready.
+        @return: the file object.
+        """
+        with self.condition:
+            return open(self.path, 'rb')
+
+    def iter_content(self, fd, chunk_size=MIN_CHUNK_SIZE):
+        """
+        Read the content from the spool file, and wait for the fetching content.
+        @param fd: the file object from L{open}.
+        @return: the generator of content chunks.
+        """
+        position = 0
+        while True:
+            with self.condition:
+                while position >= self.written and not self.is_done:
+                    self.condition.wait()
+                if self.error:
+                    raise self.error
+                available = self.written
+            if position >= available:
+                break
+            while position < available:
+                data = fd.read(min(chunk_size, available - position))
+                if not data:
+                    break
+                position += len(data)
+                yield data
+
+
+class ArtifactProxy(object):
+    # the seconds of keeping the resolution of namespace, the namespaces are re-pointed to the new tasks
+    RESOLUTION_TTL = 60
+
+    def __init__(self, task_finder, downloader, store_dir, resolution_ttl=RESOLUTION_TTL,
+                 max_size=ArtifactCache.DEFAULT_MAX_SIZE, resilience=None):
+        """
+        Resolve and fetch the artifacts for the proxy server.
+        The concurrent requests of the same artifact are served by one upstream fetch.
+        @param task_finder: the L{TaskFinder}.
+        @param downloader: the L{Downloader}.
+        @param store_dir: the folder of fetched artifacts.
+        @param resolution_ttl: the seconds of keeping the resolution of namespace, but no longer than the task expires.
+        @param max_size: the max total size of store folder, the least recently used artifacts are removed
+        after each fetch. 0 for no limit.
+        @param resilience: the L{Resilience} of upstream fetches, the shared one is used if not given.
+        """
+        self.task_finder = task_finder
+        self.downloader = downloader
+        self.store_dir = os.path.abspath(store_dir)
+        self.resolution_ttl = resolution_ttl
+        self.max_size = max_size
+        self.resilience = resilience
+        self._fetches = {}
+        self._resolutions = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, namespace):
+        """
+        Resolve the namespace, the result is kept until it expires, including the not found result.
+        @return: the L{Resolution}.
+        """
+        now = time.time()
+        with self._lock:
+            resolution, expires = self._resolutions.get(namespace, (None, 0))
+        if expires > now:
+            return resolution
+        resolution = self.task_finder.resolve(namespace, use_memo=False)
+        expires = now + self.resolution_ttl
+        task_expires = parse_expires(resolution.expires) if resolution.is_task else None
+        if task_expires is not None:
+            expires = min(expires, task_expires)
+        with self._lock:
+            for key in [key for key, (_, key_expires) in self._resolutions.items() if key_expires <= now]:
+                del self._resolutions[key]
+            self._resolutions[namespace] = (resolution, expires)
+        return resolution
+
+    def get_task_id(self, namespace):
+        """
+        @return: the TaskId of namespace.
+        """
+        resolution = self._resolve(self.task_finder.normalize_namespace(namespace))
+        if not resolution.is_task:
+            raise ProxyError(404, 'Can not find the task of Namespace [{}].'.format(namespace))
+        return resolution.task_id
+
+    def get_store_path(self, task_id, artifact_name):
+        """
+        @return: the file path of artifact in store folder.
+        """
+        path = os.path.normpath(os.path.join(self.store_dir, task_id, *artifact_name.split('/')))
+        if not path.startswith(os.path.join(self.store_dir, task_id) + os.sep):
+            raise ProxyError(400, 'Invalid artifact name [{}].'.format(artifact_name))
+        return path
+
+    def get_artifact(self, task_id, artifact_name):
+        """
+        Get the stored artifact, or join the fetch of artifact.
+        The stored artifact is opened here, so it can be read even if it is evicted after.
+        @return: the tuple (file object, None) if it is stored, or (None, L{ArtifactFetch}).
+        """
+        path = self.get_store_path(task_id, artifact_name)
+        key = (task_id, artifact_name)
+        with self._lock:
+            fetch = self._fetches.get(key)
+            if fetch is not None:
+                logger.debug('Join the fetch of [{}] of TaskID [{}].'.format(artifact_name, task_id))
+                return None, fetch
+            if os.path.isfile(path):
+                # the modified time is the last access time for eviction
+                os.utime(path, None)
+                return open(path, 'rb'), None
+            fetch = ArtifactFetch(self.downloader.get_signed_url(task_id, artifact_name), path, self.resilience)
+            self._fetches[key] = fetch
+        logger.info('Fetching [{}] of TaskID [{}] ...'.format(artifact_name, task_id))
+        fetch.start(on_done=lambda done_fetch: self._remove_fetch(key, done_fetch))
+        return None, fetch
+
+    def _remove_fetch(self, key, fetch):
+        with self._lock:
+            if self._fetches.get(key) is fetch:
+                del self._fetches[key]
+        if fetch.error:
+            logger.error('Fetch [{}] of TaskID [{}] failed.'.format(key[1], key[0]))
+            logger.debug(fetch.error)
+        else:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used artifacts until the total size of store folder is under the max size.
+        The artifacts being fetched are not counted, the removed artifacts are fetched again when requested.
+        """
+        if not self.max_size:
+            return
+        with self._lock:
+            files = []
+            for folder, _, names in os.walk(self.store_dir):
+                for name in names:
+                    if name.endswith(ArtifactFetch._SPOOL_SUFFIX):
+                        continue
+                    path = os.path.join(folder, name)
+                    try:
+                        file_stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((file_stat.st_mtime, file_stat.st_size, path))
+            total_size = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.debug(e)
+                    continue
+                total_size -= size
+                logger.debug('Evicted [{}] from store.'.format(path))
+
+
+class ProxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serve GET /namespace/<namespace>/<artifact> and GET /task/<TaskId>/<artifact>.
+    """
+    _CHUNK_SIZE = 64 * 1024
+
+    def log_message(self, format, *args):
+        logger.info('{} - {}'.format(self.address_string(), format % args))
+
+    def _parse_path(self):
+        path = urllib.unquote(self.path.split('?', 1)[0])
+        parts = path.lstrip('/').split('/', 2)
+        if len(parts) != 3 or parts[0] not in ('namespace', 'task') or not parts[1] or not parts[2]:
+            raise ProxyError(404, 'Please request /namespace/<namespace>/<artifact> or /task/<TaskId>/<artifact>.')
+        return parts
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        try:
+            kind, name, artifact_name = self._parse_path()
+            task_id = proxy.get_task_id(name) if kind == 'namespace' else name
+            fd, fetch = proxy.get_artifact(task_id, artifact_name)
+            if fetch is not None:
+                fetch.ready.wait()
+                if fetch.error and fetch.written == 0:
+                    # do not send the error message, it contains the signed URL
+                    status_code = getattr(getattr(fetch.error, 'response', None), 'status_code', None)
+                    raise ProxyError(status_code if status_code in (403, 404) else 502,
+                                     'Can not fetch [{}] of TaskID [{}].'.format(artifact_name, task_id))
+        except ProxyError as e:
+            self.send_error(e.status_code, str(e))
+            return
+        except Exception as e:
+            logger.debug(e)
+            self.send_error(502, 'Can not resolve [{}].'.format(self.path))
+            return
+
+        if fetch is None:
+            with fd:
+                self._send_file(fd)
+        else:
+            self._send_fetch(fetch)
+
+    def _send_headers(self, content_length, content_type=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type or 'application/octet-stream')
+        if content_length is not None:
+            self.send_header('Content-Length', str(content_length))
+        self.end_headers()
+
+    def _send_file(self, fd):
+        self._send_headers(os.fstat(fd.fileno()).st_size)
+        while True:
+            data = fd.read(ProxyRequestHandler._CHUNK_SIZE)
+            if not data:
+                break
+            self.wfile.write(data)
+
+    def _send_fetch(self, fetch):
+        try:
+            fd = fetch.open()
+        except IOError as e:
+            logger.debug(e)
+            self.send_error(502, 'Fetch [{}] failed.'.format(fetch.final_path))
+            return
+        with fd:
+            self._send_headers(fetch.content_length, fetch.content_type)
+            try:
+                for data in fetch.iter_content(fd, ProxyRequestHandler._CHUNK_SIZE):
+                    self.wfile.write(data)
+            except Exception as e:
+                # the status was sent, close the connection to tell the client the content is incomplete
+                logger.error('Stop sending [{}]: {}'.format(fetch.final_path, e))
+                self.close_connection = 1
+
+
+class ProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, proxy):
+        """
+        The threading HTTP server of artifacts.
+        @param server_address: the tuple (address, port).
+        @param proxy: the L{ArtifactProxy}.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, ProxyRequestHandler)
+        self.proxy = proxy
@@ -0,0 +1,195 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import random
+import logging
+import urlparse
+import threading
+
+from requests.packages.urllib3.exceptions import HTTPError as Urllib3Error
+from taskcluster.exceptions import TaskclusterConnectionError
+
+
+logger = logging.getLogger(__name__)
+
+# the status codes of throttling and temporary server errors
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class PartialResultError(Exception):
+    def __init__(self, message, partial_result=None, resume_from=None, cause=None):
+        """
+        The call failed after some results were received.
+        @param message: the error message.
+        @param partial_result: the received results, e.g. the listed items or the partial downloaded file.
+        @param resume_from: the position for resuming, e.g. the continuation token or the byte offset.
+        @param cause: the error which stopped the call.
+        """
+        super(PartialResultError, self).__init__(message)
+        self.partial_result = partial_result
+        self.resume_from = resume_from
+        self.cause = cause
+
+
+def get_status_code(error):
+    """
+    @return: the HTTP status code of error, or None if it is not an HTTP error.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code
+
+
+def is_retryable(error):
+    """
+    Check the error is temporary or not, e.g. the throttling, server errors, and broken connections.
+    @param error: the error.
+    @return: True if the call can be retried.
+    """
+    if isinstance(error, PartialResultError):
+        return error.cause is not None and is_retryable(error.cause)
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # the requests exceptions and socket errors are IOError
+    return isinstance(error, (IOError, Urllib3Error, TaskclusterConnectionError))
+
+
+def get_host(url):
+    """
+    @return: the host of url, e.g. 'index.taskcluster.net'.
+    """
+    return urlparse.urlparse(url or '').netloc.lower()
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        """
+        The token bucket rate limiter.
+        @param rate: the tokens added per second.
+        @param burst: the max number of tokens.
+        """
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, and wait for it if the bucket is empty.
+        @return: the waited seconds.
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + max(0, now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class Resilience(object):
+    """
+    The retry policy and the per-host rate limits, shared by the Index API calls and the artifact downloads.
+    The retries wait by exponential backoff with full jitter, so the concurrent callers do not retry at the same time.
+    """
+    DEFAULT_RETRIES = 5
+    DEFAULT_BACKOFF = 0.5
+    DEFAULT_MAX_BACKOFF = 30
+    DEFAULT_RATE = 50
+    DEFAULT_BURST = 100
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """
+        @param retries: the max number of retries of a call.
+        @param backoff: the base seconds of backoff, it is doubled by each retry.
+        @param max_backoff: the max seconds of backoff.
+        @param rate: the max requests per second of each host, 0 for no limit.
+        @param burst: the max requests of each host in a burst.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """
+        Wait for the rate limit of the host of url.
+        @param url: the request url.
+        """
+        if not self.rate:
+            return
+        host = get_host(url)
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        waited = bucket.acquire()
+        if waited:
+            logger.debug('Throttled [{}] for {:.2f} seconds.'.format(host, waited))
+
+    def get_backoff(self, attempt, error=None):
+        """
+        Get the seconds before the retry.
+        The Retry-After of throttled response is respected.
+        @param attempt: the retry number, starts from 1.
+        @param error: the error of last attempt.
+        @return: the seconds.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** (attempt - 1))))
+        retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('Retry-After')
+        try:
+            delay = max(delay, min(self.max_backoff, float(retry_after))) if retry_after else delay
+        except ValueError:
+            pass
+        return delay
+
+    def call(self, func, args=(), kwargs=None, url=None, on_retry=None):
+        """
+        Call the function, and retry it on the temporary errors.
+        The function should resume from its last position, e.g. the continuation token or the byte offset.
+        @param func: the function.
+        @param args: the arguments.
+        @param kwargs: the keyword arguments.
+        @param url: the url for the rate limit of each attempt, None for no rate limit.
+        @param on_retry: the function called with the error before each retry.
+        @return: the result of function.
+        """
+        attempt = 0
+        while True:
+            if url:
+                self.acquire(url)
+            try:
+                return func(*args, **(kwargs or {}))
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                delay = self.get_backoff(attempt, e)
+                logger.info('Retry {} of {} in {:.2f} seconds: {}'.format(attempt, self.retries, delay, e))
+                if on_retry:
+                    on_retry(e)
+                time.sleep(delay)
+
+
+_default_resilience = Resilience()
+
+
+def get_default_resilience():
+    """
+    @return: the L{Resilience} shared by the process.
+    """
+    return _default_resilience
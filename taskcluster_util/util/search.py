@@ -0,0 +1,273 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import bisect
+import fnmatch
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class NamespaceIndex(object):
+    """
+    The local searchable index of namespaces and task names, filled by crawling or by the traversed listings.
+    The names are kept in a sorted array, the prefix and glob queries find their range by binary search,
+    and the substring and fuzzy queries scan the array.
+    """
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'taskcluster_util', 'namespaces.json')
+    DEFAULT_LIMIT = 50
+    _GLOB_CHARS = '*?['
+    _SEPARATORS = '.-_'
+
+    def __init__(self, path=None):
+        """
+        @param path: the JSON file of index, it is loaded if exists. None for the in-memory index.
+        The index starts empty if the file can not be read or parsed, and the file is replaced when it is saved.
+        """
+        self.path = os.path.abspath(path) if path else None
+        # {namespace: TaskId, or None if it is not a task}
+        self._entries = {}
+        # the sorted namespaces, rebuilt when the entries are changed
+        self._names = []
+        self._is_sorted = True
+        self._is_changed = False
+        self._lock = threading.Lock()
+        if self.path and os.path.isfile(self.path):
+            try:
+                self.load()
+            except (IOError, ValueError) as e:
+                logger.warning('Can not load the search index [{}], start with an empty index: {}'.format(self.path, e))
+                self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def is_changed(self):
+        return self._is_changed
+
+    def add(self, namespace, task_id=None):
+        """
+        Add the namespace and its parents.
+        @param namespace: the namespace. e.g. 'gecko.v2.mozilla-central.latest.firefox.linux64-opt'.
+        @param task_id: the TaskId if the namespace is a task.
+        """
+        if not namespace:
+            return
+        with self._lock:
+            self._add(namespace, task_id)
+
+    def _add(self, namespace, task_id):
+        if namespace in self._entries:
+            if task_id and self._entries[namespace] != task_id:
+                self._entries[namespace] = task_id
+                self._is_changed = True
+            return
+        self._entries[namespace] = task_id
+        self._is_sorted = False
+        self._is_changed = True
+        parent = namespace.rpartition('.')[0]
+        while parent and parent not in self._entries:
+            self._entries[parent] = None
+            parent = parent.rpartition('.')[0]
+
+    def add_listing(self, listing):
+        """
+        Add the namespaces and tasks of listing.
+        @param listing: the dict of L{TaskFinder.get_namespaces_and_tasks}.
+        """
+        with self._lock:
+            if listing.get('node'):
+                self._add(listing['node'], None)
+            for namespace in listing.get('namespaces') or []:
+                self._add(namespace, None)
+            for namespace, task_id in listing.get('tasks') or []:
+                self._add(namespace, task_id)
+
+    def add_record(self, record):
+        """
+        Add the record of L{NamespaceCrawler.crawl}.
+        @param record: e.g. {'type': 'task', 'namespace': 'foo.bar.task', 'taskId': 'TASK_ID', 'depth': 2}.
+        """
+        self.add(record.get('namespace'), record.get('taskId') if record.get('type') == 'task' else None)
+
+    def get_task_id(self, namespace):
+        """
+        @return: the TaskId of namespace, or None if it is not a known task.
+        """
+        return self._entries.get(namespace)
+
+    def _get_names(self):
+        with self._lock:
+            if not self._is_sorted:
+                self._names = sorted(self._entries)
+                self._is_sorted = True
+            return self._names
+
+    def _to_results(self, names):
+        return [(name, self._entries.get(name)) for name in names]
+
+    def _iter_prefix(self, prefix):
+        names = self._get_names()
+        index = bisect.bisect_left(names, prefix)
+        while index < len(names) and names[index].startswith(prefix):
+            yield names[index]
+            index += 1
+
+    def prefix_search(self, prefix, limit=DEFAULT_LIMIT):
+        """
+        Find the namespaces start with prefix, in order.
+        @param prefix: the prefix. e.g. 'gecko.v2.mozilla-central'.
+        @param limit: the max number of results, None for no limit.
+        @return: the list of (namespace, TaskId or None).
+        """
+        names = []
+        for name in self._iter_prefix(prefix):
+            if limit is not None and len(names) >= limit:
+                break
+            names.append(name)
+        return self._to_results(names)
+
+    def glob_search(self, pattern, limit=DEFAULT_LIMIT):
+        """
+        Find the namespaces match the glob pattern, the range is narrowed by the literal prefix of pattern.
+        @param pattern: the glob pattern. e.g. 'gecko.v2.*.latest.firefox.linux64-opt'.
+        @param limit: the max number of results, None for no limit.
+        @return: the list of (namespace, TaskId or None).
+        """
+        prefix = pattern
+        for char in NamespaceIndex._GLOB_CHARS:
+            prefix = prefix.split(char, 1)[0]
+        names = []
+        for name in self._iter_prefix(prefix):
+            if limit is not None and len(names) >= limit:
+                break
+            if fnmatch.fnmatchcase(name, pattern):
+                names.append(name)
+        return self._to_results(names)
+
+    def substring_search(self, text, limit=DEFAULT_LIMIT):
+        """
+        Find the namespaces contain the text, in order.
+        @param text: the text. e.g. 'linux64-opt'.
+        @param limit: the max number of results, None for no limit.
+        @return: the list of (namespace, TaskId or None).
+        """
+        names = []
+        for name in self._get_names():
+            if limit is not None and len(names) >= limit:
+                break
+            if text in name:
+                names.append(name)
+        return self._to_results(names)
+
+    @staticmethod
+    def get_fuzzy_score(query, name):
+        """
+        Match the characters of query in order, case-insensitively.
+        The consecutive characters and the characters at the start of segments score more.
+        @param query: the query. e.g. 'm-c linux64opt'.
+        @param name: the namespace.
+        @return: the score, or None if it does not match.
+        """
+        score = 0
+        position = -1
+        last_position = -2
+        for char in query:
+            position = name.find(char, position + 1)
+            if position < 0:
+                return None
+            if position == last_position + 1:
+                score += 3
+            elif position == 0 or name[position - 1] in NamespaceIndex._SEPARATORS:
+                score += 2
+            else:
+                score += 1
+            last_position = position
+        return score
+
+    def fuzzy_search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Find the namespaces match the characters of query in order, the best matches first.
+        @param query: the query, the spaces are ignored. e.g. 'central linux64opt'.
+        @param limit: the max number of results, None for no limit.
+        @return: the list of (namespace, TaskId or None).
+        """
+        query = ''.join(query.lower().split())
+        if not query:
+            return []
+        scored = []
+        for name in self._get_names():
+            score = NamespaceIndex.get_fuzzy_score(query, name.lower())
+            if score is not None:
+                scored.append((-score, len(name), name))
+        scored.sort()
+        if limit is not None:
+            scored = scored[:limit]
+        return self._to_results([name for _, _, name in scored])
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Search by the glob pattern if query has '*', '?' or '[', otherwise by prefix, then substring, then fuzzy.
+        @param query: the query.
+        @param limit: the max number of results.
+        @return: the list of (namespace, TaskId or None).
+        """
+        query = query.strip()
+        if not query:
+            return []
+        if any(char in query for char in NamespaceIndex._GLOB_CHARS):
+            return self.glob_search(query, limit)
+        results = []
+        found = set()
+        for search in (self.prefix_search, self.substring_search, self.fuzzy_search):
+            for name, task_id in search(query, limit):
+                if name not in found:
+                    found.add(name)
+                    results.append((name, task_id))
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def load(self):
+        """
+        Load the index file.
+        """
+        with open(self.path) as fd:
+            content = json.load(fd)
+        if not isinstance(content, dict) or not isinstance(content.get('tasks', {}), dict):
+            raise ValueError('Unknown format of the search index.')
+        with self._lock:
+            for namespace in content.get('namespaces', []):
+                self._entries.setdefault(namespace, None)
+            self._entries.update(content.get('tasks', {}))
+            self._is_sorted = False
+        logger.debug('Loaded {} namespaces from [{}].'.format(len(self._entries), self.path))
+
+    def save(self):
+        """
+        Save the index file, it is replaced atomically.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            content = {
+                'namespaces': sorted(name for name, task_id in self._entries.items() if task_id is None),
+                'tasks': dict((name, task_id) for name, task_id in self._entries.items() if task_id is not None)
+            }
+            self._is_changed = False
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            json.dump(content, fd, separators=(',', ':'))
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+        logger.debug('Saved {} namespaces into [{}].'.format(len(self._entries), self.path))
@@ -0,0 +1,221 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# the phases of finding and downloading artifacts
+RESOLVE = 'resolve'
+INDEX_API = 'index_api'
+QUEUE_API = 'queue_api'
+SIGN = 'sign'
+FIRST_BYTE = 'first_byte'
+TRANSFER = 'transfer'
+DECODE = 'decode'
+VERIFY = 'verify'
+CACHE = 'cache'
+PUBLISH = 'publish'
+DOWNLOAD = 'download'
+
+STATS_FORMATS = ('json', 'prometheus')
+
+
+class _Timer(object):
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+        self.bytes_count = 0
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.record(self.phase, time.time() - self.started, self.bytes_count)
+
+
+class _NullTimer(object):
+    bytes_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class Stats(object):
+    """
+    The timings, byte counts and retry counts of each phase, shared by L{TaskFinder} and L{Downloader}.
+    Every record is passed to the hooks, e.g. L{StatsdExporter}.
+    """
+    enabled = True
+
+    def __init__(self, hooks=None):
+        """
+        @param hooks: the functions called with (phase, seconds, bytes_count, retries) of each record.
+        """
+        self.hooks = list(hooks or [])
+        self.started = time.time()
+        # {phase: [count, seconds, bytes, retries]}
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds=0, bytes_count=0, count=1, retries=0):
+        """
+        Add the timing, byte count and retry count of phase.
+        @param phase: the phase name. e.g. L{TRANSFER}.
+        @param seconds: the seconds spent.
+        @param bytes_count: the bytes processed.
+        @param count: the number of calls.
+        @param retries: the number of retries.
+        """
+        with self._lock:
+            values = self._phases.get(phase)
+            if values is None:
+                values = self._phases[phase] = [0, 0.0, 0, 0]
+            values[0] += count
+            values[1] += seconds
+            values[2] += bytes_count
+            values[3] += retries
+        for hook in self.hooks:
+            try:
+                hook(phase, seconds, bytes_count, retries)
+            except Exception as e:
+                logger.debug('Stats hook failed: {}'.format(e))
+
+    def add_retry(self, phase, error=None):
+        """
+        Count a retry of phase, it can be the on_retry callback of L{Resilience.call}.
+        """
+        self.record(phase, count=0, retries=1)
+
+    def timer(self, phase):
+        """
+        The context manager records the seconds of phase.
+        The bytes_count attribute of the timer can be set inside the context.
+        """
+        return _Timer(self, phase)
+
+    def get_phase(self, phase):
+        """
+        @return: the dict {'count', 'seconds', 'bytes', 'retries'} of phase.
+        """
+        with self._lock:
+            count, seconds, bytes_count, retries = self._phases.get(phase, (0, 0.0, 0, 0))
+        return {'count': count, 'seconds': seconds, 'bytes': bytes_count, 'retries': retries}
+
+    def to_dict(self):
+        """
+        @return: the dict {'elapsed': seconds, 'phases': {phase: {'count', 'seconds', 'bytes', 'retries'}}}.
+        """
+        with self._lock:
+            phases = list(self._phases)
+        return {'elapsed': time.time() - self.started,
+                'phases': dict((phase, self.get_phase(phase)) for phase in phases)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='taskcluster_util'):
+        """
+        @return: the Prometheus text format, for the textfile collector of node exporter.
+        """
+        phases = self.to_dict()['phases']
+        lines = []
+        for key, name in (('count', 'calls'), ('seconds', 'seconds'), ('bytes', 'bytes'), ('retries', 'retries')):
+            metric = '{}_phase_{}_total'.format(prefix, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            for phase in sorted(phases):
+                lines.append('{}{{phase="{}"}} {}'.format(metric, phase, phases[phase][key]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, stats_format, path=None):
+        """
+        Write the stats into file, the Prometheus textfile is replaced atomically.
+        @param stats_format: 'json' or 'prometheus'.
+        @param path: the file path, None for stderr.
+        """
+        content = self.to_json() + '\n' if stats_format == 'json' else self.to_prometheus()
+        if not path:
+            sys.stderr.write(content)
+            return
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            fd.write(content)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+
+class NullStats(Stats):
+    """
+    The stats which records nothing, used when the stats are off.
+    """
+    enabled = False
+    _TIMER = _NullTimer()
+
+    def record(self, phase, seconds=0, bytes_count=0, count=1, retries=0):
+        pass
+
+    def add_retry(self, phase, error=None):
+        pass
+
+    def timer(self, phase):
+        return NullStats._TIMER
+
+
+NULL_STATS = NullStats()
+
+
+class StatsdExporter(object):
+    """
+    The stats hook which sends the records to StatsD by UDP.
+    """
+
+    def __init__(self, address, prefix='taskcluster_util'):
+        """
+        @param address: the 'HOST:PORT' of StatsD, the default port is 8125.
+        @param prefix: the prefix of metric names.
+        """
+        host, _, port = address.rpartition(':') if ':' in address else (address, None, None)
+        self.address = (host or 'localhost', int(port or 8125))
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, phase, seconds, bytes_count, retries):
+        metrics = []
+        if seconds:
+            metrics.append('{}.{}.time:{:.3f}|ms'.format(self.prefix, phase, seconds * 1000))
+        if bytes_count:
+            metrics.append('{}.{}.bytes:{}|c'.format(self.prefix, phase, bytes_count))
+        if retries:
+            metrics.append('{}.{}.retries:{}|c'.format(self.prefix, phase, retries))
+        if metrics:
+            try:
+                self._socket.sendto('\n'.join(metrics), self.address)
+            except socket.error as e:
+                logger.debug('Can not send stats to StatsD {}: {}'.format(self.address, e))
+
+
+def create_stats(stats_format=None, statsd=None):
+    """
+    Create the stats for CLI tools.
+    @param stats_format: 'json' or 'prometheus', None for no output.
+    @param statsd: the 'HOST:PORT' of StatsD, None for no StatsD.
+    @return: the L{Stats}, or L{NULL_STATS} if nothing is recorded.
+    """
+    if not stats_format and not statsd:
+        return NULL_STATS
+    hooks = [StatsdExporter(statsd)] if statsd else []
+    return Stats(hooks=hooks)
@@ -0,0 +1,469 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import zlib
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from resilience import get_default_resilience
+
+
+logger = logging.getLogger(__name__)
+
+# the range of read size, it is adapted to the measured throughput
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# the max number of keep-alive connections per host
+POOL_MAXSIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+# do not split the artifact into segments smaller than this size
+MIN_SEGMENT_SIZE = 1024 * 1024
+# the number of retries of a broken or short byte range, the retry asks for the remaining bytes only
+SEGMENT_RETRIES = 2
+
+
+def _mount_adapters(session, pool_maxsize):
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def get_session():
+    """
+    Get the shared HTTP session, which keeps the keep-alive connections per host.
+    It's shared by all artifact transfers of the process.
+    @return: the requests session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            _mount_adapters(session, POOL_MAXSIZE)
+            # the content encoding is handled by GzipDecoder, do not ask for other encodings
+            session.headers['Accept-Encoding'] = 'identity'
+            _session = session
+        return _session
+
+
+def set_pool_maxsize(pool_maxsize):
+    """
+    Set the max number of keep-alive connections per host of the shared HTTP session.
+    The connections of the old pool are dropped.
+    @param pool_maxsize: the max number of connections.
+    """
+    global POOL_MAXSIZE
+    with _session_lock:
+        POOL_MAXSIZE = pool_maxsize
+        if _session is not None:
+            _mount_adapters(_session, pool_maxsize)
+
+
+def ensure_pool_maxsize(pool_maxsize):
+    """
+    Grow the pool of the shared HTTP session, so the given number of parallel connections per host are kept alive.
+    @param pool_maxsize: the number of parallel connections.
+    """
+    if pool_maxsize > POOL_MAXSIZE:
+        set_pool_maxsize(pool_maxsize)
+
+
+def open_url(url, headers=None):
+    """
+    Open the given url by the shared HTTP session.
+    @param url: the url.
+    @param headers: the extra request headers dict.
+    @return: the streaming response. The 304 response is returned without raising error.
+    """
+    # the requests to the same host share the rate limit
+    get_default_resilience().acquire(url)
+    response = get_session().get(url, headers=headers or {}, stream=True)
+    if response.status_code >= 400:
+        response.close()
+        response.raise_for_status()
+    return response
+
+
+def release_response(response):
+    """
+    Return the connection to the pool if the content is fully read, otherwise close it.
+    @param response: the response.
+    """
+    if response.raw.closed:
+        response.raw.release_conn()
+    else:
+        response.close()
+
+
+def get_content_length(response):
+    """
+    Get the Content-Length of response.
+    @param response: the response.
+    @return: the length, or 0 if there is no Content-Length.
+    """
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        return int(content_length.strip())
+    return 0
+
+
+def is_range_supported(response):
+    """
+    Check the server supports the byte range requests or not.
+    @param response: the response.
+    @return: True if the server accepts byte ranges.
+    """
+    accept_ranges = response.headers.get('Accept-Ranges')
+    return accept_ranges is not None and accept_ranges.strip().lower() == 'bytes'
+
+
+def is_gzip_encoded(response):
+    """
+    Check the content is encoded by GZip or not.
+    @param response: the response.
+    @return: True if the Content-Encoding is gzip.
+    """
+    content_encoding = response.headers.get('Content-Encoding')
+    if content_encoding and 'gzip' in content_encoding.strip():
+        logger.debug('Content-Encoding={}'.format(content_encoding))
+        return True
+    return False
+
+
+def get_content_range(response):
+    """
+    Get the Content-Range of partial content response.
+    @param response: the response.
+    @return: the tuple (START, END, TOTAL), the END is exclusive. Or None if there is no Content-Range.
+    """
+    content_range = response.headers.get('Content-Range')
+    if not content_range:
+        return None
+    # format: "bytes START-END/TOTAL"
+    unit, _, value = content_range.strip().partition(' ')
+    byte_range, _, total = value.partition('/')
+    start, _, end = byte_range.partition('-')
+    if unit != 'bytes' or total == '*':
+        return None
+    return int(start), int(end) + 1, int(total)
+
+
+def copy_stream(response, fd, start, end=None, on_written=None, hasher=None):
+    """
+    Copy the content of response into the file at given offset.
+    @param response: the response.
+    @param fd: the opened local file.
+    @param start: the start offset of file.
+    @param end: the expected end offset, exclusive. None for reading until EOF.
+    @param on_written: the callback with the written range (START, END) of each chunk.
+    @param hasher: the L{StreamHasher} updated with each chunk, the content should be written in order.
+    @return: the end offset of written content.
+    """
+    offset = start
+    fd.seek(offset)
+    reader = ChunkReader(response.raw)
+    while end is None or offset < end:
+        chunk = reader.read(None if end is None else end - offset)
+        if not chunk:
+            break
+        fd.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+        if on_written:
+            # the chunk is in the file before it is reported, e.g. recorded by the journal
+            fd.flush()
+            on_written(offset, offset + len(chunk))
+        offset += len(chunk)
+    return offset
+
+
+class ChunkReader(object):
+    """
+    Read the stream into a reusable buffer, and adapt the read size to the measured throughput.
+    """
+    # double the read size if a full chunk is read faster than this (seconds), halve it if slower than _SLOW_READ
+    _FAST_READ = 0.05
+    _SLOW_READ = 0.5
+
+    def __init__(self, stream, min_chunk_size=MIN_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE):
+        """
+        @param stream: the stream, which has read() or readinto() method.
+        @param min_chunk_size: the min read size.
+        @param max_chunk_size: the max read size.
+        """
+        self.stream = stream
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.chunk_size = min_chunk_size
+        self._readinto = getattr(stream, 'readinto', None)
+        self._view = memoryview(bytearray(max_chunk_size)) if self._readinto else None
+
+    def read(self, limit=None):
+        """
+        Read the next chunk.
+        The returned memoryview is only valid until the next read.
+        @param limit: the max size of chunk.
+        @return: the chunk, it's empty when EOF.
+        """
+        size = self.chunk_size if limit is None else min(self.chunk_size, limit)
+        started = time.time()
+        if self._readinto:
+            chunk = self._view[:self._readinto(self._view[:size]) or 0]
+        else:
+            chunk = self.stream.read(size)
+        self._adapt(len(chunk), size, time.time() - started)
+        return chunk
+
+    def _adapt(self, read_size, request_size, duration):
+        if read_size == request_size == self.chunk_size and duration < ChunkReader._FAST_READ:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+        elif duration > ChunkReader._SLOW_READ:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+
+
+class NullProgress(object):
+    """
+    The progress bar which displays nothing.
+    """
+    maxval = 0
+
+    def update(self, value):
+        pass
+
+    def finish(self):
+        pass
+
+
+class ThrottledProgress(object):
+    """
+    Redraw the progress bar at most once per interval.
+    """
+    def __init__(self, progress, interval=0.2):
+        """
+        @param progress: the progress bar.
+        @param interval: the min interval (seconds) between two redraws.
+        """
+        self.progress = progress
+        self.interval = interval
+        self._last_update = 0
+
+    @property
+    def maxval(self):
+        return self.progress.maxval
+
+    @maxval.setter
+    def maxval(self, value):
+        self.progress.maxval = value
+
+    def update(self, value):
+        now = time.time()
+        if now - self._last_update >= self.interval:
+            self._last_update = now
+            self.progress.update(value)
+
+    def finish(self):
+        self.progress.finish()
+
+
+def split_ranges(total_length, parts, min_size=MIN_SEGMENT_SIZE, offset=0):
+    """
+    Split the content into byte ranges.
+    @param total_length: the length of content.
+    @param parts: the max number of ranges.
+    @param min_size: the min size of each range.
+    @param offset: the start offset of content.
+    @return: the ranges list. e.g. [(START, END), ...], the END is exclusive.
+    """
+    if total_length <= 0:
+        return []
+    parts = max(1, min(parts, total_length // min_size))
+    segment_size = total_length // parts
+    ranges = []
+    start = offset
+    for idx in range(parts):
+        end = offset + total_length if idx == parts - 1 else start + segment_size
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def split_missing_ranges(missing_ranges, parts, min_size=MIN_SEGMENT_SIZE):
+    """
+    Split the missing ranges into byte ranges for parallel connections.
+    @param missing_ranges: the ranges list. e.g. [(START, END), ...], the END is exclusive.
+    @param parts: the max number of ranges of all missing ranges.
+    @param min_size: the min size of each range.
+    @return: the ranges list. e.g. [(START, END), ...], the END is exclusive.
+    """
+    missing_size = sum(end - start for start, end in missing_ranges)
+    ranges = []
+    for start, end in missing_ranges:
+        # split each missing range proportionally
+        range_parts = max(1, parts * (end - start) // missing_size) if missing_size else 1
+        ranges.extend(split_ranges(end - start, range_parts, min_size, offset=start))
+    return ranges
+
+
+class GzipDecoder(object):
+    """
+    Decode the GZip content chunk by chunk, so the memory usage does not depend on the content size.
+    """
+    # accept the gzip header and trailer
+    _WBITS = 16 + zlib.MAX_WBITS
+    # the max size of each decoded piece, the highly compressed chunk can be expanded a lot
+    MAX_DECODED_SIZE = 1024 * 1024
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(GzipDecoder._WBITS)
+
+    def iter_decode(self, data):
+        """
+        Decode the chunk into the pieces up to L{MAX_DECODED_SIZE}.
+        @param data: the encoded chunk.
+        @return: the generator of decoded pieces.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        while True:
+            piece = self._decompressor.decompress(data, GzipDecoder.MAX_DECODED_SIZE)
+            if piece:
+                yield piece
+            data = self._decompressor.unused_data
+            if data:
+                # the next gzip member
+                self._decompressor = zlib.decompressobj(GzipDecoder._WBITS)
+                continue
+            data = self._decompressor.unconsumed_tail
+            if not data and len(piece) < GzipDecoder.MAX_DECODED_SIZE:
+                break
+            # the output is capped, continue with the remaining input and the pending output
+
+    def decode(self, data):
+        """
+        Decode the chunk. The decoded data is not bounded, use L{iter_decode} for streaming.
+        @param data: the encoded chunk.
+        @return: the decoded data.
+        """
+        return ''.join(self.iter_decode(data))
+
+    def flush(self):
+        """
+        Decode the remaining data.
+        @return: the decoded data.
+        """
+        return self._decompressor.flush()
+
+
+class RangeNotSupportedError(Exception):
+    """
+    The server does not return the partial content for the byte range request.
+    """
+    pass
+
+
+class RangedFetcher(object):
+    def __init__(self, url, path, ranges, connections, on_written=None, retries=SEGMENT_RETRIES, on_retry=None):
+        """
+        Fetch the byte ranges of url in parallel, and write them into the given file.
+        The file should be created before running.
+        @param url: the url, which supports byte range requests.
+        @param path: the local file path.
+        @param ranges: the ranges list. e.g. [(START, END), ...], the END is exclusive.
+        @param connections: the number of parallel connections.
+        @param on_written: the callback with the written range (START, END) of each chunk.
+        @param retries: the number of retries of each range, for the remaining bytes.
+        @param on_retry: the function called with the error before each retry.
+        """
+        self.url = url
+        self.path = path
+        self.ranges = list(ranges)
+        self.connections = max(1, connections)
+        self.on_written = on_written
+        self.retries = retries
+        self.on_retry = on_retry
+        self._lock = threading.Lock()
+        self._errors = []
+
+    def _next_range(self):
+        with self._lock:
+            if self._errors or not self.ranges:
+                return None
+            return self.ranges.pop(0)
+
+    def _fetch_once(self, start, end, on_written):
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+        response = open_url(self.url, headers)
+        try:
+            content_range = get_content_range(response) if response.status_code == 206 else None
+            if content_range is None or content_range[0] != start:
+                raise RangeNotSupportedError('Server does not return partial content for range [{}-{}].'.format(
+                    start, end - 1))
+            with open(self.path, 'r+b') as fd:
+                offset = copy_stream(response, fd, start, end, on_written)
+            if offset != end:
+                raise IOError('Range [{}-{}] ended at {}.'.format(start, end - 1, offset))
+        finally:
+            release_response(response)
+
+    def _fetch_range(self, start, end):
+        """
+        Fetch the range, and retry the remaining bytes if the connection is broken or closed early.
+        """
+        offset = [start]
+
+        def on_written(chunk_start, chunk_end):
+            offset[0] = chunk_end
+            if self.on_written:
+                self.on_written(chunk_start, chunk_end)
+
+        attempt = 0
+        while True:
+            try:
+                self._fetch_once(offset[0], end, on_written)
+                return
+            except RangeNotSupportedError:
+                # retrying does not help
+                raise
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.debug('Range [{}-{}] failed at {}, retry {}: {}'.format(start, end - 1, offset[0], attempt, e))
+                if self.on_retry:
+                    self.on_retry(e)
+                time.sleep(get_default_resilience().get_backoff(attempt, e))
+
+    def _worker(self):
+        while True:
+            byte_range = self._next_range()
+            if byte_range is None:
+                break
+            try:
+                self._fetch_range(*byte_range)
+            except Exception as e:
+                logger.debug('Fetch range {} failed: {}'.format(byte_range, e))
+                with self._lock:
+                    self._errors.append(e)
+
+    def run(self):
+        """
+        Fetch all ranges.
+        Raise the first error if any range failed, L{RangeNotSupportedError} if the server ignores the byte ranges.
+        """
+        logger.debug('Fetching {} ranges with {} connections.'.format(len(self.ranges), self.connections))
+        workers = []
+        for _ in range(min(self.connections, len(self.ranges))):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        if self._errors:
+            raise self._errors[0]
@@ -0,0 +1,67 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class SignedUrlCache(object):
+    """
+    The in-process LRU cache of signed URLs.
+    The URL is reused until the safety margin before its signature expires.
+    """
+    DEFAULT_MAX_SIZE = 4096
+    DEFAULT_MARGIN = 60
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, margin=DEFAULT_MARGIN):
+        """
+        @param max_size: the max number of URLs.
+        @param margin: the seconds before expiration, the URL will not be reused after that.
+        """
+        self.max_size = max_size
+        self.margin = margin
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the signed URL.
+        @param key: the cache key, e.g. (TaskId, artifact name, clientId).
+        @return: the URL, or None if there is no usable URL.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            url, expires = entry
+            if time.time() >= expires - self.margin:
+                return None
+            # move to the most recently used end
+            self._entries[key] = entry
+            return url
+
+    def put(self, key, url, expires):
+        """
+        Store the signed URL.
+        @param key: the cache key, e.g. (TaskId, artifact name, clientId).
+        @param url: the signed URL.
+        @param expires: the expiration timestamp of signature.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (url, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
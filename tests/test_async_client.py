@@ -0,0 +1,65 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+from mock import patch
+from taskcluster_util.util.async_client import AsyncPool, AsyncTaskFinder, AsyncDownloader, MAX_CONCURRENCY
+
+
+class AsyncClientTester(unittest.TestCase):
+
+    def test_async_task_finder(self):
+        """
+        test AsyncTaskFinder returns the results by AsyncResult
+        """
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.findTask.side_effect = lambda namespace: {u'namespace': namespace, u'taskId': namespace.upper()}
+            instance.listNamespaces.return_value = {u'namespaces': [{u'namespace': u'foo.bar', u'name': u'bar'}]}
+
+            finder = AsyncTaskFinder(max_concurrency=4)
+            try:
+                results = [finder.get_taskid_by_namespace('ns{}'.format(idx)) for idx in range(20)]
+                self.assertEqual([result.get(10) for result in results], ['NS{}'.format(idx) for idx in range(20)])
+                self.assertEqual(finder.get_namespaces('foo').get(10), [u'foo.bar'])
+            finally:
+                finder.close()
+
+    def test_shared_pool(self):
+        """
+        test the clients share the pool, and the errors are raised by AsyncResult
+        """
+        with patch('taskcluster.Index') as MockIndex, patch('taskcluster.Queue') as MockQueue:
+            MockIndex.return_value.findTask.side_effect = Exception('not found')
+            MockQueue.return_value.listLatestArtifacts.return_value = {u'artifacts': []}
+
+            pool = AsyncPool(2)
+            try:
+                finder = AsyncTaskFinder(pool=pool)
+                downloader = AsyncDownloader(pool=pool)
+                self.assertIs(finder.pool, downloader.pool)
+                self.assertRaises(Exception, finder.get_taskid_by_namespace('foo').get, 10)
+                callback_results = []
+                ret = downloader.get_latest_artifacts('tid', callback=callback_results.append).get(10)
+                self.assertEqual(ret, {u'artifacts': []})
+                finder.close()
+                downloader.close()
+            finally:
+                pool.close()
+            self.assertEqual(callback_results, [{u'artifacts': []}])
+
+    def test_pool_size_limit(self):
+        """
+        test the pool size is limited, each in-flight call holds a worker thread
+        """
+        with patch('taskcluster_util.util.async_client.ThreadPool') as MockPool, \
+                patch('taskcluster_util.util.transfer.set_pool_maxsize') as mock_set_pool_maxsize:
+            self.assertEqual(AsyncPool(MAX_CONCURRENCY * 10).max_concurrency, MAX_CONCURRENCY)
+            MockPool.assert_called_once_with(MAX_CONCURRENCY)
+            mock_set_pool_maxsize.assert_called_once_with(MAX_CONCURRENCY)
+            self.assertEqual(AsyncPool(0).max_concurrency, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock, patch
+from taskcluster_util.util.batch import BatchDownloader, load_manifest
+
+
+class BatchTester(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _create_manifest(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w') as fd:
+            fd.write(content)
+        return path
+
+    def test_load_line_manifest(self):
+        """
+        test load_manifest with lines
+        """
+        path = self._create_manifest('manifest.txt', '# comment\n'
+                                                     'gecko.v2.foo.latest public/build/target.zip\n'
+                                                     '\n'
+                                                     'Hy5CZMbmSqOyCpNj_k1KNQ public/logs/live.log /tmp/logs\n')
+        items = load_manifest(path)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0].namespace, 'gecko.v2.foo.latest')
+        self.assertIsNone(items[0].task_id)
+        self.assertEqual(items[1].task_id, 'Hy5CZMbmSqOyCpNj_k1KNQ')
+        self.assertEqual(items[1].artifact_name, 'public/logs/live.log')
+        self.assertEqual(items[1].dest_dir, '/tmp/logs')
+
+    def test_load_json_manifest(self):
+        """
+        test load_manifest with JSON
+        """
+        path = self._create_manifest('manifest', '[{"namespace": "foo.bar", "artifact": "a.zip", "dest": "out"},'
+                                                 ' {"taskid": "tid", "artifact": "b.zip"}]')
+        items = load_manifest(path)
+        self.assertEqual([(item.namespace, item.task_id, item.artifact_name, item.dest_dir) for item in items],
+                         [('foo.bar', None, 'a.zip', 'out'), (None, 'tid', 'b.zip', None)])
+
+    def test_load_yaml_manifest_from_stdin(self):
+        """
+        test load_manifest detects the YAML manifest from stdin by the content
+        """
+        content = u'# artifacts\n- namespace: foo.bar\n  artifact: a.zip\n- taskid: tid\n  artifact: b.zip\n  dest: out\n'
+        with patch('sys.stdin', io.StringIO(content)):
+            items = load_manifest('-')
+        self.assertEqual([(item.namespace, item.task_id, item.artifact_name, item.dest_dir) for item in items],
+                         [('foo.bar', None, 'a.zip', None), (None, 'tid', 'b.zip', 'out')])
+        with patch('sys.stdin', io.StringIO(u'items:\n  - {namespace: foo.bar, artifact: a.zip}\n')):
+            self.assertEqual([item.artifact_name for item in load_manifest('-')], ['a.zip'])
+
+    def test_load_malformed_manifest(self):
+        """
+        test load_manifest raises on the malformed lines and items
+        """
+        for content in ('foo.bar a.zip\n- foo.bar b.zip\n', 'foo.bar\n', 'foo..bar a.zip\n', '["foo.bar a.zip"]'):
+            path = self._create_manifest('manifest', content)
+            self.assertRaises(Exception, load_manifest, path)
+
+    def test_run(self):
+        """
+        test BatchDownloader resolves the namespace once and keeps the failed items
+        """
+        path = self._create_manifest('manifest.txt', 'foo.bar a.zip\n'
+                                                     'foo.bar b.zip\n'
+                                                     'foo.bar broken.zip\n')
+        finder = Mock()
+        finder.normalize_namespace.side_effect = lambda namespace: namespace
+        finder.get_taskid_by_namespace.return_value = 'tid'
+        downloader = Mock()
+
+        def download(task_id, artifact_name, dest_dir, digest=None):
+            if artifact_name == 'broken.zip':
+                raise Exception('broken')
+            return os.path.join(dest_dir, artifact_name)
+        downloader.download_latest_artifact.side_effect = download
+
+        items = BatchDownloader(finder, downloader, jobs=1, dest_dir='out').run(load_manifest(path))
+        self.assertEqual([item.local_file for item in items], [os.path.join('out', 'a.zip'), os.path.join('out', 'b.zip'), None])
+        self.assertEqual(str(items[2].error), 'broken')
+        self.assertEqual(finder.get_taskid_by_namespace.call_count, 1)
+
+    def test_collisions(self):
+        """
+        test the different artifacts saved to the same file are refused before downloading
+        """
+        path = self._create_manifest('manifest.txt', 'foo.bar public/a/log.txt\n'
+                                                     'foo.bar public/b/log.txt\n'
+                                                     'foo.bar public/c/log.txt c\n'
+                                                     'foo.bar public/a/log.txt\n')
+        downloader = Mock()
+        batch_downloader = BatchDownloader(Mock(), downloader, dest_dir='out')
+        with self.assertRaises(Exception) as context:
+            batch_downloader.run(load_manifest(path))
+        self.assertIn('[foo.bar public/a/log.txt], [foo.bar public/b/log.txt]', str(context.exception))
+        self.assertNotIn('public/c/log.txt', str(context.exception))
+        self.assertEqual(downloader.download_latest_artifact.call_count, 0)
+
+        # the same artifact, and the artifacts in different dest folders
+        path = self._create_manifest('manifest.txt', 'foo.bar public/a/log.txt\n'
+                                                     'foo.bar public/a/log.txt\n'
+                                                     'foo.bar public/b/log.txt b\n')
+        batch_downloader.run(load_manifest(path))
+        self.assertEqual(downloader.download_latest_artifact.call_count, 3)
+
+        # the same artifact by namespace and TaskId
+        finder = Mock()
+        finder.normalize_namespace.side_effect = lambda namespace: namespace
+        finder.get_taskid_by_namespace.return_value = 'Hy5CZMbmSqOyCpNj_k1KNQ'
+        path = self._create_manifest('manifest.txt', 'foo.bar public/a/log.txt\n'
+                                                     'Hy5CZMbmSqOyCpNj_k1KNQ public/a/log.txt\n')
+        items = BatchDownloader(finder, downloader, dest_dir='out').run(load_manifest(path))
+        self.assertEqual([item.error for item in items], [None, None])
+        # the namespace of the other task is a collision
+        finder.get_taskid_by_namespace.return_value = 'other'
+        self.assertRaises(Exception, BatchDownloader(finder, downloader, dest_dir='out').run, load_manifest(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
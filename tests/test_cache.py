@@ -0,0 +1,155 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from taskcluster_util.util.cache import ArtifactCache, parse_size, link_or_copy
+
+
+class CacheTester(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _create_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as fd:
+            fd.write(content)
+        return path
+
+    def test_parse_size(self):
+        """
+        test parse_size
+        """
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('2K'), 2048)
+        self.assertEqual(parse_size('1.5M'), 1536 * 1024)
+        self.assertEqual(parse_size('10GB'), 10 * 1024 ** 3)
+
+    def test_link_or_copy(self):
+        """
+        test the target is replaced by renaming, and kept if putting the file failed
+        """
+        origin = self._create_file('origin', 'new')
+        target = self._create_file('target', 'old')
+
+        def broken_copy(origin_path, temp_path, hardlink=True):
+            with open(temp_path, 'wb') as fd:
+                fd.write('ne')
+            raise IOError('No space left on device')
+
+        with patch('taskcluster_util.util.cache._link_or_copy', side_effect=broken_copy):
+            self.assertRaises(IOError, link_or_copy, origin, target)
+        with open(target, 'rb') as fd:
+            self.assertEqual(fd.read(), 'old')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['origin', 'target'])
+
+        link_or_copy(origin, target)
+        with open(target, 'rb') as fd:
+            self.assertEqual(fd.read(), 'new')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['origin', 'target'])
+
+    def test_put_and_materialize(self):
+        """
+        test put and materialize
+        """
+        cache = ArtifactCache(self.cache_dir)
+        local_file = self._create_file('foo.txt', 'foo')
+        self.assertIsNone(cache.get_entry('tid', 'public/foo.txt'))
+
+        cache.put('tid', 'public/foo.txt', local_file, etag='"e"')
+        entry = cache.get_entry('tid', 'public/foo.txt')
+        self.assertEqual(entry['size'], 3)
+        self.assertEqual(ArtifactCache.get_validators(entry), {'If-None-Match': '"e"'})
+
+        dest = os.path.join(self.temp_dir, 'dest.txt')
+        cache.materialize(entry, dest)
+        with open(dest, 'rb') as fd:
+            self.assertEqual(fd.read(), 'foo')
+
+    def test_edit_downloaded_file(self):
+        """
+        test editing the downloaded files in place does not change the cached artifact
+        """
+        cache = ArtifactCache(self.cache_dir)
+        local_file = self._create_file('foo.txt', 'foo')
+        entry = cache.put('tid', 'public/foo.txt', local_file, etag='"e"')
+        object_path = os.path.join(cache.objects_dir, entry['sha256'])
+        self.assertFalse(os.stat(object_path).st_mode & 0o222)
+        with open(local_file, 'r+b') as fd:
+            fd.write('bar')
+
+        dest = os.path.join(self.temp_dir, 'dest.txt')
+        cache.materialize(entry, dest)
+        with open(dest, 'rb') as fd:
+            self.assertEqual(fd.read(), 'foo')
+        with open(dest, 'r+b') as fd:
+            fd.write('baz')
+        with open(object_path, 'rb') as fd:
+            self.assertEqual(fd.read(), 'foo')
+
+    def test_put_without_validators(self):
+        """
+        test put the artifact which can not be validated
+        """
+        cache = ArtifactCache(self.cache_dir)
+        local_file = self._create_file('foo.txt', 'foo')
+        self.assertIsNone(cache.put('tid', 'foo.txt', local_file))
+        self.assertIsNone(cache.get_entry('tid', 'foo.txt'))
+
+    def test_evict(self):
+        """
+        test the least recently used artifact is evicted
+        """
+        cache = ArtifactCache(self.cache_dir, max_size=10)
+        cache.put('tid', 'a', self._create_file('a', 'aaaa'), etag='"a"')
+        time.sleep(0.01)
+        cache.put('tid', 'b', self._create_file('b', 'bbbb'), etag='"b"')
+        time.sleep(0.01)
+        cache.materialize(cache.get_entry('tid', 'a'), os.path.join(self.temp_dir, 'a2'))
+        time.sleep(0.01)
+        cache.put('tid', 'c', self._create_file('c', 'cccc'), etag='"c"')
+
+        self.assertIsNotNone(cache.get_entry('tid', 'a'))
+        self.assertIsNone(cache.get_entry('tid', 'b'))
+        self.assertIsNotNone(cache.get_entry('tid', 'c'))
+
+    def test_evict_orphans(self):
+        """
+        test the objects which are not indexed are counted and evicted
+        """
+        cache = ArtifactCache(self.cache_dir, max_size=10)
+        cache.put('tid', 'a', self._create_file('a', 'aaaa'), etag='"a1"')
+        time.sleep(0.01)
+        # the new content of the same artifact, the old object is no longer indexed
+        cache.put('tid', 'a', self._create_file('a', 'AAAA'), etag='"a2"')
+        self.assertEqual(len(os.listdir(cache.objects_dir)), 2)
+        time.sleep(0.01)
+        cache.put('tid', 'b', self._create_file('b', 'bbbb'), etag='"b"')
+        self.assertEqual(sorted(os.listdir(cache.objects_dir)),
+                         sorted([cache.get_entry('tid', 'a')['sha256'], cache.get_entry('tid', 'b')['sha256']]))
+
+        # the orphan out of grace is removed, even if the cache is not full
+        cache = ArtifactCache(self.cache_dir, max_size=0)
+        orphan = os.path.join(cache.objects_dir, 'orphan')
+        with open(orphan, 'wb') as fd:
+            fd.write('orphan')
+        cache.put('tid', 'c', self._create_file('c', 'cccc'), etag='"c"')
+        self.assertTrue(os.path.exists(orphan))
+        os.utime(orphan, (time.time() - 3600, time.time() - 3600))
+        cache.put('tid', 'd', self._create_file('d', 'dddd'), etag='"d"')
+        self.assertFalse(os.path.exists(orphan))
+        self.assertEqual(len(os.listdir(cache.objects_dir)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
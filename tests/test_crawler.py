@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import threading
+import unittest
+from mock import patch
+from taskcluster_util.util.crawler import NamespaceCrawler
+from taskcluster_util.util.finder import TaskFinder
+
+
+class FakeTaskFinder(object):
+    TREE = {
+        '': ['a', 'b'],
+        'a': ['a.x', 'a.y'],
+        'a.x': ['a.x.deep'],
+        'b': ['b.z'],
+    }
+    TASKS = {
+        'a.x': [('a.x.opt', 'TID1')],
+        'b.z': [('b.z.opt', 'TID2'), ('b.z.debug', 'TID3')],
+    }
+
+    def iter_namespaces_and_tasks(self, ns_node='', limit=1000):
+        yield {'node': ns_node, 'namespaces': FakeTaskFinder.TREE.get(ns_node, []), 'tasks': []}
+        yield {'node': ns_node, 'namespaces': [], 'tasks': FakeTaskFinder.TASKS.get(ns_node, [])}
+
+
+class CrawlerTester(unittest.TestCase):
+
+    def _crawl(self, root='', **kwargs):
+        crawler = NamespaceCrawler(FakeTaskFinder(), workers=3, **kwargs)
+        return sorted((record['type'], record['namespace'], record['depth']) for record in crawler.crawl(root))
+
+    def test_crawl(self):
+        """
+        test crawl the whole tree
+        """
+        ret = self._crawl()
+        self.assertEqual(len(ret), 9)
+        self.assertIn(('namespace', 'a.x.deep', 3), ret)
+        self.assertIn(('task', 'b.z.debug', 3), ret)
+
+    def test_crawl_from_namespace(self):
+        """
+        test crawl from the given root namespace
+        """
+        self.assertEqual(self._crawl('a.x'), [('namespace', 'a.x.deep', 1), ('task', 'a.x.opt', 1)])
+
+    def test_max_depth(self):
+        """
+        test crawl with max depth
+        """
+        self.assertEqual(self._crawl(max_depth=0), [])
+        self.assertEqual(self._crawl(max_depth=1), [('namespace', 'a', 1), ('namespace', 'b', 1)])
+        self.assertEqual(self._crawl('a', max_depth=1), [('namespace', 'a.x', 1), ('namespace', 'a.y', 1)])
+        self.assertNotIn(('namespace', 'a.x.deep', 3), self._crawl(max_depth=2))
+
+    def test_filters(self):
+        """
+        test crawl with include and exclude patterns
+        """
+        self.assertEqual(self._crawl(includes=['*.opt']), [('task', 'a.x.opt', 3), ('task', 'b.z.opt', 3)])
+        # the excluded namespaces are not crawled
+        self.assertEqual(self._crawl(includes=['*.opt'], excludes=['a']), [('task', 'b.z.opt', 3)])
+
+    def test_stop_early(self):
+        """
+        test stop crawling by closing the generator
+        """
+        records = NamespaceCrawler(FakeTaskFinder()).crawl()
+        self.assertIsNotNone(next(records))
+        records.close()
+
+    def test_max_calls(self):
+        """
+        test the Index API calls of the background listings are bounded by the workers
+        """
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def listing(key, items):
+            def list_method(ns_node, payload):
+                with lock:
+                    running[0] += 1
+                    peak[0] = max(peak[0], running[0])
+                time.sleep(0.01)
+                with lock:
+                    running[0] -= 1
+                # two pages of each listing, the second page is prefetched
+                if payload.get('continuationToken'):
+                    return {key: []}
+                return {key: items(ns_node), 'continuationToken': 'next'}
+            return list_method
+
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.listNamespaces.side_effect = listing('namespaces', lambda ns_node: [
+                {'namespace': child} for child in FakeTaskFinder.TREE.get(ns_node, [])])
+            instance.listTasks.side_effect = listing('tasks', lambda ns_node: [
+                {'namespace': name, 'taskId': task_id} for name, task_id in FakeTaskFinder.TASKS.get(ns_node, [])])
+            crawler = NamespaceCrawler(TaskFinder(max_calls=2), workers=2)
+            records = list(crawler.crawl())
+        self.assertEqual(len(records), 9)
+        self.assertEqual(peak[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
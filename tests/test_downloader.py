@@ -0,0 +1,358 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import io
+import os
+import time
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+import contextlib
+from multiprocessing.pool import ThreadPool
+from mock import patch
+from taskcluster_util.util.downloader import Downloader, FolderHandler
+from taskcluster_util.util.integrity import IntegrityError
+from taskcluster_util.util.resilience import Resilience
+
+
+class FakeResponse(object):
+    def __init__(self, content, headers=None, status_code=200):
+        self.raw = io.BytesIO(content)
+        self.headers = headers if headers is not None else {'Content-Length': str(len(content))}
+        self.status_code = status_code
+        self.url = 'http://localhost/artifact'
+
+    def close(self):
+        self.raw.close()
+
+
+class FakeArtifactServer(object):
+    """
+    The fake open_url which serves the artifact content, and the byte ranges like S3.
+    """
+    def __init__(self, content, accept_ranges=True, honour_ranges=True, validators=True):
+        """
+        @param content: the artifact content.
+        @param accept_ranges: send 'Accept-Ranges: bytes' or not.
+        @param honour_ranges: return the partial content for the byte range requests or not.
+        @param validators: send the ETag or not.
+        """
+        self.content = content
+        self.accept_ranges = accept_ranges
+        self.honour_ranges = honour_ranges
+        self.validators = validators
+        # the Range header of requests, None for the full content
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def open_url(self, url, headers=None):
+        byte_range = (headers or {}).get('Range')
+        with self._lock:
+            self.requests.append(byte_range)
+        response_headers = {}
+        if self.accept_ranges:
+            response_headers['Accept-Ranges'] = 'bytes'
+        if self.validators:
+            response_headers['ETag'] = '"etag"'
+        if byte_range and self.honour_ranges:
+            start, _, end = byte_range[len('bytes='):].partition('-')
+            start, end = int(start), int(end) + 1 if end else len(self.content)
+            response_headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, len(self.content))
+            response_headers['Content-Length'] = str(end - start)
+            return FakeResponse(self.content[start:end], response_headers, status_code=206)
+        response_headers['Content-Length'] = str(len(self.content))
+        return FakeResponse(self.content, response_headers)
+
+
+class DownloaderTester(unittest.TestCase):
+
+    def test_find_artifacts(self):
+        """
+        test find_artifacts
+        """
+        with patch('taskcluster.Queue') as MockClass:
+            instance = MockClass.return_value
+            instance.listLatestArtifacts.return_value = {u'artifacts': [{u'name': u'public/build/target.tar.gz'},
+                                                                        {u'name': u'public/build/target.zip'},
+                                                                        {u'name': u'public/logs/live.log'}]}
+
+            d = Downloader()
+            ret = d.find_artifacts('tid', pattern='public/build/*.tar.gz')
+            self.assertEqual(ret, [u'public/build/target.tar.gz'])
+
+            ret = d.find_artifacts('tid', regex=r'target\.(zip|tar\.gz)$')
+            self.assertEqual(ret, [u'public/build/target.tar.gz', u'public/build/target.zip'])
+
+            ret = d.find_artifacts('tid', pattern='public/*', regex='log')
+            self.assertEqual(ret, [u'public/logs/live.log'])
+
+    def test_is_artifact_pattern(self):
+        """
+        test is_artifact_pattern
+        """
+        self.assertTrue(Downloader.is_artifact_pattern('public/build/*.zip'))
+        self.assertFalse(Downloader.is_artifact_pattern('public/build/target.zip'))
+
+    def test_get_signed_url(self):
+        """
+        test the signed urls are reused until they are going to expire
+        """
+        with patch('taskcluster.Queue') as MockClass:
+            instance = MockClass.return_value
+            instance._hasCredentials.return_value = True
+            instance.options = {'credentials': {'clientId': 'cid', 'accessToken': 'token'}, 'signedUrlExpiration': 900}
+            instance.buildSignedUrl.side_effect = lambda method, task_id, name: '{}/{}?bewit'.format(task_id, name)
+
+            d = Downloader()
+            self.assertEqual(d.get_signed_url('tid', 'a'), 'tid/a?bewit')
+            ret = d.get_signed_urls([('tid', 'a'), ('tid', 'b')])
+            self.assertEqual(ret, ['tid/a?bewit', 'tid/b?bewit'])
+            self.assertEqual(instance.buildSignedUrl.call_count, 2)
+
+            # expiring within the safety margin
+            instance.options['signedUrlExpiration'] = 30
+            d = Downloader()
+            d.get_signed_url('tid', 'a')
+            d.get_signed_url('tid', 'a')
+            self.assertEqual(instance.buildSignedUrl.call_count, 4)
+
+    def test_download_ranges(self):
+        """
+        test the artifact is downloaded by parallel byte ranges,
+        and by single connection if the server does not support or honour byte ranges
+        """
+        temp_dir = tempfile.mkdtemp()
+        content = os.urandom(3 * 1024 * 1024 + 5)
+
+        def download(server):
+            with patch('taskcluster.Queue') as MockClass, \
+                    patch('taskcluster_util.util.downloader.open_url', side_effect=server.open_url), \
+                    patch('taskcluster_util.util.transfer.open_url', side_effect=server.open_url), \
+                    patch('taskcluster_util.util.downloader.logger') as mock_logger:
+                instance = MockClass.return_value
+                instance._hasCredentials.return_value = False
+                instance.buildUrl.side_effect = lambda method, task_id, name: name
+                d = Downloader(connections=4, show_progress=False, resilience=Resilience(backoff=0))
+                path = d.download_latest_artifact('tid', 'public/target.bin', temp_dir)
+            with open(path, 'rb') as fd:
+                self.assertEqual(fd.read(), content)
+            os.remove(path)
+            self.assertEqual(os.listdir(temp_dir), [])
+            return ' '.join(str(call) for call in mock_logger.debug.call_args_list)
+
+        try:
+            # the 206 responses of 3 ranges, the min range size is 1 MiB
+            server = FakeArtifactServer(content)
+            download(server)
+            self.assertEqual(server.requests[0], None)
+            self.assertEqual(sorted(server.requests[1:]), ['bytes=0-1048576', 'bytes=1048577-2097153',
+                                                           'bytes=2097154-3145732'])
+
+            server = FakeArtifactServer(content, accept_ranges=False)
+            self.assertIn('Server does not support byte ranges', download(server))
+            self.assertEqual(server.requests, [None])
+
+            server = FakeArtifactServer(content, validators=False)
+            self.assertIn('ETag or Last-Modified', download(server))
+            self.assertEqual(server.requests, [None])
+
+            # the server advertises byte ranges, but returns the full content
+            server = FakeArtifactServer(content, honour_ranges=False)
+            self.assertIn('does not return partial content', download(server))
+            self.assertEqual(server.requests[0], None)
+            self.assertEqual(server.requests[-1], None)
+            self.assertGreater(len(server.requests), 2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_publish(self):
+        """
+        test the partial file is published by renaming, or by copying from the temp folder,
+        and the failed publishing raises error
+        """
+        temp_dir = tempfile.mkdtemp()
+        server = FakeArtifactServer('foo')
+        try:
+            with patch('taskcluster.Queue') as MockClass, \
+                    patch('taskcluster_util.util.downloader.open_url', side_effect=server.open_url):
+                instance = MockClass.return_value
+                instance._hasCredentials.return_value = False
+                instance.buildUrl.side_effect = lambda method, task_id, name: name
+                d = Downloader(show_progress=False, resilience=Resilience(backoff=0))
+
+                with patch.object(FolderHandler, 'move_element_from', autospec=True,
+                                  side_effect=FolderHandler.move_element_from) as mock_move:
+                    path = d.download_latest_artifact('tid', 'public/foo.txt', temp_dir)
+                self.assertEqual(mock_move.call_count, 1)
+                self.assertEqual(os.listdir(temp_dir), ['foo.txt'])
+                os.remove(path)
+
+                # the dest folder can not hold the partial file
+                partial_files = []
+                with patch.object(Downloader, '_can_create_file', return_value=False), \
+                        patch.object(FolderHandler, 'copy_elements_from', autospec=True,
+                                     side_effect=FolderHandler.copy_elements_from) as mock_copy:
+                    path = d.download_latest_artifact('tid', 'public/foo.txt', temp_dir)
+                    partial_files.append(mock_copy.call_args[0][1])
+                with open(path, 'rb') as fd:
+                    self.assertEqual(fd.read(), 'foo')
+                self.assertEqual(os.listdir(temp_dir), ['foo.txt'])
+                self.assertFalse(os.path.exists(os.path.dirname(partial_files[0])))
+                os.remove(path)
+
+                with patch.object(FolderHandler, 'move_element_from', side_effect=OSError(13, 'Permission denied')):
+                    self.assertRaises(Exception, d.download_latest_artifact, 'tid', 'public/foo.txt', temp_dir)
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, 'foo.txt')))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_single_flight(self):
+        """
+        test the concurrent downloads of the same artifact share one download
+        """
+        temp_dir = tempfile.mkdtemp()
+        calls = []
+        lock = threading.Lock()
+
+        def download(task_id, full_filename, dest_dir, expected_digests=None):
+            with lock:
+                calls.append(dest_dir)
+            time.sleep(0.2)
+            os.makedirs(dest_dir)
+            path = os.path.join(dest_dir, full_filename)
+            with open(path, 'wb') as fd:
+                fd.write('foo')
+            return path
+
+        try:
+            with patch('taskcluster.Queue'):
+                d = Downloader(show_progress=False)
+                with patch.object(d, '_download_latest_artifact', side_effect=download):
+                    pool = ThreadPool(4)
+                    try:
+                        dest_dirs = [os.path.join(temp_dir, str(idx)) for idx in range(4)]
+                        ret = pool.map(lambda dest_dir: d.download_latest_artifact('tid', 'foo.txt', dest_dir), dest_dirs)
+                    finally:
+                        pool.close()
+                        pool.join()
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(ret, [os.path.join(dest_dir, 'foo.txt') for dest_dir in dest_dirs])
+            for path in ret:
+                with open(path, 'rb') as fd:
+                    self.assertEqual(fd.read(), 'foo')
+            # the files are not hardlinked to each other
+            self.assertEqual(len(set(os.stat(path).st_ino for path in ret)), len(ret))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_verify_shared_download(self):
+        """
+        test the download shared by another caller or process is verified against the digest of each caller
+        """
+        temp_dir = tempfile.mkdtemp()
+        sha256 = hashlib.sha256('foo').hexdigest()
+        started = threading.Event()
+        finish = threading.Event()
+
+        def download(task_id, full_filename, dest_dir, expected_digests=None):
+            started.set()
+            finish.wait()
+            FolderHandler(dest_dir)
+            path = os.path.join(dest_dir, full_filename)
+            with open(path, 'wb') as fd:
+                fd.write('foo')
+            return path
+
+        try:
+            with patch('taskcluster.Queue'):
+                d = Downloader(show_progress=False)
+                with patch.object(d, '_download_latest_artifact', side_effect=download):
+                    results = {}
+
+                    def run(name, digest):
+                        try:
+                            results[name] = d.download_latest_artifact('tid', 'foo.txt', os.path.join(temp_dir, name),
+                                                                       digest=digest)
+                        except Exception as e:
+                            results[name] = e
+
+                    threads = [threading.Thread(target=run, args=('leader', None))]
+                    threads[0].start()
+                    started.wait()
+                    threads += [threading.Thread(target=run, args=('good', 'sha256:' + sha256)),
+                                threading.Thread(target=run, args=('bad', 'sha256:' + '0' * 64))]
+                    for thread in threads[1:]:
+                        thread.start()
+                    # wait for the waiters joining the download
+                    time.sleep(0.2)
+                    finish.set()
+                    for thread in threads:
+                        thread.join()
+                    self.assertEqual(d._download_latest_artifact.call_count, 1)
+                self.assertEqual(results['good'], os.path.join(temp_dir, 'good', 'foo.txt'))
+                self.assertIsInstance(results['bad'], IntegrityError)
+
+                # the final file is published by another process while waiting for the file lock
+                @contextlib.contextmanager
+                def lock_artifact(task_id, full_filename, dest_dir):
+                    with open(os.path.join(dest_dir, full_filename), 'wb') as fd:
+                        fd.write('foo')
+                    yield True
+
+                with patch.object(d, '_lock_artifact', side_effect=lock_artifact), \
+                        patch.object(d, '_download_latest_artifact') as mock_download:
+                    self.assertEqual(d.download_latest_artifact('tid', 'foo.txt', temp_dir, digest='sha256:' + sha256),
+                                     os.path.join(temp_dir, 'foo.txt'))
+                    self.assertRaises(IntegrityError, d.download_latest_artifact, 'tid', 'foo.txt', temp_dir,
+                                      digest='sha256:' + '0' * 64)
+                    self.assertFalse(mock_download.called)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_verify_digest(self):
+        """
+        test the downloaded content is verified by the given digest and the checksums artifact
+        """
+        temp_dir = tempfile.mkdtemp()
+        sha256 = hashlib.sha256('foo').hexdigest()
+        responses = {'public/foo.txt': lambda: FakeResponse('foo'),
+                     'public/short.txt': lambda: FakeResponse('fo', {'Content-Length': '3'}),
+                     'public/foo.checksums': lambda: FakeResponse('{} sha256 3 foo.txt'.format(sha256))}
+
+        def open_url(url, headers=None):
+            response = responses[url]()
+            response.content = response.raw.getvalue()
+            return response
+
+        try:
+            with patch('taskcluster.Queue') as MockClass, \
+                    patch('taskcluster_util.util.downloader.open_url', side_effect=open_url):
+                instance = MockClass.return_value
+                instance._hasCredentials.return_value = False
+                instance.buildUrl.side_effect = lambda method, task_id, name: name
+
+                d = Downloader(show_progress=False, resilience=Resilience(backoff=0))
+                path = d.download_latest_artifact('tid', 'public/foo.txt', temp_dir, digest='sha256:' + sha256)
+                self.assertEqual(path, os.path.join(temp_dir, 'foo.txt'))
+                self.assertRaises(IntegrityError, d.download_latest_artifact, 'tid', 'public/foo.txt',
+                                  os.path.join(temp_dir, 'bad'), digest='sha256:' + '0' * 64)
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, 'bad', 'foo.txt')))
+                # the received size does not match the Content-Length
+                self.assertRaises(IntegrityError, d.download_latest_artifact, 'tid', 'public/short.txt', temp_dir)
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, 'short.txt')))
+
+                d = Downloader(show_progress=False, checksums_artifact='public/foo.checksums',
+                               resilience=Resilience(backoff=0))
+                self.assertEqual(d.get_expected_digests('tid', 'public/foo.txt'), {'sha256': sha256})
+                path = d.download_latest_artifact('tid', 'public/foo.txt', os.path.join(temp_dir, 'checked'))
+                self.assertTrue(os.path.isfile(path))
+            self.assertEqual([name for name in os.listdir(os.path.join(temp_dir, 'bad'))], [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from benchmarks.fake_taskcluster import Artifact, FakeTaskcluster, FakeTaskclusterServer
+from taskcluster_util.util.finder import TaskFinder
+from taskcluster_util.util.downloader import Downloader
+from taskcluster_util.util.resilience import Resilience
+from taskcluster_util.util.stats import Stats
+
+
+class FakeServiceTester(unittest.TestCase):
+    """
+    Run TaskFinder and Downloader against the local fake Taskcluster service.
+    """
+
+    def setUp(self):
+        self.service = FakeTaskcluster(page_size=3)
+        for index in range(10):
+            self.service.add_namespace('gecko.v2.ns{}'.format(index))
+        self.target = Artifact('public/build/target.bin', size=3 * 1024 * 1024 + 7)
+        self.service.add_task('gecko.v2.latest', 'task-1', [
+            self.target, Artifact('public/build/log.txt', content='log ' * 1000, gzip_encoded=True)])
+        self.server = FakeTaskclusterServer(self.service).start()
+        self.resilience = Resilience(retries=3, backoff=0, rate=0)
+        self.dest_dir = tempfile.mkdtemp(prefix='test_fake_service_')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dest_dir, ignore_errors=True)
+
+    def test_finder(self):
+        """
+        test the listings follow the continuation tokens, and findTask
+        """
+        finder = TaskFinder(options=self.server.index_options, resilience=self.resilience)
+        namespaces = finder.get_namespaces('gecko.v2', strict=True)
+        self.assertEqual(len(namespaces), 10)
+        self.assertIn('gecko.v2.ns9', namespaces)
+        self.assertEqual(finder.get_tasks('gecko.v2', strict=True), [('gecko.v2.latest', 'task-1')])
+        self.assertEqual(finder.get_taskid_by_namespace('gecko.v2.latest'), 'task-1')
+        self.assertFalse(finder.is_task('gecko.v2.ns1'))
+        # the unknown namespace has empty listings, like the Index
+        self.assertEqual(finder.get_namespaces('gecko.v2.nope', strict=True), [])
+        self.assertTrue(finder.resolve('gecko.v2.nope').is_not_found)
+
+    def test_download(self):
+        """
+        test the downloads follow the redirect, by ranges and GZip content encoding
+        """
+        expected = hashlib.sha256(self.target.read(0, self.target.size)).hexdigest()
+        for connections in (1, 4):
+            downloader = Downloader(options=self.server.queue_options, connections=connections, show_progress=False,
+                                    resilience=self.resilience)
+            self.assertEqual(sorted(downloader.find_artifacts('task-1')),
+                             ['public/build/log.txt', 'public/build/target.bin'])
+            local_file = downloader.download_latest_artifact('task-1', 'public/build/target.bin', self.dest_dir,
+                                                             digest='sha256:' + expected)
+            self.assertEqual(os.path.getsize(local_file), self.target.size)
+            os.remove(local_file)
+
+        local_file = downloader.download_latest_artifact('task-1', 'public/build/log.txt', self.dest_dir)
+        with open(local_file) as fd:
+            self.assertEqual(fd.read(), 'log ' * 1000)
+
+    def test_stats(self):
+        """
+        test the timings, byte counts and retry counts of phases are recorded
+        """
+        stats = Stats()
+        finder = TaskFinder(options=self.server.index_options, resilience=self.resilience, stats=stats)
+        downloader = Downloader(options=self.server.queue_options, show_progress=False, resilience=self.resilience,
+                                stats=stats)
+        task_id = finder.get_taskid_by_namespace('gecko.v2.latest')
+        downloader.download_latest_artifact(task_id, 'public/build/target.bin', self.dest_dir)
+        downloader.download_latest_artifact(task_id, 'public/build/log.txt', self.dest_dir)
+        phases = stats.to_dict()['phases']
+        self.assertEqual(phases['resolve']['count'], 1)
+        self.assertEqual(phases['index_api']['count'], 1)
+        self.assertEqual(phases['download']['count'], 2)
+        self.assertEqual(phases['download']['bytes'], self.target.size + len('log ' * 1000))
+        self.assertEqual(phases['first_byte']['count'], 2)
+        self.assertEqual(phases['sign']['count'], 2)
+        self.assertEqual(phases['decode']['bytes'], len('log ' * 1000))
+        self.assertGreaterEqual(phases['transfer']['bytes'], self.target.size)
+        self.assertEqual(phases['publish']['count'], 2)
+
+    def test_error_injection(self):
+        """
+        test the injected errors are retried
+        """
+        self.server.error_rate = 0.3
+        stats = Stats()
+        finder = TaskFinder(options=self.server.index_options, resilience=Resilience(retries=20, backoff=0, rate=0),
+                            stats=stats)
+        self.assertEqual(len(finder.get_namespaces('gecko.v2', strict=True)), 10)
+        self.assertGreater(self.server.errors, 0)
+        self.assertEqual(stats.get_phase('index_api')['retries'], self.server.errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
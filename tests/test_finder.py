@@ -2,10 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+import shutil
+import tempfile
 import textwrap
 import unittest
 from mock import patch, Mock
-from taskcluster_util.util.finder import TaskFinder
+from taskcluster_util.util.finder import TaskFinder, Resolution
+from taskcluster_util.util.index_cache import IndexCache
+from taskcluster_util.util.resilience import Resilience, PartialResultError
 
 
 class FinderTester(unittest.TestCase):
@@ -83,6 +88,147 @@ class FinderTester(unittest.TestCase):
             ret = f.get_taskid_by_namespace('foo')
             self.assertEqual(ret, expected_ret)
 
+    def test_get_with_cache(self):
+        """
+        test the results are loaded from Index cache
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with patch('taskcluster.Index') as MockClass:
+                instance = MockClass.return_value
+                instance.listNamespaces.return_value = {u'namespaces': [{u'expires': u'2100-01-01T00:00:00.000Z', u'namespace': u'foo.bar', u'name': u'bar'}]}
+                instance.listTasks.return_value = {u'tasks': [{u'data': {}, u'expires': u'2100-01-01T00:00:00.000Z', u'namespace': u'foo', u'rank': 1, u'taskId': u'bar'}]}
+                instance.findTask.return_value = {u'data': {}, u'expires': u'2100-01-01T00:00:00.000Z', u'namespace': u'foo', u'rank': 1, u'taskId': u'bar'}
+
+                for _ in range(2):
+                    f = TaskFinder(cache=IndexCache(os.path.join(temp_dir, 'index.sqlite')))
+                    self.assertEqual(f.get_namespaces('foo'), [u'foo.bar'])
+                    self.assertEqual(f.get_tasks('foo'), [(u'foo', u'bar')])
+                    self.assertEqual(f.get_taskid_by_namespace('foo'), u'bar')
+                self.assertEqual(instance.listNamespaces.call_count, 1)
+                self.assertEqual(instance.listTasks.call_count, 1)
+                self.assertEqual(instance.findTask.call_count, 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_resolve(self):
+        """
+        test resolve the task, namespace, and not found
+        """
+        class RestFailure(Exception):
+            def __init__(self, status_code):
+                super(RestFailure, self).__init__('failure')
+                self.status_code = status_code
+
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.findTask.return_value = {u'data': {}, u'expires': u'2016-08-30T20:26:07.196Z', u'namespace': u'foo', u'rank': 999, u'taskId': u'foobar_taskid'}
+            f = TaskFinder(resilience=Resilience(retries=2, backoff=0))
+            ret = f.resolve('foo')
+            self.assertEqual(ret.kind, Resolution.TASK)
+            self.assertEqual((ret.task_id, ret.rank), (u'foobar_taskid', 999))
+            # memoized
+            self.assertTrue(f.is_task('foo'))
+            self.assertEqual(f.get_taskid_by_namespace('foo'), u'foobar_taskid')
+            self.assertEqual(instance.findTask.call_count, 1)
+
+            instance.findTask.side_effect = RestFailure(404)
+            instance.listNamespaces.return_value = {u'namespaces': [{u'namespace': u'bar.v1', u'name': u'v1'}]}
+            self.assertTrue(f.resolve('bar').is_namespace)
+            self.assertTrue(f.resolve('').is_namespace)
+
+            instance.listNamespaces.return_value = {u'namespaces': []}
+            instance.listTasks.return_value = {u'tasks': []}
+            self.assertTrue(f.resolve('not.exist').is_not_found)
+            self.assertRaises(Exception, f.get_taskid_by_namespace, 'not.exist')
+
+            # the errors other than 404 are raised, after retrying the server errors
+            instance.findTask.reset_mock()
+            instance.findTask.side_effect = RestFailure(500)
+            self.assertRaises(RestFailure, f.resolve, 'error')
+            self.assertEqual(instance.findTask.call_count, 3)
+
+    def test_iter_namespaces_and_tasks(self):
+        """
+        test iter_namespaces_and_tasks yields the pages
+        """
+        namespace_pages = [{u'namespaces': [{u'namespace': u'foo.a', u'name': u'a'}], u'continuationToken': u'token'},
+                           {u'namespaces': [{u'namespace': u'foo.b', u'name': u'b'}]}]
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.listNamespaces.side_effect = namespace_pages
+            instance.listTasks.return_value = {u'tasks': [{u'data': {}, u'namespace': u'foo.t', u'rank': 1, u'taskId': u'tid'}]}
+
+            pages = list(TaskFinder().iter_namespaces_and_tasks('foo'))
+            self.assertEqual(len(pages), 3)
+            self.assertEqual(sorted(ns for page in pages for ns in page['namespaces']), [u'foo.a', u'foo.b'])
+            self.assertEqual([task for page in pages for task in page['tasks']], [(u'foo.t', u'tid')])
+            # the continuation token is followed
+            instance.listNamespaces.assert_called_with('foo', {'limit': 1000, 'continuationToken': u'token'})
+
+    def test_iter_tasks(self):
+        """
+        test iter_tasks stops early and resumes from continuation token
+        """
+        def list_tasks(ns_node, payload):
+            page = int(payload.get('continuationToken') or 0)
+            ret = {u'tasks': [{u'namespace': u'foo.{}'.format(page), u'taskId': u'tid{}'.format(page)}]}
+            if page < 9:
+                ret[u'continuationToken'] = str(page + 1)
+            return ret
+
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.listTasks.side_effect = list_tasks
+            f = TaskFinder()
+
+            tasks = f.iter_tasks('foo', limit=1)
+            self.assertEqual(next(iter(tasks)), (u'foo.0', u'tid0'))
+            # only the first page and the prefetched page are fetched
+            self.assertLessEqual(instance.listTasks.call_count, 2)
+
+            tasks = f.iter_tasks('foo', limit=1, continuation_token='5')
+            self.assertEqual([task_id for _, task_id in tasks], [u'tid5', u'tid6', u'tid7', u'tid8', u'tid9'])
+            # the token of the page of the last item
+            self.assertEqual(tasks.continuation_token, '9')
+            self.assertEqual(len(f.get_tasks('foo', limit=1)), 10)
+
+    def test_partial_listing(self):
+        """
+        test the listing retries from the continuation token, and reports the partial result
+        """
+        class RestFailure(Exception):
+            def __init__(self, status_code):
+                super(RestFailure, self).__init__('failure')
+                self.status_code = status_code
+
+        calls = []
+
+        def list_tasks(ns_node, payload):
+            token = payload.get('continuationToken')
+            calls.append(token)
+            if token == 'broken' or (token == 'flaky' and calls.count('flaky') == 1):
+                raise RestFailure(503)
+            pages = {None: ('tid0', 'flaky'), 'flaky': ('tid1', 'broken')}
+            task_id, next_token = pages[token]
+            return {u'tasks': [{u'namespace': u'foo.' + task_id, u'taskId': task_id}],
+                    u'continuationToken': next_token}
+
+        with patch('taskcluster.Index') as MockClass:
+            instance = MockClass.return_value
+            instance.listTasks.side_effect = list_tasks
+            f = TaskFinder(resilience=Resilience(retries=1, backoff=0))
+
+            with self.assertRaises(PartialResultError) as context:
+                f.get_tasks('foo', strict=True)
+            self.assertEqual(context.exception.partial_result, [(u'foo.tid0', u'tid0'), (u'foo.tid1', u'tid1')])
+            self.assertEqual(context.exception.resume_from, 'broken')
+            # the failed page is retried from its continuation token, not from the first page
+            self.assertEqual(calls, [None, 'flaky', 'flaky', 'broken', 'broken'])
+
+            del calls[:]
+            self.assertEqual(f.get_tasks('foo'), [(u'foo.tid0', u'tid0'), (u'foo.tid1', u'tid1')])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_HEAVY_MODULES = ('taskcluster', 'requests', 'progressbar', 'easygui', 'Tkinter', 'sqlite3', 'yaml')
+# the modules which should not be loaded by the import of console script,
+# the wall-clock time depends on the machine, so the test checks the loaded modules instead
+_LAZY_MODULES = {
+    'taskcluster_download': _HEAVY_MODULES,
+    'taskcluster_login': _HEAVY_MODULES,
+    'taskcluster_crawl': _HEAVY_MODULES,
+    'taskcluster_serve': _HEAVY_MODULES,
+    # the GUI toolkit is used from the start of traverse
+    'taskcluster_traverse': ('taskcluster', 'requests', 'progressbar', 'sqlite3', 'yaml')
+}
+_SCRIPT = """
+import sys, json
+{code}
+print(json.dumps([name for name in {modules!r} if sys.modules.get(name) is not None]))
+"""
+
+
+def run_python(code):
+    """
+    Run the code in a new interpreter.
+    @return: the loaded modules of L{_HEAVY_MODULES}.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in (_ROOT, env.get('PYTHONPATH')) if path)
+    output = subprocess.check_output([sys.executable, '-c', _SCRIPT.format(code=code, modules=_HEAVY_MODULES)],
+                                     cwd=_ROOT, env=env)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class ImportTimeTester(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        """
+        test the console scripts load no unneeded modules on import
+        """
+        for script, modules in sorted(_LAZY_MODULES.items()):
+            loaded = set(run_python('import taskcluster_util.{}'.format(script))) & set(modules)
+            self.assertFalse(loaded, '{} loads {}'.format(script, sorted(loaded)))
+
+    def test_signed_url_path(self):
+        """
+        test getting the signed url does not load the progress bar and GUI toolkit
+        """
+        result = run_python('from taskcluster_util.util.downloader import Downloader\n'
+                            'Downloader({}, show_progress=False).get_signed_url("TASK_ID", "public/build/a.zip")')
+        for name in ('progressbar', 'easygui', 'Tkinter', 'sqlite3'):
+            self.assertNotIn(name, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
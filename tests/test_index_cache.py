@@ -0,0 +1,84 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+from taskcluster_util.util.index_cache import IndexCache, parse_expires
+
+
+class IndexCacheTester(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'index.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_expires(self):
+        """
+        test parse_expires
+        """
+        self.assertEqual(parse_expires(u'2016-02-01T00:00:00.000Z'), 1454284800)
+        self.assertEqual(parse_expires(u'2016-02-01T00:00:00Z'), 1454284800)
+        self.assertIsNone(parse_expires(None))
+        self.assertIsNone(parse_expires('foo'))
+
+    def test_fetch(self):
+        """
+        test the fresh entry is loaded from cache across instances
+        """
+        fetch = Mock(return_value=(['foo.bar'], time.time() + 3600))
+        self.assertEqual(IndexCache(self.path).fetch('ns foo', fetch), ['foo.bar'])
+        self.assertEqual(IndexCache(self.path).fetch('ns foo', fetch), ['foo.bar'])
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_fetch_expired(self):
+        """
+        test the expired entry is fetched again
+        """
+        cache = IndexCache(self.path)
+        fetch = Mock(return_value=(['foo.bar'], time.time() - 1))
+        cache.fetch('ns foo', fetch)
+        cache.fetch('ns foo', fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+        # fresh no longer than max_ttl
+        cache = IndexCache(self.path, max_ttl=0)
+        fetch = Mock(return_value=(['foo.bar'], time.time() + 3600))
+        cache.fetch('ns bar', fetch)
+        cache.fetch('ns bar', fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_refresh(self):
+        """
+        test refresh mode does not read the entry but stores the new result
+        """
+        IndexCache(self.path).set('ns foo', ['old'], time.time() + 3600)
+        fetch = Mock(return_value=(['new'], None))
+        self.assertEqual(IndexCache(self.path, refresh=True).fetch('ns foo', fetch), ['new'])
+        self.assertEqual(IndexCache(self.path).get('ns foo')[0], ['new'])
+
+    def test_stale_while_revalidate(self):
+        """
+        test the stale entry is returned and updated in background
+        """
+        cache = IndexCache(self.path, max_ttl=0, stale_while_revalidate=True)
+        cache.set('ns foo', ['old'])
+        fetch = Mock(return_value=(['new'], None))
+        self.assertEqual(cache.fetch('ns foo', fetch), ['old'])
+        for _ in range(100):
+            if cache.get('ns foo')[0] == ['new']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('ns foo')[0], ['new'])
+        fetch.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import hashlib
+import tempfile
+import unittest
+from taskcluster_util.util.integrity import IntegrityError, StreamHasher, parse_digest, parse_checksums, \
+    get_file_digests, verify_digests
+
+
+class IntegrityTester(unittest.TestCase):
+
+    def test_parse_digest(self):
+        """
+        test parse_digest
+        """
+        sha256 = hashlib.sha256('foo').hexdigest()
+        sha512 = hashlib.sha512('foo').hexdigest()
+        self.assertEqual(parse_digest('sha256:' + sha256.upper()), {'sha256': sha256})
+        self.assertEqual(parse_digest('SHA512:' + sha512), {'sha512': sha512})
+        # the algorithm of bare digest is known by its length
+        self.assertEqual(parse_digest(sha512), {'sha512': sha512})
+        self.assertRaises(Exception, parse_digest, 'md5:' + hashlib.md5('foo').hexdigest())
+        self.assertRaises(Exception, parse_digest, 'sha256:' + sha512)
+        self.assertRaises(Exception, parse_digest, 'sha256:xyz')
+
+    def test_parse_checksums(self):
+        """
+        test parse_checksums with Mozilla checksums and sha256sum formats
+        """
+        sha256 = hashlib.sha256('foo').hexdigest()
+        sha512 = hashlib.sha512('foo').hexdigest()
+        content = '\n'.join(['{} sha512 3 target.tar.bz2'.format(sha512),
+                             '{} sha256 3 target.tar.bz2'.format(sha256),
+                             '{} md5 3 target.tar.bz2'.format(hashlib.md5('foo').hexdigest()),
+                             '{} sha512 3 target.zip'.format(hashlib.sha512('bar').hexdigest())])
+        ret = parse_checksums(content, 'public/build/target.tar.bz2')
+        self.assertEqual(ret, {'sha256': sha256, 'sha512': sha512})
+
+        ret = parse_checksums('{}  other.zip\n{} *build/target.zip\n'.format(sha512, sha256), 'public/build/target.zip')
+        self.assertEqual(ret, {'sha256': sha256})
+        self.assertEqual(parse_checksums(content, 'public/build/target.dmg'), {})
+
+    def test_hash_and_verify(self):
+        """
+        test StreamHasher, get_file_digests and verify_digests
+        """
+        hasher = StreamHasher(['sha256', 'sha512'])
+        hasher.update('fo')
+        hasher.update(memoryview(bytearray('o')))
+        expected = {'sha256': hashlib.sha256('foo').hexdigest(), 'sha512': hashlib.sha512('foo').hexdigest()}
+        self.assertEqual(hasher.hexdigests(), expected)
+
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'foo')
+            os.close(fd)
+            self.assertEqual(get_file_digests(path, ['sha256']), {'sha256': expected['sha256']})
+        finally:
+            os.remove(path)
+
+        verify_digests(expected, {'sha256': expected['sha256']}, 'foo')
+        self.assertRaises(IntegrityError, verify_digests, expected, {'sha256': '0' * 64}, 'foo')
+        self.assertRaises(IntegrityError, verify_digests, {}, {'sha512': expected['sha512']}, 'foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from taskcluster_util.util.journal import DownloadJournal
+
+
+class JournalTester(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_file = os.path.join(self.temp_dir, 'foo.bin')
+        with open(self.local_file, 'wb') as fd:
+            fd.truncate(100)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_missing_ranges(self):
+        """
+        test add_range and get_missing_ranges
+        """
+        journal = DownloadJournal(self.local_file, 'tid', 'foo.bin', etag='"e"', total_length=100)
+        self.assertEqual(journal.get_missing_ranges(), [(0, 100)])
+
+        journal.add_range(10, 20)
+        journal.add_range(20, 30)
+        journal.add_range(50, 60)
+        self.assertEqual(journal.completed, [[10, 30], [50, 60]])
+        self.assertEqual(journal.get_missing_ranges(), [(0, 10), (30, 50), (60, 100)])
+        self.assertEqual(journal.get_completed_size(), 30)
+
+        journal.add_range(0, 100)
+        self.assertEqual(journal.get_missing_ranges(), [])
+
+    def test_save_and_load(self):
+        """
+        test save and load
+        """
+        journal = DownloadJournal(self.local_file, 'tid', 'foo.bin', etag='"e"', total_length=100, completed=[[0, 40]])
+        journal.save()
+
+        ret = DownloadJournal.load(self.local_file, 'tid', 'foo.bin')
+        self.assertEqual(ret.etag, '"e"')
+        self.assertEqual(ret.get_missing_ranges(), [(40, 100)])
+
+        # the journal of other artifact
+        self.assertIsNone(DownloadJournal.load(self.local_file, 'other_tid', 'foo.bin'))
+
+        journal.remove()
+        self.assertIsNone(DownloadJournal.load(self.local_file, 'tid', 'foo.bin'))
+
+    def test_load_with_unexpected_size(self):
+        """
+        test load the journal when the size of partial file is changed
+        """
+        DownloadJournal(self.local_file, 'tid', 'foo.bin', etag='"e"', total_length=200).save()
+        self.assertIsNone(DownloadJournal.load(self.local_file, 'tid', 'foo.bin'))
+
+
+    def test_save_syncs_local_file(self):
+        """
+        test save syncs the partial file before writing the journal
+        """
+        journal = DownloadJournal(self.local_file, 'tid', 'foo.bin', etag='"e"', total_length=100, completed=[[0, 40]])
+        synced = []
+
+        def fsync(fileno):
+            is_local_file = os.fstat(fileno).st_ino == os.stat(self.local_file).st_ino
+            synced.append((is_local_file, os.path.exists(journal.path)))
+        with patch('taskcluster_util.util.journal.os.fsync', side_effect=fsync):
+            journal.save()
+        self.assertEqual(synced, [(True, False), (False, False)])
+        self.assertIsNotNone(DownloadJournal.load(self.local_file, 'tid', 'foo.bin'))
+
+
+if __name__ == '__main__':
+    unittest.main()
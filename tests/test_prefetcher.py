@@ -0,0 +1,118 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import threading
+import unittest
+from mock import Mock
+from taskcluster_util.util.prefetcher import ListingPrefetcher
+
+
+def create_finder(calls, lock=None):
+    """
+    The fake TaskFinder of the tree, each namespace has namespaces 'a', 'b' and task 't'.
+    """
+    lock = lock or threading.Lock()
+
+    def get_namespaces_and_tasks(ns_node, strict=False):
+        with lock:
+            calls.append(ns_node)
+        prefix = ns_node + '.' if ns_node else ''
+        return {'node': ns_node, 'namespaces': [prefix + 'a', prefix + 'b'],
+                'tasks': [(prefix + 't', 'tid-' + prefix + 't')]}
+
+    finder = Mock()
+    finder.get_namespaces_and_tasks.side_effect = get_namespaces_and_tasks
+    return finder
+
+
+class PrefetcherTester(unittest.TestCase):
+
+    def wait_for(self, prefetcher, count):
+        for _ in range(100):
+            with prefetcher._lock:
+                if len(prefetcher._entries) >= count and not prefetcher._pending:
+                    return
+            time.sleep(0.01)
+
+    def test_prefetch(self):
+        """
+        test the children and artifacts of the listing are prefetched, and the visited listings are not refetched
+        """
+        calls = []
+        downloader = Mock()
+        downloader.get_latest_artifacts.return_value = {'artifacts': [{'name': 'public/a.zip'}]}
+        prefetcher = ListingPrefetcher(create_finder(calls), downloader, workers=2, max_depth=1)
+        try:
+            root = prefetcher.get_listing('')
+            prefetcher.prefetch(root)
+            # the root, 'a', 'b', and the artifacts of 't'
+            self.wait_for(prefetcher, 4)
+            self.assertEqual(sorted(calls), ['', 'a', 'b'])
+            self.assertEqual(prefetcher.get_listing('a')['namespaces'], ['a.a', 'a.b'])
+            self.assertEqual(prefetcher.get_artifacts('tid-t'), ['public/a.zip'])
+            self.assertEqual(downloader.get_latest_artifacts.call_count, 1)
+
+            # go into 'a', then back to root
+            prefetcher.prefetch(prefetcher.get_listing('a'))
+            self.wait_for(prefetcher, 7)
+            self.assertEqual(prefetcher.get_listing('')['node'], '')
+            self.assertEqual(sorted(calls), ['', 'a', 'a.a', 'a.b', 'b'])
+        finally:
+            prefetcher.close()
+
+    def test_depth_and_lru(self):
+        """
+        test the prefetch depth, and the visited entries are not evicted
+        """
+        calls = []
+        prefetcher = ListingPrefetcher(create_finder(calls), workers=1, max_depth=2, max_size=4)
+        try:
+            prefetcher.prefetch(prefetcher.get_listing(''))
+            self.wait_for(prefetcher, 5)
+            # 'a' and 'b' and their children, the prefetch stops at depth 2
+            self.assertEqual(sorted(calls), ['', 'a', 'a.a', 'a.b', 'b', 'b.a', 'b.b'])
+            self.assertEqual(len(prefetcher._entries), 5)
+            self.assertIn(('namespace', ''), prefetcher._entries)
+            # the least recently used 'a' and 'b' are evicted
+            self.assertNotIn(('namespace', 'a'), prefetcher._entries)
+            self.assertIn(('namespace', 'b.b'), prefetcher._entries)
+        finally:
+            prefetcher.close()
+
+        # no prefetch
+        calls = []
+        prefetcher = ListingPrefetcher(create_finder(calls), workers=4, max_depth=0)
+        prefetcher.prefetch(prefetcher.get_listing(''))
+        prefetcher.close()
+        self.assertEqual(calls, [''])
+
+    def test_wait_for_prefetch(self):
+        """
+        test getting the listing which is being prefetched waits for it instead of fetching again
+        """
+        calls = []
+        started = threading.Event()
+        finder = create_finder(calls)
+        get_namespaces_and_tasks = finder.get_namespaces_and_tasks.side_effect
+
+        def slow_get_namespaces_and_tasks(ns_node, strict=False):
+            if ns_node == 'a':
+                started.set()
+                time.sleep(0.2)
+            return get_namespaces_and_tasks(ns_node, strict)
+
+        finder.get_namespaces_and_tasks.side_effect = slow_get_namespaces_and_tasks
+        prefetcher = ListingPrefetcher(finder, workers=1, max_depth=1)
+        try:
+            prefetcher.prefetch({'namespaces': ['a'], 'tasks': []})
+            started.wait(1)
+            self.assertEqual(prefetcher.get_listing('a')['node'], 'a')
+            self.assertEqual(calls, ['a'])
+        finally:
+            prefetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import urllib2
+import time
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
+from mock import Mock, patch
+from benchmarks.fake_taskcluster import FakeTaskcluster, FakeTaskclusterServer
+from taskcluster_util.util.finder import TaskFinder
+from taskcluster_util.util.proxy import ArtifactProxy, ProxyServer, ProxyError
+from taskcluster_util.util.resilience import Resilience
+
+CONTENT = 'artifact' * 100000
+
+
+class UpstreamHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serve the artifacts with byte ranges, the first response of flaky.bin is broken after half of the content.
+    """
+    ARTIFACTS = ('/tid/public/foo.bin', '/tid/public/bar.bin', '/tid/public/flaky.bin')
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        UpstreamHandler.requests.append((self.path, self.headers.get('Range')))
+        if self.path not in UpstreamHandler.ARTIFACTS:
+            self.send_error(404)
+            return
+        byte_range = self.headers.get('Range')
+        start = int(byte_range[len('bytes='):].rstrip('-')) if byte_range else 0
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(CONTENT) - start))
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(CONTENT) - 1, len(CONTENT)))
+        self.end_headers()
+        is_broken = self.path.endswith('flaky.bin') and len(UpstreamHandler.requests) == 1
+        self.wfile.write(CONTENT[start:len(CONTENT) // 2] if is_broken else CONTENT[start:])
+
+
+class ProxyTester(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        UpstreamHandler.requests = []
+        self.upstream = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), UpstreamHandler)
+        upstream_url = 'http://127.0.0.1:{}'.format(self.upstream.server_address[1])
+        downloader = Mock()
+        downloader.get_signed_url.side_effect = lambda task_id, name: '{}/{}/{}'.format(upstream_url, task_id, name)
+        task_finder = Mock()
+        task_finder.normalize_namespace.side_effect = lambda namespace: namespace
+        task_finder.resolve.return_value = Mock(is_task=True, task_id='tid', expires=None)
+        self.proxy = ArtifactProxy(task_finder, downloader, self.store_dir, max_size=len(CONTENT) * 2,
+                                   resilience=Resilience(retries=1, backoff=0, rate=0))
+        self.server = ProxyServer(('127.0.0.1', 0), self.proxy)
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        for server in (self.upstream, self.server):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def tearDown(self):
+        for server in (self.upstream, self.server):
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.store_dir)
+
+    def test_serve(self):
+        """
+        test the concurrent requests are served by one upstream fetch
+        """
+        urls = ['{}/task/tid/public/foo.bin'.format(self.base_url)] * 4 + \
+               ['{}/namespace/foo.bar/public/foo.bin'.format(self.base_url)]
+        pool = ThreadPool(5)
+        try:
+            results = pool.map(lambda url: urllib2.urlopen(url).read(), urls)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, [CONTENT] * 5)
+        self.assertEqual(len(UpstreamHandler.requests), 1)
+        # served from the store folder
+        UpstreamHandler.requests = []
+        self.assertEqual(urllib2.urlopen(urls[0]).read(), CONTENT)
+        self.assertEqual(UpstreamHandler.requests, [])
+
+    def test_resume(self):
+        """
+        test the broken upstream fetch is retried from the written bytes
+        """
+        self.assertEqual(urllib2.urlopen('{}/task/tid/public/flaky.bin'.format(self.base_url)).read(), CONTENT)
+        self.assertEqual(UpstreamHandler.requests, [('/tid/public/flaky.bin', None),
+                                                    ('/tid/public/flaky.bin', 'bytes={}-'.format(len(CONTENT) // 2))])
+
+    def test_evict(self):
+        """
+        test the least recently used artifacts are removed from the store folder
+        """
+        for name in ('foo.bin', 'bar.bin', 'foo.bin', 'flaky.bin'):
+            url = '{}/task/tid/public/{}'.format(self.base_url, name)
+            self.assertEqual(urllib2.urlopen(url).read(), CONTENT)
+            # the eviction runs after the fetch is done
+            time.sleep(0.1)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.store_dir, 'tid', 'public'))), ['flaky.bin', 'foo.bin'])
+
+    def test_errors(self):
+        """
+        test the error status
+        """
+        for path, status_code in (('/task/tid/missing', 404), ('/foo', 404)):
+            with self.assertRaises(urllib2.HTTPError) as context:
+                urllib2.urlopen(self.base_url + path)
+            self.assertEqual(context.exception.code, status_code)
+        self.assertRaises(ProxyError, self.proxy.get_store_path, 'tid', '../../etc/passwd')
+
+    def test_follow_namespace(self):
+        """
+        test the proxy follows the namespace which is re-pointed to the new task, after the resolution expires
+        """
+        service = FakeTaskcluster()
+        service.add_task('gecko.v2.latest.linux64', 'task-1')
+        fake_server = FakeTaskclusterServer(service).start()
+        try:
+            proxy = ArtifactProxy(TaskFinder(fake_server.index_options), Mock(), self.store_dir, resolution_ttl=60)
+            with patch('taskcluster_util.util.proxy.time') as mock_time:
+                mock_time.time.return_value = 1000
+                self.assertEqual(proxy.get_task_id('gecko.v2.latest.linux64'), 'task-1')
+                self.assertRaises(ProxyError, proxy.get_task_id, 'gecko.v2.latest.win64')
+
+                service.add_task('gecko.v2.latest.linux64', 'task-2')
+                service.add_task('gecko.v2.latest.win64', 'task-3')
+                mock_time.time.return_value = 1030
+                self.assertEqual(proxy.get_task_id('gecko.v2.latest.linux64'), 'task-1')
+
+                mock_time.time.return_value = 1061
+                self.assertEqual(proxy.get_task_id('gecko.v2.latest.linux64'), 'task-2')
+                # the not found result is not kept forever
+                self.assertEqual(proxy.get_task_id('gecko.v2.latest.win64'), 'task-3')
+        finally:
+            fake_server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
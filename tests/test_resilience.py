@@ -0,0 +1,80 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import socket
+import unittest
+from mock import Mock
+from taskcluster_util.util.resilience import Resilience, TokenBucket, PartialResultError, is_retryable, get_host
+
+
+class RestFailure(Exception):
+    def __init__(self, status_code):
+        super(RestFailure, self).__init__('failure {}'.format(status_code))
+        self.status_code = status_code
+
+
+class ResilienceTester(unittest.TestCase):
+
+    def test_is_retryable(self):
+        """
+        test is_retryable
+        """
+        self.assertTrue(is_retryable(RestFailure(503)))
+        self.assertTrue(is_retryable(RestFailure(429)))
+        self.assertFalse(is_retryable(RestFailure(404)))
+        self.assertTrue(is_retryable(socket.error('reset')))
+        self.assertFalse(is_retryable(ValueError('bad')))
+        self.assertTrue(is_retryable(PartialResultError('partial', cause=RestFailure(500))))
+        self.assertFalse(is_retryable(PartialResultError('partial', cause=RestFailure(403))))
+
+    def test_call(self):
+        """
+        test call retries the temporary errors only
+        """
+        resilience = Resilience(retries=3, backoff=0, rate=0)
+        func = Mock(side_effect=[RestFailure(500), RestFailure(502), 'ok'])
+        self.assertEqual(resilience.call(func, ('a',), {'b': 1}), 'ok')
+        self.assertEqual(func.call_count, 3)
+        func.assert_called_with('a', b=1)
+
+        func = Mock(side_effect=RestFailure(404))
+        self.assertRaises(RestFailure, resilience.call, func)
+        self.assertEqual(func.call_count, 1)
+
+        func = Mock(side_effect=RestFailure(503))
+        self.assertRaises(RestFailure, resilience.call, func)
+        self.assertEqual(func.call_count, 4)
+
+    def test_get_backoff(self):
+        """
+        test the backoff is jittered, capped, and respects Retry-After
+        """
+        resilience = Resilience(backoff=1, max_backoff=10)
+        for attempt in range(1, 10):
+            self.assertTrue(0 <= resilience.get_backoff(attempt) <= min(10, 2 ** (attempt - 1)))
+        error = RestFailure(429)
+        error.response = Mock(headers={'Retry-After': '5'})
+        self.assertGreaterEqual(resilience.get_backoff(1, error), 5)
+
+    def test_token_bucket(self):
+        """
+        test the token bucket waits when the burst is used up
+        """
+        bucket = TokenBucket(rate=100, burst=5)
+        started = time.time()
+        for _ in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertLess(time.time() - started, 0.05)
+        self.assertGreater(bucket.acquire(), 0)
+
+        resilience = Resilience(rate=100, burst=1)
+        resilience.acquire('https://index.taskcluster.net/v1/task/foo')
+        resilience.acquire('https://queue.taskcluster.net/v1/task/foo')
+        self.assertEqual(len(resilience._buckets), 2)
+        self.assertEqual(get_host('https://Queue.taskcluster.net/v1'), 'queue.taskcluster.net')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from taskcluster_util.util.search import NamespaceIndex
+
+
+class NamespaceIndexTester(unittest.TestCase):
+
+    def setUp(self):
+        self.index = NamespaceIndex()
+        for branch in ('mozilla-central', 'mozilla-inbound', 'try'):
+            for platform in ('linux64-opt', 'linux64-debug', 'win32-opt'):
+                namespace = 'gecko.v2.{}.latest.firefox.{}'.format(branch, platform)
+                self.index.add(namespace, 'task-{}-{}'.format(branch, platform))
+
+    def test_add(self):
+        """
+        test the parent namespaces are added, and the listings and crawler records are added
+        """
+        self.assertIsNone(self.index.get_task_id('gecko.v2.try.latest'))
+        self.assertEqual(self.index.prefix_search('gecko.v2.try.latest.firefox', limit=1),
+                         [('gecko.v2.try.latest.firefox', None)])
+        self.index.add_listing({'namespaces': ['b2g.v1'], 'tasks': [('b2g.v1-task', 'task-b2g')]})
+        self.index.add_record({'type': 'task', 'namespace': 'gecko.v1.task', 'taskId': 'task-v1', 'depth': 2})
+        self.assertEqual(self.index.get_task_id('b2g.v1-task'), 'task-b2g')
+        self.assertEqual(self.index.get_task_id('gecko.v1.task'), 'task-v1')
+        self.assertEqual(self.index.prefix_search('b2g'),
+                         [('b2g', None), ('b2g.v1', None), ('b2g.v1-task', 'task-b2g')])
+
+    def test_glob_search(self):
+        """
+        test the glob pattern matches the namespaces like the crawler filters
+        """
+        results = self.index.glob_search('gecko.v2.*.latest.firefox.linux64-opt')
+        self.assertEqual([name for name, _ in results], [
+            'gecko.v2.mozilla-central.latest.firefox.linux64-opt',
+            'gecko.v2.mozilla-inbound.latest.firefox.linux64-opt',
+            'gecko.v2.try.latest.firefox.linux64-opt'])
+        self.assertEqual(results[2][1], 'task-try-linux64-opt')
+        self.assertEqual(self.index.search('*.win32-*', limit=2)[1][0],
+                         'gecko.v2.mozilla-inbound.latest.firefox.win32-opt')
+
+    def test_search(self):
+        """
+        test the prefix matches first, then the substring and fuzzy matches
+        """
+        self.assertEqual(len(self.index.substring_search('linux64', limit=None)), 6)
+        results = self.index.search('try.latest', limit=5)
+        self.assertEqual(results[0][0], 'gecko.v2.try.latest')
+        results = self.index.search('central linux64opt')
+        self.assertEqual(results[0][0], 'gecko.v2.mozilla-central.latest.firefox.linux64-opt')
+        self.assertEqual(self.index.search('zzz'), [])
+        self.assertEqual(self.index.search(' '), [])
+
+    def test_fuzzy_score(self):
+        """
+        test the consecutive characters and the start of segments score more
+        """
+        self.assertIsNone(NamespaceIndex.get_fuzzy_score('xyz', 'gecko.v2'))
+        self.assertGreater(NamespaceIndex.get_fuzzy_score('opt', 'linux64-opt'),
+                           NamespaceIndex.get_fuzzy_score('opt', 'linux64-o-p-t'))
+
+    def test_save_and_load(self):
+        """
+        test the index file is saved and loaded
+        """
+        folder = tempfile.mkdtemp(prefix='test_search_')
+        try:
+            path = os.path.join(folder, 'cache', 'namespaces.json')
+            index = NamespaceIndex(path)
+            index.add('gecko.v2.try.latest.firefox.linux64-opt', 'task-1')
+            self.assertTrue(index.is_changed)
+            index.save()
+            self.assertFalse(index.is_changed)
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['namespaces.json'])
+            loaded = NamespaceIndex(path)
+            self.assertEqual(len(loaded), len(index))
+            self.assertFalse(loaded.is_changed)
+            self.assertEqual(loaded.glob_search('gecko.*.linux64-opt'),
+                             [('gecko.v2.try.latest.firefox.linux64-opt', 'task-1')])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_load_corrupt_file(self):
+        """
+        test the index starts empty if the file is corrupt, and the file is replaced when it is saved
+        """
+        folder = tempfile.mkdtemp(prefix='test_search_')
+        try:
+            path = os.path.join(folder, 'namespaces.json')
+            for content in ('{"namespaces": ["gecko.v2", ', '["gecko.v2"]'):
+                with open(path, 'w') as fd:
+                    fd.write(content)
+                index = NamespaceIndex(path)
+                self.assertEqual(len(index), 0)
+            index.add('gecko.v2.try', 'task-1')
+            index.save()
+            self.assertEqual(NamespaceIndex(path).get_task_id('gecko.v2.try'), 'task-1')
+        finally:
+            shutil.rmtree(folder)
+
+    def test_large_index(self):
+        """
+        test the glob search with literal prefix is fast on the large index
+        """
+        index = NamespaceIndex()
+        for branch in range(100):
+            for push in range(1000):
+                index.add('gecko.v2.branch{}.pushlog-id.{}.firefox.linux64-opt'.format(branch, push),
+                          'task-{}-{}'.format(branch, push))
+        index.prefix_search('gecko')
+        started = time.time()
+        results = index.glob_search('gecko.v2.branch42.pushlog-id.*.firefox.linux64-opt', limit=None)
+        self.assertEqual(len(results), 1000)
+        self.assertLess(time.time() - started, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import socket
+import shutil
+import tempfile
+import unittest
+from taskcluster_util.util.stats import Stats, NullStats, StatsdExporter, NULL_STATS, create_stats
+
+
+class StatsTester(unittest.TestCase):
+
+    def test_record(self):
+        """
+        test the records of phases are summed, and passed to hooks
+        """
+        records = []
+        stats = Stats(hooks=[lambda *args: records.append(args)])
+        with stats.timer('transfer') as timer:
+            timer.bytes_count = 100
+        stats.record('transfer', 0.5, 50)
+        stats.add_retry('transfer')
+        phase = stats.get_phase('transfer')
+        self.assertEqual(phase['count'], 2)
+        self.assertEqual(phase['bytes'], 150)
+        self.assertEqual(phase['retries'], 1)
+        self.assertGreaterEqual(phase['seconds'], 0.5)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[2], ('transfer', 0, 0, 1))
+        self.assertEqual(stats.get_phase('sign'), {'count': 0, 'seconds': 0.0, 'bytes': 0, 'retries': 0})
+        self.assertEqual(json.loads(stats.to_json())['phases']['transfer']['bytes'], 150)
+        self.assertIn('taskcluster_util_phase_bytes_total{phase="transfer"} 150', stats.to_prometheus())
+
+    def test_null_stats(self):
+        """
+        test the null stats record nothing
+        """
+        self.assertIs(create_stats(), NULL_STATS)
+        self.assertIsInstance(create_stats('json'), Stats)
+        stats = NullStats()
+        with stats.timer('transfer') as timer:
+            timer.bytes_count = 100
+        stats.add_retry('transfer')
+        self.assertFalse(stats.enabled)
+        self.assertEqual(stats.to_dict()['phases'], {})
+
+    def test_write(self):
+        """
+        test the stats file is written
+        """
+        stats = Stats()
+        stats.record('resolve', 0.25)
+        folder = tempfile.mkdtemp(prefix='test_stats_')
+        try:
+            path = os.path.join(folder, 'stats.prom')
+            stats.write('prometheus', path)
+            stats.write('prometheus', path)
+            with open(path) as fd:
+                self.assertIn('taskcluster_util_phase_seconds_total{phase="resolve"} 0.25', fd.read())
+            self.assertEqual(os.listdir(folder), ['stats.prom'])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_statsd(self):
+        """
+        test the StatsD exporter sends the metrics by UDP
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            stats = Stats(hooks=[StatsdExporter('127.0.0.1:{}'.format(server.getsockname()[1]), prefix='tc')])
+            stats.record('transfer', 0.002, 1024)
+            self.assertEqual(server.recv(1024), 'tc.transfer.time:2.000|ms\ntc.transfer.bytes:1024|c')
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
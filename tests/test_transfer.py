@@ -0,0 +1,220 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import io
+import os
+import zlib
+import tempfile
+import unittest
+from mock import patch
+from benchmarks.fake_taskcluster import Artifact, FakeTaskcluster, FakeTaskclusterServer
+from taskcluster_util.util import transfer
+from taskcluster_util.util.transfer import split_ranges, split_missing_ranges, ChunkReader, GzipDecoder, \
+    RangedFetcher, get_session, set_pool_maxsize, ensure_pool_maxsize, open_url, release_response
+
+
+def gzip_encode(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TransferTester(unittest.TestCase):
+
+    def test_split_ranges(self):
+        """
+        test split_ranges
+        """
+        self.assertEqual(split_ranges(0, 4), [])
+        self.assertEqual(split_ranges(10, 3, min_size=1), [(0, 3), (3, 6), (6, 10)])
+        # do not split into the ranges smaller than min_size
+        self.assertEqual(split_ranges(10, 4, min_size=5), [(0, 5), (5, 10)])
+        self.assertEqual(split_ranges(10, 4, min_size=20), [(0, 10)])
+        self.assertEqual(split_ranges(10, 2, min_size=1, offset=100), [(100, 105), (105, 110)])
+
+    def test_split_missing_ranges(self):
+        """
+        test split_missing_ranges
+        """
+        ret = split_missing_ranges([(0, 10), (20, 60)], 5, min_size=1)
+        self.assertEqual(ret, [(0, 10), (20, 30), (30, 40), (40, 50), (50, 60)])
+
+    def test_chunk_reader(self):
+        """
+        test ChunkReader with readinto and read streams
+        """
+        data = 'x' * 1000
+
+        class ReadOnlyStream(object):
+            def __init__(self):
+                self.stream = io.BytesIO(data)
+
+            def read(self, size):
+                return self.stream.read(size)
+
+        for stream in (io.BytesIO(data), ReadOnlyStream()):
+            reader = ChunkReader(stream, min_chunk_size=100, max_chunk_size=400)
+            result = ''
+            sizes = []
+            while True:
+                chunk = reader.read()
+                if not chunk:
+                    break
+                sizes.append(len(chunk))
+                result += chunk.tobytes() if isinstance(chunk, memoryview) else chunk
+            self.assertEqual(result, data)
+            # the chunk size grows up to the max size when reading fast
+            self.assertEqual(sizes, [100, 200, 400, 300])
+
+    def test_gzip_decoder(self):
+        """
+        test GzipDecoder with chunks and multiple gzip members
+        """
+        data = gzip_encode('foo' * 1000) + gzip_encode('bar')
+        decoder = GzipDecoder()
+        result = ''
+        for idx in range(0, len(data), 7):
+            result += decoder.decode(data[idx:idx + 7])
+        result += decoder.flush()
+        self.assertEqual(result, 'foo' * 1000 + 'bar')
+
+    def test_gzip_decoder_bounded(self):
+        """
+        test GzipDecoder decodes the highly compressed chunk into bounded pieces
+        """
+        size = GzipDecoder.MAX_DECODED_SIZE * 20 + 7
+        data = gzip_encode('\0' * size) + gzip_encode('bar')
+        decoder = GzipDecoder()
+        sizes = [len(piece) for piece in decoder.iter_decode(data)]
+        self.assertEqual(len(decoder.flush()), 0)
+        self.assertEqual(sum(sizes), size + 3)
+        self.assertLessEqual(max(sizes), GzipDecoder.MAX_DECODED_SIZE)
+
+    def test_ranged_fetcher_retry(self):
+        """
+        test RangedFetcher asks for the remaining bytes of the short range
+        """
+        data = ''.join(chr(idx % 256) for idx in range(1000))
+        requests = []
+
+        class FakeResponse(object):
+            status_code = 206
+
+            def __init__(self, start, end):
+                # the first response of each range is closed after 10 bytes
+                self.raw = io.BytesIO(data[start:start + 10] if start % 500 == 0 else data[start:end])
+                self.headers = {'Content-Range': 'bytes {}-{}/{}'.format(start, end - 1, len(data))}
+
+            def close(self):
+                self.raw.close()
+
+        def open_url(url, headers=None):
+            start, _, end = headers['Range'][len('bytes='):].partition('-')
+            response = FakeResponse(int(start), int(end) + 1)
+            requests.append((int(start), int(end) + 1))
+            return response
+
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, '\0' * len(data))
+            os.close(fd)
+            with patch('taskcluster_util.util.transfer.open_url', side_effect=open_url):
+                RangedFetcher('http://localhost/', path, [(0, 500), (500, 1000)], 2).run()
+            with open(path, 'rb') as local_fd:
+                self.assertEqual(local_fd.read(), data)
+            self.assertEqual(sorted(requests), [(0, 500), (10, 500), (500, 1000), (510, 1000)])
+
+            with patch('taskcluster_util.util.transfer.open_url', side_effect=open_url):
+                fetcher = RangedFetcher('http://localhost/', path, [(0, 500)], 1, retries=0)
+                self.assertRaises(Exception, fetcher.run)
+        finally:
+            os.remove(path)
+
+
+class SessionTester(unittest.TestCase):
+    """
+    Run the shared HTTP session against the local fake Taskcluster service.
+    """
+
+    def setUp(self):
+        self.artifact = Artifact('public/build/target.bin', size=256 * 1024)
+        service = FakeTaskcluster()
+        service.add_task('gecko.v2.latest', 'task-1', [self.artifact])
+        self.server = FakeTaskclusterServer(service).start()
+        self.url = '{}/blobs/task-1/public%2Fbuild%2Ftarget.bin'.format(self.server.base_url)
+        # a new session and pool size for each test
+        self.patches = [patch.object(transfer, '_session', None), patch.object(transfer, 'POOL_MAXSIZE', 32)]
+        for item in self.patches:
+            item.start()
+
+    def tearDown(self):
+        get_session().close()
+        for item in reversed(self.patches):
+            item.stop()
+        self.server.stop()
+
+    def _get_pool(self):
+        return get_session().get_adapter(self.url).poolmanager.connection_from_url(self.url)
+
+    def test_session_reused(self):
+        """
+        test the session and its keep-alive connection are reused by the fully read responses
+        """
+        session = get_session()
+        self.assertIs(get_session(), session)
+        for _ in range(3):
+            response = open_url(self.url)
+            self.assertEqual(response.raw.read(), self.artifact.read(0, self.artifact.size))
+            release_response(response)
+        self.assertEqual(self._get_pool().num_connections, 1)
+
+    def test_pool_maxsize(self):
+        """
+        test the pool size of session follows the parallel connections
+        """
+        self.assertEqual(get_session().get_adapter(self.url)._pool_maxsize, 32)
+        set_pool_maxsize(4)
+        self.assertEqual(get_session().get_adapter(self.url)._pool_maxsize, 4)
+        ensure_pool_maxsize(2)
+        self.assertEqual(get_session().get_adapter(self.url)._pool_maxsize, 4)
+        with patch('taskcluster.Queue'):
+            from taskcluster_util.util.downloader import Downloader
+            Downloader(connections=64, show_progress=False)
+        self.assertEqual(get_session().get_adapter(self.url)._pool_maxsize, 64)
+
+    def test_release_on_error(self):
+        """
+        test the partially read responses are closed, so the next requests do not read the remaining content,
+        and the responses of failed ranges are released
+        """
+        response = open_url(self.url)
+        response.raw.read(1000)
+        connection = response.raw._connection
+        release_response(response)
+        self.assertIsNone(connection.sock)
+        # the connection is kept alive after the full read
+        response = open_url(self.url, {'Range': 'bytes=0-9'})
+        connection = response.raw._connection
+        self.assertEqual(response.raw.read(), self.artifact.read(0, 10))
+        release_response(response)
+        self.assertIsNotNone(connection.sock)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with patch('taskcluster_util.util.transfer.copy_stream', side_effect=IOError('No space left on device')), \
+                    patch('taskcluster_util.util.transfer.release_response', wraps=release_response) as mock_release:
+                fetcher = RangedFetcher(self.url, path, [(0, 1000)], 1, retries=1)
+                self.assertRaises(IOError, fetcher.run)
+            self.assertEqual(mock_release.call_count, 2)
+            self.assertTrue(all(call[0][0].raw.closed for call in mock_release.call_args_list))
+        finally:
+            os.remove(path)
+        # the connection still works after the failed ranges
+        response = open_url(self.url, {'Range': 'bytes=10-19'})
+        self.assertEqual(response.raw.read(), self.artifact.read(10, 20))
+        release_response(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
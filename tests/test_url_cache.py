@@ -0,0 +1,40 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+import unittest
+from taskcluster_util.util.url_cache import SignedUrlCache
+
+
+class SignedUrlCacheTester(unittest.TestCase):
+
+    def test_margin(self):
+        """
+        test the url is not reused within the safety margin before expiration
+        """
+        cache = SignedUrlCache(margin=60)
+        cache.put('a', 'url_a', time.time() + 120)
+        cache.put('b', 'url_b', time.time() + 30)
+        self.assertEqual(cache.get('a'), 'url_a')
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+    def test_lru(self):
+        """
+        test the least recently used url is removed
+        """
+        cache = SignedUrlCache(max_size=2, margin=0)
+        expires = time.time() + 60
+        cache.put('a', 'url_a', expires)
+        cache.put('b', 'url_b', expires)
+        cache.get('a')
+        cache.put('c', 'url_c', expires)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 'url_a')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'url_c')
+
+
+if __name__ == '__main__':
+    unittest.main()